@@ -18,7 +18,7 @@ from exceptions import ImportError, OSError
 import matplotlib.pyplot as plt
 from example_utils import *
 import os
-from time import strftime
+from time import strftime, time, sleep
 
 modules = ("ps2000", "ps2000a", "ps3000", "ps3000a", "ps4000", "ps4000a", "ps5000a", "ps6000")
 TESTED = PASSED = FAILED = IGNORED = 0
@@ -533,51 +533,53 @@ def main():
             go_on = True
             total_samples = 0
             triggered = -1
+            seen = 0
+            """ follows the record metadata only, the samples are read at once when the chapter is done """
+            deadline = time() + wait4data
             while go_on:
-                record = tape.play_next(chapter=chapter, wait=True, timeout=wait4data)
-                if record is not None and hasattr(record, "buffers"):
-                    if options.autostop and hasattr(record, "final") and record.final:
-                        go_on = False
-                    top_to = total_samples + record.samples
-                    for c in channels:
-                        for m in num_modes:
-                            l = ps.m.RatioModes.labels[m]
-                            if top_to <= options.max_samples:
-                                if m == ps.m.RatioModes.agg:
-                                    buffers[c]["min"][total_samples:top_to] =\
-                                        record.buffers[c]["min"][record.start:record.samples]
-                                    buffers[c]["max"][total_samples:top_to] =\
-                                        record.buffers[c]["max"][record.start:record.samples]
-                                else:
-                                    buffers[c][l][total_samples:top_to] =\
-                                        record.buffers[c][l][record.start:record.samples]
-                            else:
-                                if m == ps.m.RatioModes.agg:
-                                    buffers[c]["min"] = np.append(buffers[c]["min"][:total_samples],
-                                                                  record.buffers[c]["min"][record.start:record.samples])
-                                    buffers[c]["max"] = np.append(buffers[c]["max"][:total_samples],
-                                                                  record.buffers[c]["max"][record.start:record.samples])
-                                else:
-                                    buffers[c][l] = np.append(buffers[c][l][:total_samples],
-                                                              record.buffers[c][l][record.start:record.samples])
-                    if options.trigger and record.triggerSet:
-                        if record.triggered:
-                            triggered = total_samples + record.triggerAt
-                            if go_on and top_to >= triggered + options.max_samples * (1 - (options.triggh % 1)):
-                                go_on = False
-                                ps.stop_recording()
-                        elif go_on and triggered >= 0 \
+                rows, ended = tape.chapter_index(chapter=chapter, start=seen)
+                if rows is None:
+                    p_error("Streaming playback interrupted")
+                for row in rows:
+                    top_to = total_samples + int(row["samples"])
+                    if options.trigger:
+                        if row["triggered"]:
+                            triggered = total_samples + int(row["triggerAt"])
+                        if go_on and triggered >= 0 \
                                 and top_to >= triggered + options.max_samples * (1 - (options.triggh % 1)):
                             go_on = False
                             ps.stop_recording()
                     elif go_on and top_to >= options.max_samples:
-                                go_on = False
-                                ps.stop_recording()
-                    total_samples += record.samples
-                else:
+                        go_on = False
+                        ps.stop_recording()
+                    total_samples = top_to
+                seen += len(rows)
+                if ended:
                     go_on = False
+                elif len(rows) > 0:
+                    deadline = time() + wait4data
+                elif time() > deadline:
                     p_error("Streaming playback interrupted")
+                else:
+                    sleep(0.01)
             tape.wait2finish()
+            rows, ended = tape.chapter_index(chapter=chapter, start=seen)
+            if rows is not None:
+                total_samples += int(rows["samples"].sum())
+            rows, ended = tape.chapter_index(chapter=chapter)
+            first = int(rows["offset"][0]) if rows is not None and len(rows) > 0 else 0
+            if first > 0:
+                p_warn("First %d samples evicted by the tape retention, %d samples kept"
+                       % (first, total_samples - first))
+            if total_samples - first > options.max_samples:
+                for c in channels:
+                    for l in buffers[c].keys():
+                        if isinstance(buffers[c][l], np.ndarray):
+                            buffers[c][l] = np.empty(shape=(total_samples - first, ), dtype=ps.m.ctypes.c_int16)
+            read, buffers = tape.read_range(chapter=chapter, start=first, count=total_samples - first,
+                                            channels=channels, out=buffers)
+            if read < total_samples - first:
+                p_error("Streaming playback incomplete, %d of %d samples read" % (read, total_samples - first))
             if tape_file is not None:
                 stats = tape.pull_stats()
                 if stats is not None and isinstance(stats, dict):
@@ -586,6 +588,13 @@ def main():
                     for s in stats.keys():
                         sum_d += stats[s]["data_len"]
                         sum_t += stats[s]["time"]
+                    codecs = tape.pull_processor_stats()["codecs"]
+                    if chapter in codecs:
+                        for c in codecs[chapter]:
+                            pick = codecs[chapter][c]["pick"]
+                            p_info("Channel %s codec %s level %d: ratio %.2f, %.1fMB/s"
+                                   % (ps.m.Channels.labels[c] if c in ps.m.Channels.labels else c, pick["complib"],
+                                      pick["complevel"], pick["ratio"], pick["throughput"] / 1048576.0))
 
                     data_units = ["", "k", "M", "G", "T"]
                     data_total = 2.0 * sum_d
@@ -0,0 +1,653 @@
+#!/usr/bin/python
+"""
+ *     Filename: tape_benchmark.py
+ *
+ *	   Description:
+ *			Streaming tape performance tests run on synthetic records,
+ *			no PicoScope oscilloscope is required.
+ *
+ *    Copyright (C) 2014 - 2018 Pico Technology Ltd. See LICENSE file for terms.
+ *
+"""
+from optparse import OptionParser, OptionGroup
+from example_utils import *
+from picosdk.psutils import StreamingTape, StreamingTapeRecording, StreamingTapeRing, StreamingTapeRecordPool, \
+    StreamingTapeFanout, read_chapter_range, chapter_summary, summary_exceeding, map_chapter
+from picosdk.tapetools import compact_tape, TapeReplay
+from picosdk.tapenet import StreamingTapePublisher, StreamingTapeSubscriber
+import threading as th
+import multiprocessing
+import tables as tb
+import numpy as np
+import tempfile
+import shutil
+import os
+from time import time, strftime, sleep
+try:
+    import trollius
+    from trollius import From
+except ImportError:
+    trollius = None
+
+benchmarks = ("transport", "latency", "workers", "compaction", "journal", "replay",
+              "precondition", "pool", "fanout", "network", "cursors", "summary", "map", "rollover")
+
+
+def _options():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-B", "--benchmarks",
+                      action="store", type="string", dest="benchmarks",
+                      metavar="NAMES", default=",".join(benchmarks),
+                      help="Comma separated list of benchmarks to run.\t"
+                           "default: %default")
+    parser.add_option("-O", "--output",
+                      action="store", type="string", dest="output",
+                      metavar="DIR", default="",
+                      help="Directory for the tape files.\t\t\t"
+                           "default: temporary directory")
+
+    group = OptionGroup(parser, "Records Options")
+    group.add_option("-c", "--channels",
+                     action="store", type="int", dest="channels",
+                     metavar="COUNT", default=4,
+                     help="Number of channels in each record.\t\t"
+                          "default: %default")
+    group.add_option("-s", "--samples",
+                     action="store", type="int", dest="samples",
+                     metavar="COUNT", default=100000,
+                     help="Number of samples per channel in each record.\t"
+                          "default: %default")
+    group.add_option("-n", "--records",
+                     action="store", type="int", dest="records",
+                     metavar="COUNT", default=200,
+                     help="Number of records to stream.\t\t\t"
+                          "default: %default")
+    group.add_option("-S", "--signal",
+                     action="store", type="string", dest="signal",
+                     metavar="TYPE", default="sine",
+                     help="Synthetic signal, sine or noise.\t\t\t"
+                          "default: %default")
+    group.add_option("-R", "--resolution",
+                     action="store", type="int", dest="resolution",
+                     metavar="BITS", default=12,
+                     help="Device resolution, lower bits of the samples are zero.\t"
+                          "default: %default")
+    parser.add_option_group(group)
+
+    return parser
+
+
+def make_record(chapter, channels, samples, signal="sine"):
+    """ Builds a record looking like the ones created by the streaming callbacks """
+    rec = StreamingTapeRecording()
+    rec.chapter = chapter
+    rec.device = "synthetic"
+    rec.serial = "bench"
+    rec.interval = 10
+    rec.units = 2
+    rec.mode = 0
+    rec.downsample = 1
+    rec.enabled = channels
+    rec.triggerSet = False
+    rec.bufflen = samples
+    rec.samples = samples
+    rec.start = 0
+    rec.timestamp = time()
+    rec.buffers = {}
+    t = np.arange(samples)
+    for c in range(channels):
+        if signal == "noise":
+            data = np.random.randint(-32512, 32512, size=samples)
+        else:
+            data = 24000 * np.sin(2 * np.pi * (t + 250 * c) / 1000.0) + np.random.normal(0, 40, size=samples)
+        rec.buffers[c] = {"range": 7, "scale": 2.0, "overflow": False, "raw": data.astype(np.int16)}
+    return rec
+
+
+def human(value):
+    units = ["", "k", "M", "G", "T"]
+    unit = 0
+    while value > 1000 and unit < 4:
+        value /= 1024.0
+        unit += 1
+    return "%.2f%s" % (value, units[unit])
+
+
+def cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+
+def wait_written(tape, count, timeout=600.0):
+    """ Waits for the processor to report count records written, requires tape with stats """
+    timeout += time()
+    while time() < timeout:
+        stats = tape.pull_stats()
+        if stats is not None and len(stats) >= count:
+            return True
+        sleep(0.01)
+    return False
+
+
+def stream(tape, rec, count):
+    """ Streams count copies of the record
+    :returns: producer cpu time and wall time until all records are written
+    """
+    start = time()
+    cpu = cpu_time()
+    for i in range(count):
+        rec.timestamp = time()
+        tape.record(rec)
+    tape.record(None)
+    tape.wait2finish(timeout=0)
+    if not wait_written(tape, count):
+        p_warn("Not all records written in time")
+    return cpu_time() - cpu, time() - start
+
+
+def bench_transport(options, outdir):
+    rec = make_record("transport", options.channels, options.samples, options.signal)
+    total = options.records * options.channels * options.samples * rec.buffers[0]["raw"].itemsize
+    slot = options.channels * options.samples * rec.buffers[0]["raw"].itemsize + StreamingTapeRing.header
+    for transport in ("queue", "ring"):
+        tape = StreamingTape(filename=os.path.join(outdir, "transport_%s.h5" % transport),
+                             stats=True, transport=transport, ring_slots=16, ring_slot_size=slot)
+        try:
+            cpu, wall = stream(tape, rec, options.records)
+        finally:
+            tape.close()
+        p_info("Transport %s: %sB/s written, %sB per producer cpu second"
+               % (transport, human(total / wall), human(total / max(cpu, 1e-6))))
+
+
+def bench_latency(options, outdir):
+    tape = StreamingTape(filename=os.path.join(outdir, "latency.h5"), stats=True)
+    try:
+        idle = 2.0
+        cpu = cpu_time()
+        proc = tape.pull_processor_stats()["cpu"]
+        sleep(idle)
+        proc = tape.pull_processor_stats()["cpu"] - proc
+        cpu = cpu_time() - cpu
+        p_info("Idle cpu load: processor %.2f%%, tape owner %.2f%%" % (100.0 * proc / idle, 100.0 * cpu / idle))
+
+        rec = make_record("latency", options.channels, min(options.samples, 1000), options.signal)
+        for i in range(options.records):
+            rec.timestamp = time()
+            tape.record(rec)
+            sleep(0.01)
+        if not wait_written(tape, options.records):
+            p_warn("Not all records written in time")
+        stats = tape.pull_stats()
+        latency = np.array([stats[k]["latency"] for k in stats.keys()]) * 1000.0
+        p_info("Record to disk latency: mean %.3fms, median %.3fms, max %.3fms"
+               % (latency.mean(), np.median(latency), latency.max()))
+    finally:
+        tape.close()
+
+
+def bench_workers(options, outdir):
+    rec = make_record("workers", options.channels, options.samples, options.signal)
+    total = options.records * options.channels * options.samples * rec.buffers[0]["raw"].itemsize
+    slot = options.channels * options.samples * rec.buffers[0]["raw"].itemsize + StreamingTapeRing.header
+    for workers in (0, 1, 2, 4):
+        filename = os.path.join(outdir, "workers_%d.h5" % workers)
+        tape = StreamingTape(filename=filename, stats=True, transport="ring", ring_slots=16, ring_slot_size=slot,
+                             compression={"complib": "blosc:lz4", "complevel": 5}, workers=workers)
+        try:
+            cpu, wall = stream(tape, rec, options.records)
+            stats = tape.pull_processor_stats()
+        finally:
+            tape.close()
+        p_info("Workers %d: %sB/s written, file %sB" % (workers, human(total / wall), human(os.path.getsize(filename))))
+        if "workers" in stats:
+            for pid, w in stats["workers"].items():
+                p_info("    worker %d: %d records, %.1f%% busy" % (pid, w["tasks"], 100.0 * w["utilisation"]))
+
+
+def count_nodes(tape, group):
+    nodes = 1
+    for node in tape.iterNodes(group):
+        nodes += count_nodes(tape, node) if isinstance(node, tb.Group) else 1
+    return nodes
+
+
+def read_chapter(filename, chapter, block=4194304):
+    """ Reads the whole chapter block by block
+    :returns: number of samples read, wall time and number of nodes in the file
+    """
+    start = time()
+    total = 0
+    with tb.openFile(filename, mode="r") as tape:
+        group = tape.getNode("/", chapter, "Group")
+        while True:
+            count, buffers = read_chapter_range(group, total, block)
+            if count == 0:
+                break
+            total += count
+        nodes = count_nodes(tape, tape.root)
+    return total, time() - start, nodes
+
+
+def bench_compaction(options, outdir):
+    samples = min(options.samples, 1000)
+    count = options.records * max(options.samples / samples, 1)
+    rec = make_record("compaction", options.channels, samples, options.signal)
+    filename = os.path.join(outdir, "compaction.h5")
+    tape = StreamingTape(filename=filename, stats=True, layout=1)
+    try:
+        stream(tape, rec, count)
+    finally:
+        tape.close()
+    compacted = os.path.join(outdir, "compaction_compact.h5")
+    start = time()
+    compact_tape(filename, compacted, compression={"complib": "blosc:zstd", "complevel": 5, "chunkshape": 262144})
+    p_info("Compacted %d records of %d samples in %.2fs" % (count, samples, time() - start))
+    for name, path in (("original", filename), ("compacted", compacted)):
+        total, wall, nodes = read_chapter(path, "compaction")
+        size = total * options.channels * rec.buffers[0]["raw"].itemsize
+        p_info("Read %s: %sB/s, file %sB, %d nodes"
+               % (name, human(size / max(wall, 1e-6)), human(os.path.getsize(path)), nodes))
+
+
+def bench_journal(options, outdir):
+    rec = make_record("journal", options.channels, options.samples, options.signal)
+    total = options.records * options.channels * options.samples * rec.buffers[0]["raw"].itemsize
+    for name, journal in (("off", None), ("1s", {"seconds": 1.0}), ("every record", {"records": 1})):
+        tape = StreamingTape(filename=os.path.join(outdir, "journal.h5"), stats=True, journal=journal)
+        try:
+            cpu, wall = stream(tape, rec, options.records)
+            stats = tape.pull_processor_stats()
+        finally:
+            tape.close()
+        line = "Journal %s: %sB/s written" % (name, human(total / wall))
+        if "journal" in stats:
+            line += ", %d flushes taking %.1f%% of the time" % (stats["journal"]["flushes"],
+                                                               100.0 * stats["journal"]["time"] / wall)
+        p_info(line)
+
+
+def bench_replay(options, outdir):
+    rec = make_record("replay", options.channels, options.samples, options.signal)
+    total = options.records * options.channels * options.samples * rec.buffers[0]["raw"].itemsize
+    source = os.path.join(outdir, "replay.h5")
+    tape = StreamingTape(filename=source, stats=True)
+    try:
+        stream(tape, rec, options.records)
+    finally:
+        tape.close()
+    for speed in (0, 1.0):
+        replay = TapeReplay(source, "replay", speed=speed)
+        tape = StreamingTape(filename=os.path.join(outdir, "replay_%g.h5" % speed), stats=True)
+        try:
+            replay.load_tape(tape)
+            start = time()
+            replay.start_recording(chapter="replayed")
+            replay.wait2finish()
+            tape.wait2finish(timeout=0)
+            if not wait_written(tape, options.records):
+                p_warn("Not all records written in time")
+            wall = time() - start
+        finally:
+            tape.close()
+        stats = replay.replay_stats()
+        p_info("Replay at %s: %sB/s through the tape, %d records, worst lag %.3fms"
+               % ("full speed" if speed == 0 else "%gx" % speed, human(total / wall), stats["records"],
+                  1000.0 * stats["lag"]))
+
+
+def bench_precondition(options, outdir):
+    count = min(options.records, 50)
+    mask = ~np.int16((1 << max(16 - options.resolution, 0)) - 1)
+    for signal in ("sine", "noise"):
+        """ distinct records, so that the codec does not find the repeated ones """
+        records = [make_record("precondition", options.channels, options.samples, signal) for i in range(4)]
+        for rec in records:
+            for c in rec.buffers:
+                rec.buffers[c]["raw"] &= mask
+        total = count * options.channels * options.samples * records[0].buffers[0]["raw"].itemsize
+        for stages in (None, ("delta", ), ("shift", ), ("shift", "delta")):
+            for bitshuffle in (False, True):
+                filename = os.path.join(outdir, "precondition.h5")
+                tape = StreamingTape(filename=filename, stats=True, layout=2, precondition=stages,
+                                     compression={"complib": "blosc:lz4", "complevel": 5,
+                                                  "shuffle": not bitshuffle, "bitshuffle": bitshuffle})
+                try:
+                    start = time()
+                    for i in range(count):
+                        tape.record(records[i % len(records)])
+                    tape.record(None)
+                    tape.wait2finish(timeout=0)
+                    if not wait_written(tape, count):
+                        p_warn("Not all records written in time")
+                    wall = time() - start
+                finally:
+                    tape.close()
+                p_info("%s %d bits, %s, %s: %sB/s, ratio %.2f"
+                       % (signal, options.resolution, "+".join(stages) if stages else "no stages",
+                          "bitshuffle" if bitshuffle else "shuffle", human(total / wall),
+                          float(total) / os.path.getsize(filename)))
+
+
+def callbacks(driver, sizes, count, pool, tape):
+    """ Replays the streaming callback bookkeeping of the devices, full records handed to the tape
+    :returns: wall time of count callbacks
+    """
+    leavers = None
+    start = time()
+    for i in range(count):
+        driver.samples = sizes[i % len(sizes)]
+        driver.start = (driver.start + driver.samples) % (driver.bufflen - driver.samples)
+        if leavers is not None:
+            left = leavers.top_up(driver, pool)
+            if leavers.bufflen == leavers.samples:
+                tape.record(leavers)
+                if pool is not None:
+                    pool.release(leavers)
+                leavers = left
+        else:
+            leavers = driver.side_copy(pool)
+    tape.record(None)
+    tape.wait2finish(timeout=0)
+    return time() - start
+
+
+def bench_pool(options, outdir):
+    driver = make_record("pool", options.channels, options.samples, options.signal)
+    driver.bufflen = options.samples
+    """ callbacks of uneven sizes, so that most of them spill over the record boundary """
+    sizes = [max(options.samples // d, 1) for d in (3, 5, 2, 7, 4)]
+    count = 20 * options.records
+    total = sum([sizes[i % len(sizes)] for i in range(count)]) * options.channels * driver.buffers[0]["raw"].itemsize
+    for name, pool in (("fresh buffers", StreamingTapeRecordPool(size=0)), ("record pool", StreamingTapeRecordPool())):
+        """ the queue transport copies each full record once more, from the pool of the tape """
+        tape = StreamingTape(None, retention={"records": 10})
+        try:
+            wall = callbacks(driver, sizes, count, pool, tape)
+            copies = tape.copy_stats()
+        finally:
+            tape.close()
+        p_info("%s: %d callbacks/s, %sB/s copied, %d buffer allocations/s, %d records reused, "
+               "tape copies %d buffer allocations/s, %d records reused"
+               % (name, count / wall, human(total / wall), pool.stats["allocated"] / wall, pool.stats["reused"],
+                  copies["allocated"] / wall, copies["reused"]))
+
+
+def bench_fanout(options, outdir):
+    rec = make_record("fanout", options.channels, options.samples, options.signal)
+    """ slow disk sink blocking on its short queue next to the live window dropping its oldest records """
+    disk = StreamingTape(filename=os.path.join(outdir, "fanout.h5"), layout=2, queue_size=4,
+                         compression={"complib": "zlib", "complevel": 9})
+    live = StreamingTape(None, retention={"records": 10}, queue_size=4, overload="drop_oldest")
+    fanout = StreamingTapeFanout({"disk": disk, "live": live})
+    try:
+        start = time()
+        for i in range(options.records):
+            rec.timestamp = time()
+            fanout.record(rec)
+        fanout.record(None)
+        p_info("Records handed to the fan-out in %.3fs" % (time() - start))
+        fanout.wait2finish(timeout=0)
+        stats = fanout.sink_stats()
+    finally:
+        fanout.close()
+    for name in sorted(stats.keys()):
+        s = stats[name]
+        p_info("    %s: %d records, %sB/s, lag mean %.3fms max %.3fms, %d dropped by the sink"
+               % (name, s["records"], human(s["throughput"]), 1000.0 * s["lag"], 1000.0 * s["max_lag"],
+                  s["overload"]["dropped"]))
+
+
+def subscribe(address, delay, results):
+    """ Receives records until the chapter end, sleeping delay seconds after each to play a slow subscriber """
+    subscriber = StreamingTapeSubscriber(address)
+    out = {}
+    records = 0
+    start = time()
+    while True:
+        rec = subscriber.receive(out)
+        if rec is None or len(rec.buffers) == 0:
+            break
+        out = rec.buffers
+        records += 1
+        sleep(delay)
+    results.append((delay, records, subscriber.lost, time() - start))
+    subscriber.close()
+
+
+def bench_network(options, outdir):
+    rec = make_record("network", options.channels, options.samples, options.signal)
+    size = options.channels * options.samples * rec.buffers[0]["raw"].itemsize
+    for address in (("127.0.0.1", 0), os.path.join(outdir, "network.sock")):
+        publisher = StreamingTapePublisher(address, queue_size=16)
+        results = []
+        threads = [th.Thread(target=subscribe, args=(publisher.address, delay, results)) for delay in (0, 0, 0.05)]
+        try:
+            for t in threads:
+                t.start()
+            publisher.wait4subscribers(len(threads))
+            start = time()
+            for i in range(options.records):
+                rec.timestamp = time()
+                publisher.record(rec)
+            publisher.record(None)
+            publisher.wait2finish(timeout=0)
+            wall = time() - start
+        finally:
+            publisher.close()
+            for t in threads:
+                t.join()
+        p_info("%s: %d records published, all queues drained in %.3fs"
+               % ("TCP loopback" if isinstance(address, tuple) else "Unix socket", options.records, wall))
+        for delay, records, lost, elapsed in sorted(results):
+            p_info("    %s subscriber: %d records, %sB/s, %d lost"
+                   % ("slow" if delay > 0 else "fast", records, human(records * size / elapsed), lost))
+
+
+def read_cursors(tape, chapter, size):
+    """ Reads the chapter with 1, 2 and 4 cursors at once, each in its own thread """
+    for readers in (1, 2, 4):
+        counts = []
+
+        def read(cursor):
+            counts.append(len([r for r in cursor]))
+            cursor.close()
+        cursors = [tape.cursor(chapter) for i in range(readers)]
+        threads = [th.Thread(target=read, args=(cursor, )) for cursor in cursors]
+        start = time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time() - start
+        p_info("    %d cursors: %d records each, %sB/s in total, %sB/s per cursor"
+               % (readers, min(counts), human(sum(counts) * size / wall), human(min(counts) * size / wall)))
+
+
+def bench_cursors(options, outdir):
+    rec = make_record("cursors", options.channels, options.samples, options.signal)
+    size = options.channels * options.samples * rec.buffers[0]["raw"].itemsize
+    tape = StreamingTape(filename=os.path.join(outdir, "cursors.h5"), stats=True, layout=2,
+                         compression={"complib": "blosc:lz4", "complevel": 5})
+    try:
+        stream(tape, rec, options.records)
+        start = time()
+        count = 0
+        while tape.play_next("cursors", wait=False) is not None:
+            count += 1
+        p_info("play_next: %d records, %sB/s" % (count, human(count * size / (time() - start))))
+        """ the processor serves one cursor request at a time, the rate is shared rather than multiplied """
+        p_info("Cursors read by the processor:")
+        read_cursors(tape, "cursors", size)
+    finally:
+        tape.close()
+    """ the closed files of the rolling tape are read by the reader processes, the rate scales with them """
+    tape = StreamingTape(filename=os.path.join(outdir, "cursors_rolling.h5"), stats=True, layout=2,
+                         compression={"complib": "blosc:lz4", "complevel": 5},
+                         rollover={"records": max(options.records // 8, 1)}, readers=4)
+    try:
+        rec.timestamp = time()
+        for i in range(options.records):
+            tape.record(rec)
+        tape.record(None)
+        tape.wait2finish(timeout=0)
+        p_info("Cursors of the rolling tape read by 4 reader processes:")
+        read_cursors(tape, "cursors", size)
+    finally:
+        tape.close()
+
+
+def bench_summary(options, outdir):
+    rec = make_record("summary", options.channels, options.samples, options.signal)
+    total = options.records * options.channels * options.samples * rec.buffers[0]["raw"].itemsize
+    filename = os.path.join(outdir, "summary.h5")
+    for summary in (False, True):
+        tape = StreamingTape(filename=filename, stats=True, layout=2, summary=summary)
+        try:
+            cpu, wall = stream(tape, rec, options.records)
+        finally:
+            tape.close()
+        p_info("Summary %s: %sB/s written" % ("on" if summary else "off", human(total / wall)))
+    level = 1.4
+    start = time()
+    with tb.openFile(filename, mode="r") as tape:
+        group = tape.getNode("/", "summary", "Group")
+        scanned = set()
+        offset = 0
+        while True:
+            count, buffers = read_chapter_range(group, offset, options.samples)
+            if count == 0:
+                break
+            for line in buffers:
+                if np.abs(buffers[line]["raw"].astype(np.int32)).max() * 2.0 / 32512 > level:
+                    scanned.add(offset // options.samples)
+            offset += count
+    scan = time() - start
+    start = time()
+    with tb.openFile(filename, mode="r") as tape:
+        rows = chapter_summary(tape.getNode("/", "summary", "Group"))
+        found = summary_exceeding(rows, level) if rows is not None else None
+    query = time() - start
+    if found is None or set(found) != scanned:
+        p_warn("Summary query found %s records, sample scan %d" % ("no" if found is None else len(found), len(scanned)))
+    p_info("Records above %.1fV: sample scan %.3fs, summary query %.3fs" % (level, scan, query))
+
+
+def band_power(part):
+    """ Map function of the map benchmark, spectral power of every line in the partition """
+    power = {}
+    for line in part.buffers:
+        data = part.buffers[line]["raw"].astype(np.float64)
+        power[line] = float(np.sum(np.abs(np.fft.rfft(data)) ** 2))
+    return power
+
+
+def add_power(total, power):
+    return dict([(line, total.get(line, 0.0) + power[line]) for line in power])
+
+
+def bench_map(options, outdir):
+    rec = make_record("map", options.channels, options.samples, options.signal)
+    total = options.records * options.channels * options.samples * rec.buffers[0]["raw"].itemsize
+    filename = os.path.join(outdir, "map.h5")
+    tape = StreamingTape(filename=filename, stats=True, layout=2,
+                         compression={"complib": "blosc:zstd", "complevel": 5})
+    try:
+        stream(tape, rec, options.records)
+        start = time()
+        tape.map(band_power, "map", workers=2, reduce=add_power, initial={})
+        p_info("Map of the open tape with 2 workers: %sB/s" % human(total / (time() - start)))
+        """ the processor reopens the file after the map, recording goes on in the next chapter """
+        rec.chapter = "map_after"
+        stream(tape, rec, options.records)
+        rec.chapter = "map"
+    finally:
+        tape.close()
+    p_info("%d CPUs available" % multiprocessing.cpu_count())
+    single = None
+    for workers in (0, 1, 2, 4):
+        start = time()
+        map_chapter(filename, "map", band_power, workers=workers, reduce=add_power, initial={})
+        wall = time() - start
+        single = wall if single is None else single
+        p_info("Map with %d workers: %sB/s, %.2fx the calling process" % (workers, human(total / wall), single / wall))
+
+
+def bench_rollover(options, outdir):
+    if trollius is None:
+        p_warn("trollius not installed, asynchronous reader skipped")
+        return
+    rec = make_record("rollover", options.channels, options.samples, options.signal)
+    size = options.channels * options.samples * rec.buffers[0]["raw"].itemsize
+    every = max(options.records // 4, 1)
+    tape = StreamingTape(filename=os.path.join(outdir, "rollover.h5"), layout=2,
+                         compression={"complib": "blosc:lz4", "complevel": 5},
+                         rollover={"records": every})
+    loop = trollius.new_event_loop()
+    indexes = []
+
+    def produce():
+        """ write stats restart with every file, the reader waits for the end of the chapter instead """
+        for i in range(options.records):
+            rec.timestamp = time()
+            tape.record(rec)
+        tape.record(None)
+
+    @trollius.coroutine
+    def consume():
+        reader = tape.aplay("rollover", loop=loop)
+        while True:
+            got = yield From(reader.next())
+            if got is None:
+                break
+            indexes.append(got.index)
+    try:
+        producer = th.Thread(target=produce)
+        start = time()
+        producer.start()
+        loop.run_until_complete(consume())
+        wall = time() - start
+        producer.join()
+        p_info("aplay, file rolled every %d records: %d of %d records, %sB/s" %
+               (every, len(indexes), options.records, human(len(indexes) * size / wall)))
+        if indexes != range(options.records):
+            p_warn("Asynchronous reader missed or repeated records across the files")
+        cursor = tape.cursor("rollover")
+        start = time()
+        count = len([r for r in cursor])
+        cursor.close()
+        p_info("cursor, file rolled every %d records: %d records, %sB/s"
+               % (every, count, human(count * size / (time() - start))))
+    finally:
+        loop.close()
+        tape.close()
+
+
+def main():
+    parser = _options()
+    (options, args) = parser.parse_args()
+
+    p_info("Tape benchmark started %s" % strftime("%Y-%m-%d %H:%M:%S"))
+    if options.output != "":
+        outdir = os.path.abspath(options.output)
+        if not os.path.isdir(outdir):
+            p_error("Output directory not found.")
+        cleanup = False
+    else:
+        outdir = tempfile.mkdtemp(prefix="tape_benchmark")
+        cleanup = True
+
+    selected = options.benchmarks.split(",")
+    for name in selected:
+        if name not in benchmarks:
+            p_error("Unknown benchmark %s" % name)
+    try:
+        for name in selected:
+            p_info("Running %s benchmark" % name)
+            globals()["bench_%s" % name](options, outdir)
+    finally:
+        if cleanup:
+            shutil.rmtree(outdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
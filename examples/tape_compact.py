@@ -0,0 +1,84 @@
+#!/usr/bin/python
+"""
+ *     Filename: tape_compact.py
+ *
+ *	   Description:
+ *			Rewrites streaming tapes made of many small records into
+ *			large contiguous chunks with the chosen compression.
+ *
+ *    Copyright (C) 2014 - 2018 Pico Technology Ltd. See LICENSE file for terms.
+ *
+"""
+from optparse import OptionParser
+from example_utils import *
+from picosdk.tapetools import compact_tape
+import os
+from time import time
+
+
+def _options():
+    parser = OptionParser(usage="usage: %prog [options] TAPE")
+    parser.add_option("-O", "--output",
+                      action="store", type="string", dest="output",
+                      metavar="FILE", default="",
+                      help="Compacted tape file name.\t\t\t"
+                           "default: TAPE_compact.h5")
+    parser.add_option("-c", "--chapters",
+                      action="store", type="string", dest="chapters",
+                      metavar="NAMES", default="",
+                      help="Comma separated list of chapters to compact.\t"
+                           "default: all")
+    parser.add_option("-L", "--complib",
+                      action="store", type="string", dest="complib",
+                      metavar="NAME", default="blosc:zstd",
+                      help="PyTables compression library.\t\t"
+                           "default: %default")
+    parser.add_option("-C", "--complevel",
+                      action="store", type="int", dest="complevel",
+                      metavar="LEVEL", default=5,
+                      help="Compression level 0-9.\t\t\t"
+                           "default: %default")
+    parser.add_option("-k", "--chunkshape",
+                      action="store", type="int", dest="chunkshape",
+                      metavar="SAMPLES", default=262144,
+                      help="Number of samples in each stored chunk.\t\t"
+                           "default: %default")
+    parser.add_option("-b", "--block",
+                      action="store", type="int", dest="block",
+                      metavar="SAMPLES", default=4194304,
+                      help="Number of samples read at once.\t\t"
+                           "default: %default")
+    parser.add_option("-w", "--workers",
+                      action="store", type="int", dest="workers",
+                      metavar="COUNT", default=0,
+                      help="Number of reading processes.\t\t\t"
+                           "default: %default")
+    return parser
+
+
+def main():
+    parser = _options()
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Tape file name required")
+    if not os.path.isfile(args[0]):
+        p_error("Tape %s not found" % args[0])
+    output = options.output if options.output != "" else "%s_compact.h5" % os.path.splitext(args[0])[0]
+    if os.path.abspath(output) == os.path.abspath(args[0]):
+        p_error("Output must differ from the source tape")
+
+    chapters = options.chapters.split(",") if options.chapters != "" else None
+    compression = {"complib": options.complib, "complevel": options.complevel, "chunkshape": options.chunkshape}
+    start = time()
+    try:
+        summary = compact_tape(args[0], output, compression=compression, chapters=chapters,
+                               block=options.block, workers=options.workers)
+    except ValueError as ex:
+        p_error(ex.message)
+    p_info("Tape compacted in %.2fs, %d bytes to %d bytes"
+           % (time() - start, os.path.getsize(args[0]), os.path.getsize(output)))
+    for chapter in sorted(summary.keys()):
+        p_info("    %s: %d records, %d samples" % (chapter, summary[chapter]["records"], summary[chapter]["samples"]))
+
+if __name__ == "__main__":
+    main()
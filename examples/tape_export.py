@@ -0,0 +1,101 @@
+#!/usr/bin/python
+"""
+ *     Filename: tape_export.py
+ *
+ *	   Description:
+ *			Converts streaming tape chapters into npy, raw, Parquet,
+ *			Arrow or WAV files readable without the tape layout knowledge.
+ *
+ *    Copyright (C) 2014 - 2018 Pico Technology Ltd. See LICENSE file for terms.
+ *
+"""
+from optparse import OptionParser
+from example_utils import *
+from picosdk.tapetools import export_chapter, FORMATS
+import tables as tb
+import os
+from time import time
+
+
+def _options():
+    parser = OptionParser(usage="usage: %prog [options] TAPE")
+    parser.add_option("-c", "--chapters",
+                      action="store", type="string", dest="chapters",
+                      metavar="NAMES", default="",
+                      help="Comma separated list of chapters to export.\t"
+                           "default: all")
+    parser.add_option("-O", "--output",
+                      action="store", type="string", dest="output",
+                      metavar="DIR", default=".",
+                      help="Directory for the exported files.\t\t"
+                           "default: %default")
+    parser.add_option("-f", "--formats",
+                      action="store", type="string", dest="formats",
+                      metavar="NAMES", default="npy",
+                      help="Comma separated list of %s.\t"
+                           "default: %%default" % ", ".join(FORMATS))
+    parser.add_option("-l", "--lines",
+                      action="store", type="string", dest="lines",
+                      metavar="LIST", default="",
+                      help="Comma separated channels/ports (port n as 128+n).\t"
+                           "default: all")
+    parser.add_option("-m", "--modes",
+                      action="store", type="string", dest="modes",
+                      metavar="NAMES", default="",
+                      help="Comma separated buffer modes (raw, min, max, avg, dec).\t"
+                           "default: all")
+    parser.add_option("-V", "--volts",
+                      action="store_true", dest="volts", default=False,
+                      help="Convert channel samples to volts.\t\t"
+                           "default: %default")
+    parser.add_option("-A", "--max-adc",
+                      action="store", type="int", dest="max_adc",
+                      metavar="COUNT", default=None,
+                      help="ADC count of the full scale for the volts conversion.\t"
+                           "default: from tape")
+    parser.add_option("-b", "--block",
+                      action="store", type="int", dest="block",
+                      metavar="SAMPLES", default=1048576,
+                      help="Number of samples read at once.\t\t"
+                           "default: %default")
+    parser.add_option("-w", "--workers",
+                      action="store", type="int", dest="workers",
+                      metavar="COUNT", default=0,
+                      help="Number of decompression processes.\t\t"
+                           "default: %default")
+    return parser
+
+
+def main():
+    parser = _options()
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Tape file name required")
+    if not os.path.isfile(args[0]):
+        p_error("Tape %s not found" % args[0])
+    if not os.path.isdir(options.output):
+        p_error("Output directory not found.")
+
+    if options.chapters != "":
+        chapters = options.chapters.split(",")
+    else:
+        with tb.openFile(args[0], mode="r") as tape:
+            chapters = [node._v_name for node in tape.iterNodes("/", classname="Group")]
+    lines = tuple([int(l) for l in options.lines.split(",")]) if options.lines != "" else None
+    modes = tuple(options.modes.split(",")) if options.modes != "" else None
+
+    for chapter in chapters:
+        start = time()
+        try:
+            names = export_chapter(args[0], chapter, options.output, formats=tuple(options.formats.split(",")),
+                                   channels=lines, modes=modes, volts=options.volts, block=options.block,
+                                   workers=options.workers, max_adc=options.max_adc)
+        except (ValueError, ImportError) as ex:
+            p_error("Chapter %s: %s" % (chapter, ex.message))
+        size = sum([os.path.getsize(n) for n in names])
+        p_info("Chapter %s exported in %.2fs, %d files, %d bytes" % (chapter, time() - start, len(names), size))
+        for name in names:
+            p_info("    %s" % name)
+
+if __name__ == "__main__":
+    main()
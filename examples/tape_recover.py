@@ -0,0 +1,63 @@
+#!/usr/bin/python
+"""
+ *     Filename: tape_recover.py
+ *
+ *	   Description:
+ *			Salvages records of streaming tapes left unclosed by a crash,
+ *			using the journal written by tapes opened with journal option.
+ *
+ *    Copyright (C) 2014 - 2018 Pico Technology Ltd. See LICENSE file for terms.
+ *
+"""
+from optparse import OptionParser
+from example_utils import *
+from picosdk.tapetools import recover_tape
+from picosdk.psutils import journal_name
+import os
+from time import time
+
+
+def _options():
+    parser = OptionParser(usage="usage: %prog [options] TAPE")
+    parser.add_option("-O", "--output",
+                      action="store", type="string", dest="output",
+                      metavar="FILE", default="",
+                      help="Recovered tape file name.\t\t\t"
+                           "default: TAPE_recovered.h5")
+    parser.add_option("-j", "--journal",
+                      action="store", type="string", dest="journal",
+                      metavar="FILE", default="",
+                      help="Journal of the tape.\t\t\t\t"
+                           "default: TAPE.journal")
+    return parser
+
+
+def main():
+    parser = _options()
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Tape file name required")
+    if not os.path.isfile(args[0]):
+        p_error("Tape %s not found" % args[0])
+    output = options.output if options.output != "" else "%s_recovered.h5" % os.path.splitext(args[0])[0]
+    if os.path.abspath(output) == os.path.abspath(args[0]):
+        p_error("Output must differ from the damaged tape")
+    journal = options.journal if options.journal != "" else None
+    if journal is not None and not os.path.isfile(journal):
+        p_error("Journal %s not found" % journal)
+    if journal is None and not os.path.isfile(journal_name(args[0])):
+        p_warn("No journal found, trusting the records tables of the tape")
+
+    start = time()
+    try:
+        summary = recover_tape(args[0], output, journal=journal)
+    except (IOError, ValueError) as ex:
+        p_error(ex.message)
+    p_info("Tape recovered in %.2fs" % (time() - start))
+    for chapter in sorted(summary.keys()):
+        p_info("    %s: %d records, %d samples, %d torn records skipped"
+               % (chapter, summary[chapter]["records"], summary[chapter]["samples"], summary[chapter]["torn"]))
+    p_warn("Records written after the last journal flush are not counted, up to one flush interval is lost")
+
+if __name__ == "__main__":
+    main()
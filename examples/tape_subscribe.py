@@ -0,0 +1,84 @@
+#!/usr/bin/python
+"""
+ *     Filename: tape_subscribe.py
+ *
+ *	   Description:
+ *			Receives streaming records published over the network
+ *			and reports them, optionally storing them to local tape.
+ *
+ *    Copyright (C) 2014 - 2018 Pico Technology Ltd. See LICENSE file for terms.
+ *
+"""
+from optparse import OptionParser
+from example_utils import *
+from picosdk.tapenet import StreamingTapeSubscriber
+from picosdk.psutils import StreamingTape
+import socket
+from time import time
+
+
+def _options():
+    parser = OptionParser(usage="usage: %prog [options] HOST:PORT|SOCKET")
+    parser.add_option("-O", "--output",
+                      action="store", type="string", dest="output",
+                      metavar="FILE", default="",
+                      help="Tape file to store the received records to.\t"
+                           "default: none")
+    parser.add_option("-n", "--records",
+                      action="store", type="int", dest="records",
+                      metavar="COUNT", default=0,
+                      help="Number of records to receive, 0 until the publisher closes.\t"
+                           "default: %default")
+    parser.add_option("-t", "--timeout",
+                      action="store", type="float", dest="timeout",
+                      metavar="SECONDS", default=10.0,
+                      help="How long to wait for single record.\t\t"
+                           "default: %default")
+    return parser
+
+
+def main():
+    parser = _options()
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Publisher address required")
+    if ":" in args[0]:
+        host, port = args[0].rsplit(":", 1)
+        address = (host, int(port))
+    else:
+        address = args[0]
+
+    try:
+        subscriber = StreamingTapeSubscriber(address, timeout=options.timeout)
+    except socket.error as ex:
+        p_error("Cannot connect to %s: %s" % (args[0], ex))
+    tape = StreamingTape(options.output) if options.output != "" else None
+    start = time()
+    report = start
+    records = 0
+    samples = 0
+    try:
+        while options.records == 0 or records < options.records:
+            rec = subscriber.receive()
+            if rec is None:
+                break
+            if tape is not None:
+                tape.record(rec if len(rec.buffers) > 0 else None, detached=True)
+            if len(rec.buffers) == 0:
+                p_info("Chapter %s closed" % rec.chapter)
+                continue
+            records += 1
+            samples += rec.samples
+            if time() - report >= 1.0:
+                report = time()
+                p_info("%s: %d records, %d samples, %d records lost" % (rec.chapter, records, samples, subscriber.lost))
+    finally:
+        subscriber.close()
+        if tape is not None:
+            tape.wait2finish(timeout=0)
+            tape.close()
+    p_info("Received %d records, %d samples in %.2fs, %d records lost"
+           % (records, samples, time() - start, subscriber.lost))
+
+if __name__ == "__main__":
+    main()
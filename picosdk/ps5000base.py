@@ -604,6 +604,7 @@ class PS5000Device(object):
         self._tape = None
         self._records = None
         self._leavers = None
+        self._pool = None
         self._recording_thread = None
         self._recording_lock = Lock()
         if self._recording_lock.acquire(False):
@@ -1959,14 +1960,15 @@ class PS5000Device(object):
 
     def load_tape(self, tape):
         """ Loads/sets which streaming tape to use
-        :param tape: tape object
-        :type tape: StreamingTape
+        :param tape: tape object, fan-out of several tapes, network publisher or any sink with record
+                     and is_processing, see tape_sink
+        :type tape: StreamingTape, StreamingTapeFanout, StreamingTapePublisher
         :returns: status of the call
         :rtype int
         """
         if self._tape is not None:
             self.eject_tape()
-        if isinstance(tape, StreamingTape):
+        if tape_sink(tape):
             self._tape = tape
             return pico_num("PICO_OK")
         else:
@@ -1981,6 +1983,7 @@ class PS5000Device(object):
             self._tape = None
         self._records = None
         self._leavers = None
+        self._pool = None
         return pico_num("PICO_OK")
 
     def start_recording(self, interval, units, mode, downsample=1, memlength=0, limit=0, chapter=None):
@@ -2028,6 +2031,7 @@ class PS5000Device(object):
             """ initialize records """
             self._records = StreamingTapeRecording()
             self._leavers = None
+            self._pool = StreamingTapeRecordPool()
             self._records.device = self.info.variant_info
             self._records.serial = self.info.batch_and_serial
             """ Determine how many ratio modes to set up """
@@ -2055,6 +2059,8 @@ class PS5000Device(object):
             else:
                 self._records.chapter = chapter
             self._records.enabled = enabled + engaged
+            if self.info.max_adc is not None:
+                self._records.maxAdc = self.info.max_adc
             self._records.units = units
             self._records.mode = mode
             self._records.downsample = downsample
@@ -2197,6 +2203,7 @@ class PS5000Device(object):
                 if self._leavers is not None and self._leavers.samples > 0 and self._tape is not None:
                     self._leavers.final = True
                     self._tape.record(self._leavers)
+                    self._pool.release(self._leavers)
                     self._leavers = None
                 return
             if len(self._records) == 0:
@@ -2215,15 +2222,16 @@ class PS5000Device(object):
                     self._records.triggered = False
             if self._tape is not None:
                 if self._leavers is not None:
-                    left = self._leavers.top_up(self._records)
+                    left = self._leavers.top_up(self._records, self._pool)
                     if self._leavers.bufflen == self._leavers.samples:
                         self._tape.record(self._leavers)
+                        self._pool.release(self._leavers)
                         self._leavers = left
                 else:
                     if self._records.bufflen == self._records.samples:
                         self._tape.record(self._records)
                     else:
-                        self._leavers = self._records.side_copy()
+                        self._leavers = self._records.side_copy(self._pool)
 
         except Exception as ex:
             self.last_error = ex.message
@@ -17,6 +17,24 @@ import os.path
 from time import time, strftime, sleep
 import warnings
 import multiprocessing
+import cPickle
+import struct
+import bisect
+import zlib
+import collections
+import json
+import weakref
+try:
+    import blosc
+except ImportError:
+    blosc = None
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
 from exceptions import AttributeError, OSError, TypeError
 from copy import deepcopy
 from picosdk.picostatus import pico_num
@@ -29,6 +47,9 @@ if not hasattr(tb, "openFile"):
     tb.File.iterNodes = tb.File.iter_nodes
     tb.File.createGroup = tb.File.create_group
     tb.File.createCArray = tb.File.create_carray
+    tb.File.createEArray = tb.File.create_earray
+    tb.File.createTable = tb.File.create_table
+    tb.File.createVLArray = tb.File.create_vlarray
     tb.Node._f_setAttr = tb.Node._f_setattr
 
 """ disable warnings from PyTables """
@@ -134,26 +155,192 @@ class StreamingTape(object):
     recfmt = "record%08d"
     filters = tb.Filters(complib='blosc', complevel=9)
     atom = tb.Atom.from_dtype(np.dtype("int16"))
+    """ auto compression: candidates, number of samples to try and expected storage speed in bytes/s """
+    codecs = ({"complib": "blosc:lz4", "complevel": 1, "shuffle": True},
+              {"complib": "blosc:lz4", "complevel": 1, "shuffle": False, "bitshuffle": True},
+              {"complib": "blosc:lz4", "complevel": 5, "shuffle": True},
+              {"complib": "blosc:zstd", "complevel": 1, "shuffle": True},
+              {"complib": "blosc:zstd", "complevel": 1, "shuffle": False, "bitshuffle": True},
+              {"complib": "blosc", "complevel": 9, "shuffle": True},
+              {"complib": "zlib", "complevel": 1, "shuffle": True})
+    trial_samples = 262144
+    storage_rate = 200e6
+    """ samples per row of the overview levels built with overview=True """
+    overview_levels = (16, 256, 4096)
+    """ flush cadence of the tape file and its journal with journal=True """
+    journal_cadence = {"seconds": 1.0}
 
-    def __init__(self, filename, title=None, limit=1000, overwrite=True, stats=False):
+    def __init__(self, filename, title=None, limit=1000, overwrite=True, stats=False,
+                 transport="queue", ring_slots=16, ring_slot_size=4194304, layout=1,
+                 compression=None, channel_compression=None, workers=0, retention=None,
+                 queue_size=0, overload="block", degrade_factor=64, overview=None, journal=None,
+                 precondition=None, summary=False, rollover=None, readers=0):
+        """ Opens the tape and starts the records processor
+        :param filename: tape file name, None to keep records in memory
+        :type filename: str, None
+        :param title: tape title, None for a generated one
+        :type title: str, None
+        :param limit: number of records to keep per chapter of the memory tape when retention is not set
+        :type limit: int
+        :param overwrite: whether to overwrite an existing file
+        :type overwrite: bool
+        :param stats: whether to collect write statistics
+        :type stats: bool
+        :param transport: "queue" to pickle records to the processor,
+                          "ring" to pass them through shared memory slots
+        :type transport: str
+        :param ring_slots: number of shared memory slots in the ring transport
+        :type ring_slots: int
+        :param ring_slot_size: size of single ring slot in bytes, records not fitting it are queued
+        :type ring_slot_size: int
+        :param layout: 1 to store each record in its own group,
+                       2 to append records to extendable per channel arrays with a records table per chapter
+        :type layout: int
+        :param compression: dict with complib, complevel, shuffle, bitshuffle and chunkshape (in samples),
+                            "auto" to pick the codec on the first record of each chapter
+                            or None for the default blosc filters
+        :type compression: dict, str, None
+        :param channel_compression: compression overrides per channel/port
+        :type channel_compression: dict, None
+        :param workers: number of compression worker processes, when set the records are compressed
+                        in parallel and stored as pre-compressed chunks (layout 3)
+        :type workers: int
+        :param retention: dict with records, seconds and/or bytes (uncompressed samples) to keep per chapter,
+                          the oldest records beyond any of them are evicted,
+                          file tapes roll only with layout 1, None to keep everything on file tapes
+        :type retention: dict, None
+        :param queue_size: maximum number of records waiting for the processor, 0 for unbounded
+        :type queue_size: int
+        :param overload: what record does when the queue or the ring is full,
+                         "block" to wait for room, "drop_newest" to drop the record,
+                         "drop_oldest" to have the processor drop the oldest queued record or
+                         "degrade" to queue min/max envelope of the record once the queue is half full
+                         and to drop it once the queue is full, the envelope is stored as it is and
+                         brought back to the record sample count on read, not with layout 2
+        :type overload: str
+        :param degrade_factor: number of samples represented by each min/max pair of degraded records, even
+        :type degrade_factor: int
+        :param overview: samples per row of each min/max/mean overview level built while recording,
+                         each a multiple of the previous one, True for StreamingTape.overview_levels,
+                         None to build no overview, file tapes without retention only
+        :type overview: tuple, bool, None
+        :param journal: dict with seconds and/or records between flushes of the tape file,
+                        each flush appends the records made durable to the journal file next to the tape,
+                        True for StreamingTape.journal_cadence, None to flush only on close, file tapes only
+        :type journal: dict, bool, None
+        :param precondition: lossless stages applied to the samples before compression,
+                             "shift" to drop low bits found zero in all samples of the record,
+                             "delta" to store differences of consecutive samples, None for no stages,
+                             undone on read, file tapes only
+        :type precondition: tuple, None
+        :param summary: whether to keep min, max, mean, RMS and overflow of every record buffer
+                        in the chapter summary table, queried without reading the samples
+        :type summary: bool
+        :param rollover: dict with bytes (file size), records and/or seconds after which the tape file is closed
+                         and the recording continues in the next one, chapters carrying on across the files;
+                         the files are named by segment_name and listed in the manifest next to the tape,
+                         closed ones are readable right away, see tapetools.TapeSegments;
+                         record indexes and sample offsets of the running tape readers count the whole
+                         chapter across the files, file tapes without retention and overview only
+        :type rollover: dict, None
+        :param readers: number of processes the cursors read the closed files of the rolling tape with,
+                        in parallel with each other and with the processor, 0 to have the processor read them
+        :type readers: int
+        :raises ValueError: on unsupported compression, retention, overload, overview, journal, precondition,
+                            rollover or readers options
+        """
 
-        # Check filename has an extension
-        extension = os.path.splitext(filename)[-1].lower()
+        if filename is not None:
+            # Check filename has an extension
+            extension = os.path.splitext(filename)[-1].lower()
 
-        if not extension:
-            filename += ".h5"
+            if not extension:
+                filename += ".h5"
 
-        # Check file path is writable
-        with open(filename, 'w'):
-            pass
+            # Check file path is writable
+            with open(filename, 'w'):
+                pass
+
+            os.remove(filename)
+        elif retention is None:
+            retention = {"records": limit}
 
-        os.remove(filename)
+        if retention is not None:
+            for key in retention:
+                if key not in ("records", "seconds", "bytes") or retention[key] <= 0:
+                    raise ValueError("Unsupported retention %s" % repr(retention))
+            if filename is not None and (layout != 1 or workers > 0):
+                raise ValueError("Rolling file tapes require layout 1 without compression workers")
+        if overload not in ("block", "drop_newest", "drop_oldest", "degrade"):
+            raise ValueError("Unsupported overload policy %s" % repr(overload))
+        if degrade_factor < 2 or degrade_factor % 2 != 0:
+            raise ValueError("Degrade factor has to be even, got %s" % repr(degrade_factor))
+        if overload == "degrade" and filename is not None and layout == 2 and workers == 0:
+            raise ValueError("Degraded records are stored as envelopes, layout 2 keeps samples only")
+        if overview is True:
+            overview = StreamingTape.overview_levels
+        elif not overview:
+            overview = None
+        if overview is not None:
+            if filename is None or retention is not None:
+                raise ValueError("Overview requires file tape without retention")
+            for previous, factor in zip((1, ) + tuple(overview), overview):
+                if factor <= previous or factor % previous != 0:
+                    raise ValueError("Unsupported overview levels %s" % repr(overview))
+            overview = tuple(overview)
+        if journal is True:
+            journal = dict(StreamingTape.journal_cadence)
+        elif not journal:
+            journal = None
+        if journal is not None:
+            if filename is None:
+                raise ValueError("Journal requires file tape")
+            for key in journal:
+                if key not in ("seconds", "records") or journal[key] <= 0:
+                    raise ValueError("Unsupported journal %s" % repr(journal))
+        if precondition is not None:
+            if filename is None:
+                raise ValueError("Preconditioning requires file tape")
+            precondition = tuple([stage for stage in precondition_stages if stage in precondition])
+            if len(precondition) == 0:
+                raise ValueError("Unsupported precondition %s" % repr(precondition))
+        if rollover is not None:
+            if filename is None or retention is not None or overview is not None:
+                raise ValueError("Rollover requires file tape without retention and overview")
+            if len(rollover) == 0:
+                raise ValueError("Unsupported rollover %s" % repr(rollover))
+            for key in rollover:
+                if key not in ("bytes", "records", "seconds") or rollover[key] <= 0:
+                    raise ValueError("Unsupported rollover %s" % repr(rollover))
+        if readers < 0 or (readers > 0 and rollover is None):
+            raise ValueError("Cursor readers require rolling file tape, got %s" % repr(readers))
 
         self._filename = filename
         self._title = title
         self._limit = limit
         self._overwrite = overwrite
         self._stats = stats
+        self._layout = layout
+        self._compression = compression
+        self._channelCompression = channel_compression if channel_compression is not None else {}
+        for c in [compression] + self._channelCompression.values():
+            compression_filters(c)
+        self._workers = workers
+        self._retention = retention
+        self._queueSize = max(queue_size, 0)
+        self._overload = overload
+        self._degradeFactor = degrade_factor
+        self._overview = overview
+        self._journal = journal
+        self._precondition = precondition
+        self._summary = summary
+        self._rollover = rollover
+        self._readers = readers
+        self._readerPool = None
+        self._overloadStats = {"dropped": 0, "dropped_samples": 0, "degraded": 0, "degraded_samples": 0}
+        self._ring = None
+        if transport == "ring":
+            self._ring = StreamingTapeRing(ring_slots, ring_slot_size)
         self.lastError = None
         self._recordLock = th.Lock()
         self._readLock = th.Lock()
@@ -161,49 +348,56 @@ class StreamingTape(object):
             if l.acquire(False):
                 l.release()
         self._closing = False
+        """ queued copies of the records come from here and return once the processor took them """
+        self._copies = StreamingTapeRecordPool(max(self._queueSize, 4))
+        self._asyncInbox = None
+        self._asyncThread = None
+        self._cursorThread = None
+        self._cursorInboxes = {}
         self._start_processor()
         self._setup_processor()
 
     def _start_processor(self):
         self._recordControl = multiprocessing.Queue()
         self._recordRead = multiprocessing.Queue()
-        self._recordWrite = multiprocessing.Queue()
-        self._recordWatchIn = multiprocessing.Queue()
-        self._recordWatchOut = multiprocessing.Queue()
+        """ drop_oldest lets the processor take everything and drop the oldest records itself """
+        self._recordWrite = multiprocessing.Queue(self._queueSize if self._overload != "drop_oldest" else 0)
+        """ items put by us, handed to the writer and dropped by the processor, each written by one side only """
+        self._recordPut = 0
+        self._recordTaken = multiprocessing.RawArray(c_longlong, 3)
+        self._copied = collections.deque()
+        self._recordNotify = multiprocessing.Queue()
+        self._recordCursor = multiprocessing.Queue()
+        """ processor sees EOF on the parent pipe when we are gone, we see EOF on the alive pipe when it is gone """
+        parent_in, self._parentPipe = multiprocessing.Pipe(duplex=False)
+        self._alivePipe, alive_out = multiprocessing.Pipe(duplex=False)
         self._recordProcess = RecordsProcessor(self._recordControl,
                                                self._recordRead,
                                                self._recordWrite,
-                                               self._recordWatchIn,
-                                               self._recordWatchOut)
+                                               (parent_in, self._parentPipe),
+                                               (self._alivePipe, alive_out),
+                                               self._ring,
+                                               self._recordNotify,
+                                               self._recordCursor,
+                                               self._recordTaken,
+                                               self._queueSize if self._overload == "drop_oldest" else 0)
         self._recordProcess.start()
-        self._watchdogEvent = th.Event()
-        if self._watchdogEvent.is_set():
-            self._watchdogEvent.clear()
+        parent_in.close()
+        alive_out.close()
+        self._isProcessing = True
         self._watchdogThread = th.Thread(target=self._watchdog_worker, args=(None, ))
+        self._watchdogThread.daemon = True
         self._watchdogThread.start()
-        self._isProcessing = True
 
     def _watchdog_worker(self, args):
-        keepalive = None
+        """ Blocks until the processor exits and the alive pipe reports EOF """
         try:
-            self._recordWatchOut.put(True)
-        except Exception as ex:
-            print "Watchdog Init(%d):" % sys.exc_info()[-1].tb_lineno, ex, type(ex)
-        with self._readLock:
-            self._recordControl.put({"Command": "Watchdog", "args": None})
-        while not self._watchdogEvent.wait(0.1):
-            try:
-                keepalive = self._recordWatchIn.get(True, 1.0)
-            except Queue.Empty:
-                keepalive = None
-            if keepalive is not None:
-                try:
-                    self._recordWatchOut.put(True)
-                except Exception as ex:
-                    print "Watchdog Send(%d):" % sys.exc_info()[-1].tb_lineno, ex, type(ex)
-            else:
-                self._watchdogEvent.set()
-                self._isProcessing = False
+            self._alivePipe.recv()
+        except (EOFError, IOError):
+            pass
+        self._isProcessing = False
+        if self._asyncInbox is not None:
+            self._asyncInbox.put(None)
 
     def _setup_processor(self):
         if self._recordProcess.is_alive():
@@ -213,7 +407,17 @@ class StreamingTape(object):
                                                   "title": self._title,
                                                   "limit": self._limit,
                                                   "overwrite": self._overwrite,
-                                                  "stats": self._stats}},
+                                                  "stats": self._stats,
+                                                  "layout": self._layout,
+                                                  "compression": self._compression,
+                                                  "channel_compression": self._channelCompression,
+                                                  "workers": self._workers,
+                                                  "retention": self._retention,
+                                                  "overview": self._overview,
+                                                  "journal": self._journal,
+                                                  "precondition": self._precondition,
+                                                  "summary": self._summary,
+                                                  "rollover": self._rollover}},
                                         True)
                 response = None
                 try:
@@ -246,9 +450,15 @@ class StreamingTape(object):
                 self._recordRead.get()
             self._recordProcess.join()
         self._recordProcess = None
-        if not self._watchdogEvent.is_set():
-            self._watchdogEvent.set()
         self._watchdogThread.join()
+        if self._asyncThread is not None:
+            self._asyncInbox.put(None)
+            self._asyncThread.join()
+        if self._readerPool is not None:
+            self._readerPool.terminate()
+            self._readerPool.join()
+        self._alivePipe.close()
+        self._parentPipe.close()
 
         self._recordControl._buffer.clear()
         self._recordControl.close()
@@ -262,26 +472,151 @@ class StreamingTape(object):
         self._recordWrite.close()
         self._recordWrite.join_thread()
 
-    def record(self, records):
+        self._recordNotify.close()
+        self._recordNotify.join_thread()
+
+        self._recordCursor.close()
+        self._recordCursor.join_thread()
+
+        if self._ring is not None:
+            self._ring.close()
+
+    def record(self, records, detached=False):
+        """ Queues the records for the processor, the samples are copied before returning
+        :param records: records to store, None to close the current chapter
+        :type records: StreamingTapeRecording, None
+        :param detached: whether the records are a copy nobody modifies anymore, queued without copying
+        :type detached: bool
+        :returns: status of the call
+        :rtype: int
+        """
         if self._closing or self._recordProcess is None or not self._recordProcess.is_alive():
             return pico_num("PICO_CANCELLED")
         status = pico_num("PICO_OK")
         try:
             with self._recordLock:
-                if records is not None:
-                    self._recordWrite.put(records.side_copy())
+                if records is None:
+                    if not self._put(None, "block"):
+                        status = pico_num("PICO_CANCELLED")
+                elif self._overload == "degrade" and self._queueSize > 0 \
+                        and self._backlog() * 2 >= self._queueSize:
+                    self._degrade(records)
+                elif self._ring is not None and self._ring.fits(records):
+                    slot = self._slot()
+                    if slot is None:
+                        if self._overload == "block":
+                            return pico_num("PICO_CANCELLED")
+                        elif self._overload == "degrade":
+                            self._degrade(records)
+                        elif self._overload == "drop_oldest":
+                            """ the processor makes room by dropping the oldest records, the copy goes behind them """
+                            self._put_copy(records, detached)
+                        else:
+                            self._count("dropped", records.samples)
+                    elif self._ring.store(slot, records):
+                        self._put(slot)
+                    else:
+                        self._ring.release(slot)
+                        self._put_copy(records, detached)
                 else:
-                    self._recordWrite.put(None)
+                    self._put_copy(records, detached)
         except Exception as ex:
             self.lastError = ex.message
             print "Tape Record(%d):" % sys.exc_info()[-1].tb_lineno, self.lastError, type(ex)
             status = pico_num("PICO_CANCELLED")
         return status
 
+    def _count(self, counter, samples):
+        self._overloadStats[counter] += 1
+        self._overloadStats[counter + "_samples"] += samples
+
+    def _degrade(self, rec):
+        if self._put(rec.envelope(self._degradeFactor)):
+            self._count("degraded", rec.samples)
+
+    def _slot(self):
+        """ Takes a free ring slot according to the overload policy, None if there is none to take """
+        slot = self._ring.acquire(timeout=0)
+        if slot is None and self._overload == "block":
+            while slot is None and self._isProcessing and not self._closing:
+                slot = self._ring.acquire(timeout=1.0)
+        return slot
+
+    def _backlog(self):
+        """ Items put on the write queue the processor has neither handed to the writer nor dropped yet """
+        return self._recordPut - self._recordTaken[0] - self._recordTaken[1]
+
+    def _put(self, item, policy=None):
+        """ Puts the item on the write queue applying the overload policy when the queue is full,
+        drop_oldest never finds it full, the processor drops the oldest records instead
+        :returns: False if the item was dropped
+        :rtype: bool
+        """
+        policy = self._overload if policy is None else policy
+        if policy == "block":
+            while self._isProcessing and not self._closing:
+                try:
+                    self._recordWrite.put(item, True, 1.0)
+                    self._recordPut += 1
+                    return True
+                except Queue.Full:
+                    pass
+        else:
+            try:
+                self._recordWrite.put(item, False)
+                self._recordPut += 1
+                return True
+            except Queue.Full:
+                pass
+        if isinstance(item, int):
+            self._count("dropped", self._ring.load(item).samples)
+            self._ring.release(item)
+        elif item is not None:
+            self._count("dropped", item.samples)
+        return False
+
+    def _put_copy(self, records, detached):
+        """ Queues the records, copied into a record of the pool unless detached, the copies the processor
+        took already are released first, items leave the write queue in order
+        :returns: False if the records were dropped
+        :rtype: bool
+        """
+        if detached:
+            return self._put(records)
+        taken = self._recordTaken[0] + self._recordTaken[1]
+        while len(self._copied) > 0 and self._copied[0][0] <= taken:
+            self._copies.release(self._copied.popleft()[1])
+        clone = records.side_copy(self._copies)
+        if clone is None:
+            return False
+        if not self._put(clone):
+            self._copies.release(clone)
+            return False
+        self._copied.append((self._recordPut, clone))
+        return True
+
+    def copy_stats(self):
+        """ Counters of the record pool the queued copies come from
+        :returns: allocated buffers and reused records
+        :rtype: dict
+        """
+        return dict(self._copies.stats)
+
+    def overload_stats(self):
+        """ Counters of records lost to the overload policy
+        :returns: dropped and degraded records and their samples
+        :rtype: dict
+        """
+        with self._recordLock:
+            stats = dict(self._overloadStats)
+        stats["dropped"] += self._recordTaken[1]
+        stats["dropped_samples"] += self._recordTaken[2]
+        return stats
+
     def wait2finish(self, timeout=10.0):
-        timeout += time()
+        deadline = time() + timeout
         if self._recordProcess is not None and self._recordProcess.is_alive():
-            while not self._closing and self._recordWrite.qsize() > 0 and (timeout == 0 or time() < timeout):
+            while not self._closing and self._backlog() > 0 and (timeout == 0 or time() < deadline):
                 sleep(0.01)
 
     def wait2start(self, chapter=None, timeout=10.0):
@@ -308,48 +643,2009 @@ class StreamingTape(object):
             chapters.sort()
             return chapters
 
-    def play_next(self, chapter=None, wait=True, timeout=10.0, purge=False):
-        with self._readLock:
-            self._recordControl.put({"Command": "Next", "args": {"chapter": chapter, "wait": wait, "purge": purge}})
-            nrec = None
-            try:
-                nrec = self._recordRead.get(True, timeout)
-            except Queue.Empty:
-                nrec = None
-            if nrec is None:
-                return nrec
-            if isinstance(nrec, basestring):
-                if wait and nrec == "WAIT":
-                    try:
-                        nrec = self._recordRead.get(True, timeout)
-                    except Queue.Empty:
-                        nrec = None
-                else:
-                    return None
-            return nrec
+    def play_next(self, chapter=None, wait=True, timeout=10.0, purge=False):
+        with self._readLock:
+            self._recordControl.put({"Command": "Next", "args": {"chapter": chapter, "wait": wait, "purge": purge}})
+            nrec = None
+            try:
+                nrec = self._recordRead.get(True, timeout)
+            except Queue.Empty:
+                nrec = None
+            if nrec is None:
+                return nrec
+            if isinstance(nrec, basestring):
+                if wait and nrec == "WAIT":
+                    try:
+                        nrec = self._recordRead.get(True, timeout)
+                    except Queue.Empty:
+                        nrec = None
+                else:
+                    return None
+            return nrec
+
+    def seek(self, chapter, sample=None, time=None):
+        """ Positions the read cursor, so that next play_next returns record holding the sample or time
+        :param chapter: chapter name
+        :type chapter: str
+        :param sample: sample offset from the chapter start
+        :type sample: int, None
+        :param time: timestamp, as returned by time.time(), of the first record completed at or after it
+        :type time: float, None
+        :returns: index of the record and offset of its first sample, None if not found
+        :rtype: tuple(int, int), None
+        """
+        if (sample is None) == (time is None):
+            return None
+        with self._readLock:
+            self._recordControl.put({"Command": "Seek", "args": {"chapter": chapter, "sample": sample, "time": time}})
+            try:
+                found = self._recordRead.get(True)
+            except Queue.Empty:
+                found = None
+        return found
+
+    def read_range(self, chapter, start, count, channels=None, modes=None, out=None):
+        """ Reads contiguous run of samples from the chapter in single request to the processor
+        :param chapter: chapter name
+        :type chapter: str
+        :param start: first sample offset from the chapter start
+        :type start: int
+        :param count: number of samples to read
+        :type count: int
+        :param channels: channels/ports to read, None for all
+        :type channels: tuple, None
+        :param modes: buffer names to read (raw, min, max, avg, dec), None for all
+        :type modes: tuple, None
+        :param out: arrays as {line: {mode: np.array}} the samples are copied into once they arrive pickled
+                    through the read queue, so that the caller keeps its buffers, missing ones are allocated
+        :type out: dict, None
+        :returns: number of samples read and buffers as {line: {mode: np.array}}, (0, None) if out of chapter,
+                  ranges reaching into the records evicted by retention start at the first retained sample
+        :rtype: tuple(int, dict)
+        """
+        with self._readLock:
+            self._recordControl.put({"Command": "Range",
+                                     "args": {"chapter": chapter, "start": start, "count": count,
+                                              "channels": channels, "modes": modes}})
+            try:
+                result = self._recordRead.get(True)
+            except Queue.Empty:
+                result = None
+        if result is None or result[1] is None:
+            return 0, None
+        count, buffers = result
+        if out is not None:
+            for line in buffers:
+                for mode in buffers[line]:
+                    if line in out and mode in out[line] and isinstance(out[line][mode], np.ndarray):
+                        np.copyto(out[line][mode][:count], buffers[line][mode])
+                        buffers[line][mode] = out[line][mode]
+        return count, buffers
+
+    def chapter_index(self, chapter, start=0):
+        """ Metadata of the chapter records without their samples, for following the recording cheaply
+        :param chapter: chapter name
+        :type chapter: str
+        :param start: index of the first record to return, records evicted by retention are left out
+        :type start: int
+        :returns: rows of record index, sample offset, samples, timestamp, triggered and triggerAt
+                  with whether the chapter has ended, (None, False) if chapter not found
+        :rtype: tuple(np.ndarray, bool)
+        """
+        with self._readLock:
+            self._recordControl.put({"Command": "Index", "args": {"chapter": chapter, "start": start}})
+            try:
+                result = self._recordRead.get(True)
+            except Queue.Empty:
+                result = None
+        if result is None:
+            return None, False
+        return result
+
+    def triggers(self, chapter):
+        """ Trigger events of the chapter from the trigger index kept by the writer
+        :param chapter: chapter name
+        :type chapter: str
+        :returns: rows of absolute sample position, record index and record timestamp, None if chapter not found
+        :rtype: np.ndarray, None
+        """
+        with self._readLock:
+            self._recordControl.put({"Command": "Triggers", "args": {"chapter": chapter}})
+            try:
+                result = self._recordRead.get(True)
+            except Queue.Empty:
+                result = None
+        return result
+
+    def summary(self, chapter):
+        """ Per record statistics of the chapter from the summary table kept by the writer with summary=True
+        :param chapter: chapter name
+        :type chapter: str
+        :returns: rows of record index, line, mode, timestamp, min, max, mean, RMS, overflow and volts per ADC count,
+                  None if chapter not found or recorded without summary
+        :rtype: np.ndarray, None
+        """
+        with self._readLock:
+            self._recordControl.put({"Command": "Summary", "args": {"chapter": chapter}})
+            try:
+                result = self._recordRead.get(True)
+            except Queue.Empty:
+                result = None
+        return result
+
+    def records_exceeding(self, chapter, volts, channels=None, modes=None):
+        """ Records of the chapter with any sample beyond the level or overflow, without reading the samples
+        :param chapter: chapter name
+        :type chapter: str
+        :param volts: absolute level in volts, ADC counts for the ports and lines without scale
+        :type volts: float
+        :param channels: channels/ports to check, None for all
+        :type channels: tuple, None
+        :param modes: buffer names to check, None for all
+        :type modes: tuple, None
+        :returns: sorted record indexes, None if the chapter has no summary
+        :rtype: np.ndarray, None
+        """
+        rows = self.summary(chapter)
+        if rows is None:
+            return None
+        return summary_exceeding(rows, volts, channels, modes)
+
+    def rms_trend(self, chapter, line, mode=None):
+        """ RMS of the line over the chapter record by record, without reading the samples
+        :param chapter: chapter name
+        :type chapter: str
+        :param line: channel/port
+        :type line: int
+        :param mode: buffer name, None for the first one of the line
+        :type mode: str, None
+        :returns: record indexes, timestamps and RMS in volts, NaN for the degraded records,
+                  (None, None, None) if the chapter has no summary
+        :rtype: tuple(np.ndarray, np.ndarray, np.ndarray)
+        """
+        rows = self.summary(chapter)
+        if rows is None:
+            return None, None, None
+        return summary_trend(rows, line, mode)
+
+    def map(self, func, chapter, channels=None, modes=None, workers=0, overlap=0, reduce=None, initial=None,
+            records=None):
+        """ Applies the function to the chapter split into record ranges, in parallel with workers,
+        see map_chapter. HDF5 file cannot be read by others while it is open for writing, so the processor
+        commits and closes the tape file for the map and reopens it afterwards. Records arriving meanwhile
+        wait in the write queue, subject to the overload policy of the tape, other requests to the tape
+        wait for the map to finish.
+        :param func: function(StreamingTapeSlice) returning a picklable result, defined at module level with workers
+        :type func: callable
+        :param chapter: chapter name
+        :type chapter: str
+        :param channels: channels/ports to read, None for all
+        :type channels: tuple, None
+        :param modes: buffer names to read, None for all
+        :type modes: tuple, None
+        :param workers: number of worker processes, 0 to map in the calling process
+        :type workers: int
+        :param overlap: number of samples of the neighbouring partitions added on both sides
+        :type overlap: int
+        :param reduce: function(accumulated, result) folding the results in the chapter order,
+                       None to return the list of results
+        :type reduce: callable, None
+        :param initial: initial accumulated value, None to start with the first result
+        :param records: number of records per partition, None for four partitions per worker
+        :type records: int, None
+        :returns: reduced value or list of the partition results, None if the chapter has no records
+        :raises ValueError: on memory tape, rolling tape, closed tape or chapter not found
+        """
+        if self._filename is None or self._rollover is not None:
+            raise ValueError("Map requires file tape without rollover")
+        with self._readLock:
+            self._recordControl.put({"Command": "Hold", "args": None})
+            try:
+                result = self._recordRead.get(True)
+            except Queue.Empty:
+                result = None
+            if result != "OK":
+                raise ValueError("Tape %s is not open" % self._filename)
+            try:
+                return map_chapter(self._filename, chapter, func, channels, modes, workers, overlap, reduce,
+                                   initial, records)
+            finally:
+                self._recordControl.put({"Command": "Release", "args": None})
+
+    def trigger_windows(self, chapter, pre, post, channels=None, modes=None):
+        """ Reads samples around every trigger of the chapter in single request to the processor,
+        windows are cut across record boundaries
+        :param chapter: chapter name
+        :type chapter: str
+        :param pre: number of samples before the trigger
+        :type pre: int
+        :param post: number of samples from the trigger on
+        :type post: int
+        :param channels: channels/ports to read, None for all
+        :type channels: tuple, None
+        :param modes: buffer names to read (raw, min, max, avg, dec), None for all
+        :type modes: tuple, None
+        :returns: trigger positions of the windows and {line: {mode: np.array(triggers, pre + post)}},
+                  triggers too close to the chapter ends to fit the window are left out, (None, None) on failure
+        :rtype: tuple(np.ndarray, dict)
+        """
+        with self._readLock:
+            self._recordControl.put({"Command": "Windows",
+                                     "args": {"chapter": chapter, "pre": pre, "post": post,
+                                              "channels": channels, "modes": modes}})
+            try:
+                result = self._recordRead.get(True)
+            except Queue.Empty:
+                result = None
+        if result is None:
+            return None, None
+        return result
+
+    def aplay(self, chapter, start=0, loop=None):
+        """ Asynchronous reader following the chapter until it ends, served by single thread shared by all readers
+
+        Coroutines of the event loop (trollius on Python 2) read it with ``rec = yield From(reader.next())``
+        until it returns None, plain callers can add done callbacks to the futures.
+        :param chapter: chapter name, the reader waits for it to start
+        :type chapter: str
+        :param start: index of the first record to read
+        :type start: int
+        :param loop: event loop to deliver records to, None for the current one
+        :returns: reader with next() returning futures of the records
+        :rtype: StreamingTapeReader
+        """
+        return StreamingTapeReader(self, chapter, start, self._async_loop(loop))
+
+    def aread_range(self, chapter, start, count, channels=None, modes=None, loop=None):
+        """ Asynchronous read_range
+        :returns: future of the read_range result
+        """
+        future = asyncio.Future(loop=self._async_loop(loop))
+        """ range reads take their own thread, the readers do not wait behind them """
+        worker = th.Thread(target=self._async_range, args=(future, {"chapter": chapter, "start": start, "count": count,
+                                                                     "channels": channels, "modes": modes}))
+        worker.daemon = True
+        worker.start()
+        return future
+
+    def _async_range(self, future, args):
+        try:
+            resolve_future(future, self.read_range(**args))
+        except Exception as ex:
+            resolve_future(future, error=ex)
+
+    def cursor(self, chapter, name=None, start=0):
+        """ Read cursor of the chapter with its own position and wait state kept by the processor,
+        cursors move neither each other nor the play_next position, waiting ones do not hold the others back;
+        with readers the cursors read the closed files of the rolling tape in parallel, see StreamingTapeCursor
+        :param chapter: chapter name, the cursor waits for it to start
+        :type chapter: str
+        :param name: cursor name, None for a generated one
+        :type name: str, None
+        :param start: index of the first record to read
+        :type start: int
+        :returns: cursor, None if the tape is closed
+        :rtype: StreamingTapeCursor, None
+        :raises ValueError: when the cursor of the name is open already
+        """
+        if self._closing or not self._isProcessing:
+            return None
+        with self._readLock:
+            if self._cursorThread is None:
+                self._cursorThread = th.Thread(target=self._cursor_feeder)
+                self._cursorThread.daemon = True
+                self._cursorThread.start()
+            if self._readers > 0 and self._readerPool is None:
+                self._readerPool = multiprocessing.Pool(self._readers)
+            if name is None:
+                name = "cursor%d" % len(self._cursorInboxes)
+                while name in self._cursorInboxes:
+                    name += "_"
+            elif name in self._cursorInboxes:
+                raise ValueError("Cursor %s is open already" % name)
+            inbox = Queue.Queue()
+            self._cursorInboxes[name] = inbox
+        self._cursor_request(name, "open", chapter=chapter, start=start)
+        return StreamingTapeCursor(self, name, chapter, start, inbox, self._readerPool)
+
+    def _cursor_request(self, name, op, **args):
+        args.update({"cursor": name, "op": op})
+        self._recordControl.put({"Command": "Cursor", "args": args})
+
+    def _cursor_close(self, name):
+        with self._readLock:
+            self._cursorInboxes.pop(name, None)
+        if not self._closing and self._isProcessing:
+            self._cursor_request(name, "close")
+
+    def _cursor_feeder(self):
+        """ Routes the replies of the processor to the cursors they belong to """
+        while True:
+            try:
+                reply = self._recordCursor.get()
+            except (EOFError, IOError):
+                break
+            if reply is None:
+                break
+            name, op, result = reply
+            inbox = self._cursorInboxes.get(name, None)
+            if inbox is not None:
+                inbox.put((op, result))
+        with self._readLock:
+            for inbox in self._cursorInboxes.values():
+                inbox.put((None, None))
+
+    def _async_loop(self, loop):
+        if asyncio is None:
+            raise ImportError("asyncio or trollius is required by the asynchronous readers")
+        return loop if loop is not None else asyncio.get_event_loop()
+
+    def _async_request(self, request):
+        if self._closing or not self._isProcessing:
+            reader, future = request
+            reader.finish(future)
+            return
+        with self._readLock:
+            if self._asyncThread is None:
+                self._asyncInbox = Queue.Queue()
+                for worker in (self._async_worker, self._notify_feeder):
+                    thread = th.Thread(target=worker)
+                    thread.daemon = True
+                    thread.start()
+                    if worker == self._async_worker:
+                        self._asyncThread = thread
+        self._asyncInbox.put(request)
+
+    def _notify_feeder(self):
+        """ Forwards chapters reported written by the processor to the asynchronous readers worker """
+        while True:
+            try:
+                chapter = self._recordNotify.get()
+            except (EOFError, IOError):
+                break
+            if chapter is None:
+                break
+            self._asyncInbox.put(("written", chapter))
+
+    def _async_worker(self):
+        """ Fetches records for the asynchronous readers, readers which are ahead wait for their chapter writes,
+        runs until None is put on the inbox when the tape closes or the processor is gone
+        """
+        waiting = {}
+        while True:
+            item = self._asyncInbox.get()
+            if item is None:
+                break
+            kind, request = item
+            try:
+                if kind == "next":
+                    self._async_fetch(request, waiting)
+                elif kind == "written":
+                    for pending in waiting.pop(request, []):
+                        self._async_fetch(pending, waiting)
+            except Exception as ex:
+                print "Tape Async(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+        for pending in [p for chapter in waiting.values() for p in chapter]:
+            pending[0].finish(pending[1])
+        """ requests put after the sentinel are finished too, nobody serves them anymore """
+        while True:
+            try:
+                item = self._asyncInbox.get_nowait()
+            except Queue.Empty:
+                break
+            if item is not None and item[0] == "next":
+                item[1][0].finish(item[1][1])
+
+    def _async_fetch(self, request, waiting):
+        reader, future = request
+        with self._readLock:
+            self._recordControl.put({"Command": "Fetch", "args": {"chapter": reader.chapter, "index": reader.index}})
+            rec = Queue.Empty
+            while rec is Queue.Empty:
+                try:
+                    rec = self._recordRead.get(True, 10.0)
+                except Queue.Empty:
+                    """ busy processor is waited for, only the tape closing ends the reader without reply """
+                    if self._closing or not self._isProcessing:
+                        rec = None
+        if rec is None or (isinstance(rec, basestring) and rec == "END"):
+            reader.finish(future)
+        elif isinstance(rec, basestring) and rec == "WAIT":
+            if reader.chapter not in waiting:
+                waiting[reader.chapter] = []
+            waiting[reader.chapter].append(request)
+        elif isinstance(rec, basestring):
+            resolve_future(future, error=IOError(rec))
+        else:
+            reader.index = rec.index + 1
+            resolve_future(future, rec)
+
+    def overview(self, chapter, start, count, pixels, channels=None, modes=None):
+        """ Reads the coarsest overview level of the samples still giving at least pixels rows,
+        the cost does not depend on the chapter length, see read_chapter_overview
+        :param chapter: chapter name
+        :type chapter: str
+        :param start: first sample offset from the chapter start, seek converts timestamps to offsets
+        :type start: int
+        :param count: number of samples in the window
+        :type count: int
+        :param pixels: minimal number of rows to return
+        :type pixels: int
+        :param channels: channels/ports to read, None for all
+        :type channels: tuple, None
+        :param modes: buffer names to read (raw, min, max, avg, dec), None for all
+        :type modes: tuple, None
+        :returns: sample offset of the first row, samples per row and rows as {line: {mode: np.array}}
+        :rtype: tuple(int, int, dict)
+        """
+        with self._readLock:
+            self._recordControl.put({"Command": "Overview",
+                                     "args": {"chapter": chapter, "start": start, "count": count, "pixels": pixels,
+                                              "channels": channels, "modes": modes}})
+            try:
+                result = self._recordRead.get(True)
+            except Queue.Empty:
+                result = None
+        if result is None:
+            return 0, 0, None
+        return result
+
+    def play_last(self):
+        with self._readLock:
+            self._recordControl.put({"Command": "Last", "args": None})
+            try:
+                last = self._recordRead.get(True)
+            except Queue.Empty:
+                last = None
+        return last
+
+    def pull_stats(self):
+        if not self._stats:
+            return None
+        with self._readLock:
+            self._recordControl.put({"Command": "Stats", "args": None})
+            try:
+                stats = self._recordRead.get(True)
+            except Queue.Empty:
+                stats = None
+        return stats
+
+    def pull_processor_stats(self):
+        """ Counters of the recording process, kept apart from the per record write statistics of pull_stats
+        :returns: codec picks per chapter and channel, CPU time of the process, compression worker utilisation,
+                  journal flushes and the overload counters
+        :rtype: dict, None
+        """
+        with self._readLock:
+            self._recordControl.put({"Command": "ProcessorStats", "args": None})
+            try:
+                stats = self._recordRead.get(True)
+            except Queue.Empty:
+                stats = None
+        if stats is not None:
+            stats["overload"] = self.overload_stats()
+        return stats
+
+    def erase(self):
+        pass
+
+
+class StreamingTapeFanout(object):
+    """ Tape handing every record to several sink tapes
+
+    Each record is copied once and the copy is shared by all the sinks. Every sink is fed by
+    its own thread, so the queue size and overload policy of the sink apply to that sink only
+    and a slow one never holds back the others, its records wait in front of it instead.
+    Devices accept the fan-out in load_tape in place of a single tape.
+    """
+
+    def __init__(self, sinks, backlog=0):
+        """
+        :param sinks: sink name to tape, the fan-out owns the sinks and closes them
+        :type sinks: dict
+        :param backlog: number of records allowed to wait in front of each sink,
+                        records beyond it are dropped for that sink, 0 for unbounded
+        :type backlog: int
+        """
+        if len(sinks) == 0:
+            raise ValueError("Fan-out needs at least one sink")
+        self.sinks = dict(sinks)
+        self._backlog = max(backlog, 0)
+        self._closing = False
+        self._lock = th.Lock()
+        self._inboxes = {}
+        self._threads = {}
+        self._sinkStats = {}
+        for name in self.sinks:
+            self._inboxes[name] = Queue.Queue()
+            self._sinkStats[name] = {"records": 0, "samples": 0, "bytes": 0, "dropped": 0, "dropped_samples": 0,
+                                     "lag": 0.0, "max_lag": 0.0, "first": None, "last": None}
+            self._threads[name] = th.Thread(target=self._feed, args=(name, ))
+            self._threads[name].daemon = True
+            self._threads[name].start()
+
+    def _feed(self, name):
+        sink = self.sinks[name]
+        inbox = self._inboxes[name]
+        stats = self._sinkStats[name]
+        while True:
+            item = inbox.get()
+            if item is None:
+                break
+            rec, stamp = item
+            try:
+                sink.record(rec, detached=True)
+            except Exception as ex:
+                print "Fan-out %s(%d):" % (name, sys.exc_info()[-1].tb_lineno), ex.message
+                continue
+            if rec is None:
+                continue
+            done = time()
+            with self._lock:
+                stats["records"] += 1
+                stats["samples"] += rec.samples
+                stats["bytes"] += rec.samples * sum([1 for c in rec.buffers for key in rec.buffers[c]
+                                                     if isinstance(rec.buffers[c][key], np.ndarray)]) \
+                    * np.dtype(c_int16).itemsize
+                stats["lag"] += done - stamp
+                stats["max_lag"] = max(stats["max_lag"], done - stamp)
+                if stats["first"] is None:
+                    stats["first"] = stamp
+                stats["last"] = done
+
+    def record(self, records, detached=False):
+        """ Hands the records to all the sinks, the samples are copied before returning
+        :param records: records to store, None to close the current chapter of all sinks
+        :type records: StreamingTapeRecording, None
+        :param detached: whether the records are a copy nobody modifies anymore, shared without copying
+        :type detached: bool
+        :returns: status of the call
+        :rtype: int
+        """
+        if self._closing:
+            return pico_num("PICO_CANCELLED")
+        shared = records if detached or records is None else records.side_copy()
+        if records is not None and shared is None:
+            return pico_num("PICO_CANCELLED")
+        stamp = time()
+        for name in self.sinks:
+            if shared is not None and 0 < self._backlog <= self._inboxes[name].qsize():
+                with self._lock:
+                    self._sinkStats[name]["dropped"] += 1
+                    self._sinkStats[name]["dropped_samples"] += shared.samples
+                continue
+            self._inboxes[name].put((shared, stamp))
+        return pico_num("PICO_OK")
+
+    def is_processing(self):
+        """ Whether any of the sinks still takes records """
+        return not self._closing and any([sink.is_processing() for sink in self.sinks.values()])
+
+    def wait2finish(self, timeout=10.0):
+        """ Waits for the records in front of the sinks to be handed over and for the sinks to finish
+        :param timeout: how long to wait in seconds, 0 to wait until done
+        :type timeout: float
+        """
+        deadline = time() + timeout
+        while not self._closing and any([inbox.qsize() > 0 for inbox in self._inboxes.values()]) \
+                and (timeout == 0 or time() < deadline):
+            sleep(0.01)
+        for sink in self.sinks.values():
+            sink.wait2finish(timeout=0 if timeout == 0 else max(deadline - time(), 0.01))
+
+    def sink_stats(self):
+        """ Throughput and lag of each sink
+        :returns: sink name to dict of records, samples and bytes handed over, throughput in bytes/s,
+                  mean and max lag in seconds between the fan-out taking a record and the sink queuing it,
+                  records waiting in front of the sink (backlog), records dropped by the fan-out
+                  and the overload stats of the sink itself
+        :rtype: dict
+        """
+        stats = {}
+        with self._lock:
+            for name, s in self._sinkStats.items():
+                stats[name] = {k: v for k, v in s.items() if k not in ("first", "last")}
+                stats[name]["lag"] = s["lag"] / s["records"] if s["records"] > 0 else 0.0
+                elapsed = s["last"] - s["first"] if s["first"] is not None else 0.0
+                stats[name]["throughput"] = s["bytes"] / elapsed if elapsed > 0 else 0.0
+        for name, sink in self.sinks.items():
+            stats[name]["backlog"] = self._inboxes[name].qsize()
+            stats[name]["overload"] = sink.overload_stats()
+        return stats
+
+    def close(self):
+        """ Hands over the records waiting in front of the sinks and closes them """
+        if self._closing:
+            return
+        self._closing = True
+        for name in self.sinks:
+            self._inboxes[name].put(None)
+        for name in self.sinks:
+            self._threads[name].join()
+            self.sinks[name].close()
+
+
+def resolve_future(future, result=None, error=None):
+    """ Completes the asyncio future from any thread """
+    def complete():
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    future._loop.call_soon_threadsafe(complete)
+
+
+class StreamingTapeReader(object):
+    """ Asynchronous reader of single chapter, see StreamingTape.aplay """
+
+    def __init__(self, tape, chapter, start, loop):
+        self.tape = tape
+        self.chapter = chapter
+        self.index = start
+        self.loop = loop
+
+    def next(self):
+        """ Future of the next record
+        :returns: future resolving to None once the chapter ends or the tape is closed
+        """
+        future = asyncio.Future(loop=self.loop)
+        self.tape._async_request(("next", (self, future)))
+        return future
+
+    def finish(self, future):
+        resolve_future(future, None)
+
+
+class StreamingTapeCursor(object):
+    """ Named read position in single chapter, see StreamingTape.cursor
+
+    Cursor waiting for its record does not hold the others back. The processor reads the records
+    one request at a time, so the cursors share its read rate, only unpickling of the records
+    runs in the threads of the cursors. Cursors of rolling tapes started with readers read
+    the records of the closed files through the reader pool instead, each reader process with
+    its own read-only handle, so that they scale with the readers; only the records of the file
+    being written and the waits for new ones go to the processor. Single cursor is meant to be used
+    by single thread.
+    """
+
+    def __init__(self, tape, name, chapter, start, inbox, readers=None):
+        self.tape = tape
+        self.name = name
+        self.chapter = chapter
+        self.index = start
+        self._inbox = inbox
+        self._pending = False
+        self._closed = False
+        self._readers = readers
+        self._segments = []
+        self._manifestStamp = None
+
+    def _reply(self, op, deadline):
+        """ Next reply to the operation, replies to the earlier ones are dropped
+        :returns: whether the reply came and the reply, no reply once the deadline passes or the tape closes
+        :rtype: tuple(bool, object)
+        """
+        while True:
+            try:
+                got, result = self._inbox.get(True, None if deadline is None else max(deadline - time(), 0))
+            except Queue.Empty:
+                return False, None
+            if got is None:
+                self._closed = True
+                return False, None
+            if got == op:
+                return True, result
+
+    def _closed_file(self):
+        """ Closed file of the rolling tape holding the record at the cursor, the manifest is read again
+        only once it is replaced
+        :returns: file name and index of the record in the file, None if no closed file holds it
+        :rtype: tuple(str, int), None
+        """
+        for reload in (False, True):
+            if reload:
+                try:
+                    st = os.stat(manifest_name(self.tape._filename))
+                    if (st.st_ino, st.st_mtime) == self._manifestStamp:
+                        return None
+                    self._manifestStamp = (st.st_ino, st.st_mtime)
+                    segments = read_manifest(self.tape._filename)["segments"]
+                except (OSError, ValueError):
+                    return None
+                self._segments = [segment for segment in segments if segment["closed"]]
+            for segment in self._segments:
+                part = segment["chapters"].get(self.chapter, None)
+                if part is not None and part["first"] <= self.index < part["first"] + part["records"]:
+                    return (os.path.join(os.path.dirname(self.tape._filename), segment["file"]),
+                            self.index - part["first"])
+        return None
+
+    def _read_closed(self):
+        """ Reads the record at the cursor from the closed files of the rolling tape with the reader pool
+        :returns: record, None if it is not in the closed files or cannot be read there
+        :rtype: StreamingTapeRecording, None
+        """
+        if self._readers is None:
+            return None
+        rec = None
+        try:
+            located = self._closed_file()
+            if located is not None:
+                rec = self._readers.apply(_cursor_task, ((located[0], self.chapter, located[1]), ))
+        except Exception as ex:
+            print "Tape Cursor Read(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+            rec = None
+        if rec is not None:
+            rec["index"] = self.index
+        return rec
+
+    def next(self, wait=True, timeout=10.0):
+        """ Reads the record at the cursor and moves past it
+        :param wait: whether to wait for the record to be written
+        :type wait: bool
+        :param timeout: seconds to wait for the record, None to wait forever; the cursor keeps waiting
+                        after the timeout and the record is returned by the next call
+        :type timeout: float, None
+        :returns: record, None at the end of the finished chapter, on timeout or when the tape closes
+        :rtype: StreamingTapeRecording, None
+        """
+        if self._closed or self.tape._closing:
+            return None
+        deadline = None if timeout is None else time() + timeout
+        if not self._pending:
+            rec = self._read_closed()
+            if rec is not None:
+                self.index += 1
+                return rec
+            self.tape._cursor_request(self.name, "next", wait=wait, index=self.index)
+            self._pending = True
+        while True:
+            ok, rec = self._reply("next", deadline)
+            if not ok:
+                return None
+            if isinstance(rec, basestring):
+                continue
+            self._pending = False
+            if rec is not None:
+                self.index = rec.index + 1
+            return rec
+
+    def seek(self, sample=None, time=None):
+        """ Positions the cursor at the record holding the sample or time, waiting for a record is cancelled
+        :param sample: sample offset from the chapter start
+        :type sample: int, None
+        :param time: timestamp, as returned by time.time(), of the first record completed at or after it
+        :type time: float, None
+        :returns: index of the record and offset of its first sample, None if not found
+        :rtype: tuple(int, int), None
+        """
+        if (sample is None) == (time is None) or self._closed or self.tape._closing:
+            return None
+        self.tape._cursor_request(self.name, "seek", sample=sample, time=time)
+        ok, found = self._reply("seek", None)
+        self._pending = False
+        if found is not None:
+            self.index = found[0]
+        return found
+
+    def tell(self):
+        """ Index of the record next returns """
+        return self.index
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.tape._cursor_close(self.name)
+
+    def __iter__(self):
+        while True:
+            rec = self.next(timeout=None)
+            if rec is None:
+                return
+            yield rec
+
+
+class StreamingTapeIndex(tb.IsDescription):
+    """ Row of the per chapter records table used by the layout 2 tapes """
+    offset = tb.Int64Col(pos=0)
+    samples = tb.UInt32Col(pos=1)
+    timestamp = tb.Float64Col(pos=2)
+    triggered = tb.BoolCol(pos=3)
+    triggerAt = tb.Int64Col(pos=4)
+    overflow = tb.UInt64Col(pos=5)
+    degraded = tb.UInt16Col(pos=6)
+    shift = tb.UInt8Col(pos=7)
+
+
+""" entry of the tape journal, appended for each record once it is flushed to the tape file """
+journal_dtype = np.dtype([("chapter", "S128"), ("index", "<i8"), ("row", "<i8"), ("offset", "<i8"),
+                          ("samples", "<u4"), ("timestamp", "<f8"), ("triggered", "?"), ("triggerAt", "<i8"),
+                          ("overflow", "<u8"), ("degraded", "<u2"), ("shift", "u1")])
+journal_magic = "PICOTAPEJOURNAL1"
+
+
+def journal_name(filename):
+    """ Name of the journal kept next to the tape file, removed when the tape is closed cleanly """
+    return filename + ".journal"
+
+
+def read_journal(filename):
+    """ Reads the tape journal, torn entry left at the end by a crash is ignored
+    :param filename: journal file name
+    :type filename: str
+    :returns: entries with chapter, record index, records table row and the records table columns
+    :rtype: np.ndarray
+    :raises ValueError: when the file is not a tape journal
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    if not data.startswith(journal_magic):
+        raise ValueError("%s is not a tape journal" % filename)
+    count = (len(data) - len(journal_magic)) // journal_dtype.itemsize
+    entries = np.frombuffer(data, dtype=journal_dtype, count=count, offset=len(journal_magic))
+    return entries[entries["chapter"] != ""]
+
+
+def segment_name(filename, index):
+    """ Name of the file holding single segment of the rolling tape """
+    root, extension = os.path.splitext(filename)
+    return "%s.%04d%s" % (root, index, extension)
+
+
+def manifest_name(filename):
+    """ Name of the manifest listing the segments of the rolling tape """
+    return filename + ".manifest"
+
+
+def read_manifest(filename):
+    """ Reads the manifest of the rolling tape
+    :param filename: tape file name the rolling tape was started with
+    :type filename: str
+    :returns: title and segments, each with file name relative to the manifest, whether it is closed,
+              number of records and {chapter: first record, sample offset, records and samples in the segment}
+    :rtype: dict
+    :raises ValueError: when the manifest is not found or broken
+    """
+    try:
+        with open(manifest_name(filename), "r") as f:
+            manifest = json.load(f)
+    except (IOError, ValueError) as ex:
+        raise ValueError("Cannot read manifest of %s: %s" % (filename, ex))
+    if "segments" not in manifest:
+        raise ValueError("%s is not a tape manifest" % manifest_name(filename))
+    return manifest
+
+
+class StreamingTapeTrigger(tb.IsDescription):
+    """ Row of the per chapter trigger index """
+    position = tb.Int64Col(pos=0)
+    record = tb.Int64Col(pos=1)
+    timestamp = tb.Float64Col(pos=2)
+
+
+trigger_dtype = np.dtype([("position", "<i8"), ("record", "<i8"), ("timestamp", "<f8")])
+
+
+""" row of StreamingTape.chapter_index, metadata of single record without its samples """
+index_dtype = np.dtype([("record", "<i8"), ("offset", "<i8"), ("samples", "<u4"), ("timestamp", "<f8"),
+                        ("triggered", "?"), ("triggerAt", "<i8")])
+
+
+""" ADC count of the full scale, used when the records do not carry it """
+MAX_ADC = 32512
+
+
+""" labels of the reduction modes OR-ed in the mode of the streaming records, as in ps5000base.RatioModes """
+ratio_labels = {0: "raw", 1: "agg", 2: "dec", 4: "avg"}
+
+
+def ratio_modes(mode):
+    """ Reduction modes of the OR-ed selection, decoded without the device modules
+    :param mode: OR-ed modes selection
+    :type mode: int
+    :returns: dict of valid labels with enum values
+    :rtype: dict
+    """
+    r = {}
+    for m in ratio_labels:
+        if mode == m:
+            return {ratio_labels[m]: m}
+        if mode & m > 0:
+            r[ratio_labels[m]] = m
+    return r
+
+
+def tape_sink(tape):
+    """ Whether the object takes streaming records like StreamingTape, judged by its record and is_processing
+    :param tape: tape, fan-out, network publisher or any other sink
+    :rtype: bool
+    """
+    return callable(getattr(tape, "record", None)) and callable(getattr(tape, "is_processing", None))
+
+
+class StreamingTapeSummary(tb.IsDescription):
+    """ Row of the per chapter summary table, statistics of single buffer of single record """
+    record = tb.Int64Col(pos=0)
+    line = tb.UInt8Col(pos=1)
+    mode = tb.StringCol(8, pos=2)
+    timestamp = tb.Float64Col(pos=3)
+    min = tb.Int16Col(pos=4)
+    max = tb.Int16Col(pos=5)
+    mean = tb.Float32Col(pos=6)
+    rms = tb.Float32Col(pos=7)
+    overflow = tb.BoolCol(pos=8)
+    volts = tb.Float32Col(pos=9)
+
+
+summary_dtype = np.dtype([("record", "<i8"), ("line", "u1"), ("mode", "S8"), ("timestamp", "<f8"),
+                          ("min", "<i2"), ("max", "<i2"), ("mean", "<f4"), ("rms", "<f4"), ("overflow", "?"),
+                          ("volts", "<f4")])
+
+
+def record_summary(rec, index, timestamp):
+    """ Min, max, mean and RMS of every buffer of the record, taken before the samples are preconditioned,
+    degraded records hold only the min/max envelope and get NaN mean and RMS
+    :param rec: record
+    :type rec: StreamingTapeRecording
+    :param index: record index in the chapter
+    :type index: int
+    :param timestamp: record timestamp
+    :type timestamp: float
+    :returns: rows of the chapter summary table, volts per ADC count 0 for ports and lines without scale
+    :rtype: np.ndarray
+    """
+    max_adc = int(rec["maxAdc"]) if "maxAdc" in rec and rec["maxAdc"] > 0 else MAX_ADC
+    buffers = [(c, d, rec.buffers[c][d][rec.start:(rec.start + rec.samples)])
+               for c in sorted(rec.buffers) for d in sorted(rec.buffers[c])
+               if isinstance(rec.buffers[c][d], np.ndarray)]
+    rows = np.zeros(shape=(len(buffers), ), dtype=summary_dtype)
+    rows["record"] = index
+    rows["timestamp"] = timestamp
+    for i, (c, d, a) in enumerate(buffers):
+        rows["line"][i] = c
+        rows["mode"][i] = d
+        rows["overflow"][i] = "overflow" in rec.buffers[c] and bool(rec.buffers[c]["overflow"])
+        if not c & 128 and "scale" in rec.buffers[c]:
+            rows["volts"][i] = float(rec.buffers[c]["scale"]) / max_adc
+        if len(a) == 0:
+            continue
+        rows["min"][i] = a.min()
+        rows["max"][i] = a.max()
+        if "degraded" in rec:
+            rows["mean"][i] = np.nan
+            rows["rms"][i] = np.nan
+            continue
+        f = a.astype(np.float64)
+        rows["mean"][i] = f.sum() / len(a)
+        rows["rms"][i] = np.sqrt(np.dot(f, f) / len(a))
+    return rows
+
+
+def summary_exceeding(rows, volts, channels=None, modes=None):
+    """ Records with any sample beyond the level, judged by the summary rows only
+    :param rows: rows of the chapter summary table
+    :type rows: np.ndarray
+    :param volts: absolute level in volts, ADC counts for the lines without scale
+    :type volts: float
+    :param channels: channels/ports to check, None for all
+    :type channels: tuple, None
+    :param modes: buffer names to check, None for all
+    :type modes: tuple, None
+    :returns: sorted indexes of the records
+    :rtype: np.ndarray
+    """
+    rows = _summary_select(rows, channels, modes)
+    factor = np.where(rows["volts"] > 0, rows["volts"], 1.0)
+    peak = np.maximum(np.abs(rows["min"].astype(np.float64)), np.abs(rows["max"].astype(np.float64))) * factor
+    return np.unique(rows["record"][(peak > volts) | rows["overflow"]])
+
+
+def summary_trend(rows, line, mode=None):
+    """ RMS of the line record by record, judged by the summary rows only
+    :param rows: rows of the chapter summary table
+    :type rows: np.ndarray
+    :param line: channel/port
+    :type line: int
+    :param mode: buffer name, None for the first one of the line
+    :type mode: str, None
+    :returns: record indexes, timestamps and RMS in volts, ADC counts for the lines without scale,
+              NaN for the degraded records
+    :rtype: tuple(np.ndarray, np.ndarray, np.ndarray)
+    """
+    rows = _summary_select(rows, (line, ), None if mode is None else (mode, ))
+    if mode is None and len(rows) > 0:
+        rows = rows[rows["mode"] == rows["mode"][0]]
+    factor = np.where(rows["volts"] > 0, rows["volts"], 1.0)
+    return rows["record"], rows["timestamp"], rows["rms"] * factor
+
+
+def _summary_select(rows, channels, modes):
+    if channels is not None:
+        rows = rows[np.in1d(rows["line"], np.array(channels, dtype=np.uint8))]
+    if modes is not None:
+        rows = rows[np.in1d(rows["mode"], np.array(modes, dtype="S8"))]
+    return rows
+
+
+""" lossless preconditioning stages, in the order they are applied on write """
+precondition_stages = ("shift", "delta")
+
+
+def chapter_precondition(chapter):
+    """ Preconditioning stages of the tape chapter, None if the samples are stored as they are """
+    if "precondition" in chapter._v_attrs and chapter._v_attrs["precondition"]:
+        return tuple(chapter._v_attrs["precondition"].split(","))
+    return None
+
+
+def record_shift(rec, stages):
+    """ Number of low bits zero in every sample of the record buffers, 0 without the shift stage """
+    if stages is None or "shift" not in stages:
+        return 0
+    bits = 0
+    for line in rec.buffers.values():
+        for a in line.values():
+            if isinstance(a, np.ndarray) and len(a) > 0:
+                # reducing 64 bit words is way faster than the 16 bit ones, lanes folded afterwards
+                a = np.ascontiguousarray(a).view(np.uint16)
+                n = len(a) & ~3
+                if n < len(a):
+                    bits |= int(np.bitwise_or.reduce(a[n:]))
+                if n > 0:
+                    w = int(np.bitwise_or.reduce(a[:n].view(np.uint64)))
+                    bits |= (w | w >> 16 | w >> 32 | w >> 48) & 0xffff
+    shift = 0
+    while bits != 0 and not bits & 1 and shift < 15:
+        bits >>= 1
+        shift += 1
+    return shift
+
+
+def precondition(data, stages, shift=0):
+    """ Applies the preconditioning stages to the samples of single record
+    :param data: samples
+    :type data: np.ndarray
+    :param stages: stages from precondition_stages, None for none
+    :type stages: tuple, None
+    :param shift: number of low bits dropped by the shift stage, all of them have to be zero
+    :type shift: int
+    :returns: new array with the preconditioned samples, the data itself without stages
+    :rtype: np.ndarray
+    """
+    if stages is None or len(data) == 0:
+        return data
+    data = np.asarray(data, dtype=c_int16)
+    if "shift" in stages and shift > 0:
+        data = np.right_shift(data, shift)
+    if "delta" in stages:
+        delta = np.empty_like(data)
+        delta[0] = data[0]
+        np.subtract(data[1:], data[:-1], out=delta[1:])
+        data = delta
+    return data
+
+
+def expand_envelope(data, factor, samples):
+    """ Brings min/max envelope of degraded record back to its sample count, each value held for half of its block
+    :param data: min and max of each block of factor samples interleaved
+    :type data: np.ndarray
+    :param factor: number of samples represented by each min/max pair
+    :type factor: int
+    :param samples: number of samples of the record
+    :type samples: int
+    :rtype: np.ndarray
+    """
+    return np.repeat(data, factor // 2)[:samples]
+
+
+def restore(data, stages, shifts=0, heads=None):
+    """ Undoes the preconditioning stages on samples of consecutive records, int16 wrap-around included
+    :param data: preconditioned samples starting at the first sample of a record
+    :type data: np.ndarray
+    :param stages: stages from precondition_stages, None for none
+    :type stages: tuple, None
+    :param shifts: shift of each record, or single one
+    :type shifts: np.ndarray, int
+    :param heads: positions of the records in data, None for single record
+    :type heads: np.ndarray, None
+    :rtype: np.ndarray
+    """
+    if stages is None or len(data) == 0:
+        return data
+    data = np.array(data, dtype=c_int16)
+    heads = np.zeros(shape=(1, ), dtype=np.int64) if heads is None else np.asarray(heads, dtype=np.int64)
+    lengths = np.diff(np.append(heads, len(data)))
+    if "delta" in stages:
+        np.cumsum(data, dtype=c_int16, out=data)
+        if len(heads) > 1:
+            base = np.zeros(shape=(len(heads), ), dtype=c_int16)
+            base[1:] = data[heads[1:] - 1]
+            data -= np.repeat(base, lengths)
+    shifts = np.resize(np.asarray(shifts, dtype=c_int16), len(heads))
+    if "shift" in stages and shifts.any():
+        np.left_shift(data, np.repeat(shifts, lengths), out=data)
+    return data
+
+
+def chapter_layout(chapter):
+    """ Layout version of the tape chapter group """
+    if "layout" in chapter._v_attrs:
+        return int(chapter._v_attrs["layout"])
+    return 1
+
+
+def line_node(line):
+    """ Name of the tape node holding the channel or digital port data """
+    if line & 128:
+        return "port%02d" % (line & 127)
+    return "channel%02d" % line
+
+
+def node_line(name):
+    """ Channel or digital port of the tape node name, None for other nodes """
+    if name.startswith("channel"):
+        return int(name.replace("channel", ""))
+    elif name.startswith("port"):
+        return int(name.replace("port", "")) | 128
+    return None
+
+
+def overview_rows(data, factor):
+    """ Min, max and mean of each full block of samples or of lower level overview rows
+    :param data: samples or (n, 3) rows of min, max and mean
+    :type data: np.ndarray
+    :param factor: number of samples or rows in each block
+    :type factor: int
+    :returns: (n, 3) rows of min, max and mean, and leftover not filling whole block
+    :rtype: tuple(np.ndarray, np.ndarray)
+    """
+    n = len(data) // factor
+    rows = np.empty(shape=(n, 3), dtype=c_int16)
+    if data.ndim == 1:
+        blocks = data[:(n * factor)].reshape((n, factor))
+        rows[:, 0] = blocks.min(axis=1)
+        rows[:, 1] = blocks.max(axis=1)
+        rows[:, 2] = np.round(blocks.mean(axis=1))
+    else:
+        blocks = data[:(n * factor)].reshape((n, factor, 3))
+        rows[:, 0] = blocks[:, :, 0].min(axis=1)
+        rows[:, 1] = blocks[:, :, 1].max(axis=1)
+        rows[:, 2] = np.round(blocks[:, :, 2].mean(axis=1))
+    return rows, data[(n * factor):]
+
+
+def read_chapter_overview(chapter, start, count, pixels, channels=None, modes=None):
+    """ Reads the coarsest overview level of the chapter samples still giving at least pixels rows
+
+    Each row holds min, max and mean of the samples it covers, rows are aligned to multiples
+    of the level factor. Part of the window not yet reduced into the level, always shorter
+    than one row, is reduced from the samples. When no level is fine enough, the samples
+    themselves are returned as rows.
+    :param chapter: chapter group
+    :type chapter: tables.Group
+    :param start: first sample offset from the chapter start
+    :type start: int
+    :param count: number of samples in the window
+    :type count: int
+    :param pixels: minimal number of rows to return
+    :type pixels: int
+    :param channels: channels/ports to read, None for all
+    :type channels: tuple, None
+    :param modes: buffer names to read (raw, min, max, avg, dec), None for all
+    :type modes: tuple, None
+    :returns: sample offset of the first row, samples per row and rows as {line: {mode: np.array}},
+              (0, 0, None) if out of chapter
+    :rtype: tuple(int, int, dict)
+    """
+    if start < 0 or count <= 0 or "records" not in chapter or chapter.records.nrows == 0:
+        return 0, 0, None
+    last = chapter.records[-1]
+    end = min(start + count, int(last["offset"] + last["samples"]))
+    if end <= start:
+        return 0, 0, None
+    factor = 1
+    if "overview" in chapter:
+        for level in chapter.overview._v_attrs["levels"]:
+            if (end - start) // level >= pixels:
+                factor = int(level)
+    if factor == 1:
+        count, buffers = read_chapter_range(chapter, start, end - start, channels, modes)
+        if buffers is None:
+            return 0, 0, None
+        for line in buffers:
+            for mode in buffers[line]:
+                buffers[line][mode] = np.column_stack([buffers[line][mode]] * 3)
+        """ the window may start later, at the first sample kept by retention """
+        return end - count, 1, buffers
+    first = start // factor
+    stop = (end + factor - 1) // factor
+    buffers = {}
+    for group in chapter._v_file.listNodes(chapter.overview, classname="Group"):
+        line = node_line(group._v_name)
+        if line is None or (channels is not None and line not in channels):
+            continue
+        buffers[line] = {}
+        for a in chapter._v_file.listNodes(group, classname="Leaf"):
+            mode, level = a._v_name.rsplit("_", 1)
+            if int(level) != factor or (modes is not None and mode not in modes):
+                continue
+            stored = min(stop, a.nrows)
+            rows = a[first:stored] if first < stored else np.empty(shape=(0, 3), dtype=c_int16)
+            if stop > stored:
+                """ tail not reduced into the level yet """
+                tail_start = max(stored, first) * factor
+                n, tail = read_chapter_range(chapter, tail_start, end - tail_start, (line, ), (mode, ))
+                if n > 0:
+                    tail = tail[line][mode]
+                    rows = np.concatenate((rows, [[tail.min(), tail.max(), np.round(tail.mean())]])).astype(c_int16)
+            buffers[line][mode] = rows
+    return first * factor, factor, buffers
+
+
+def compression_filters(compression):
+    """ Translates compression options of the tape into PyTables filters
+    :param compression: dict with complib, complevel, shuffle, bitshuffle and chunkshape, None for defaults
+    :type compression: dict, None
+    :returns: filters and chunk length, None for chunk length picked by PyTables
+    :rtype: tuple(tables.Filters, int)
+    :raises ValueError: on unsupported options
+    """
+    if compression is None or compression == "auto":
+        return StreamingTape.filters, None
+    if not isinstance(compression, dict):
+        raise ValueError("Unsupported compression %s" % repr(compression))
+    filters = tb.Filters(complib=compression.get("complib", "blosc"),
+                         complevel=compression.get("complevel", 9),
+                         shuffle=compression.get("shuffle", True),
+                         bitshuffle=compression.get("bitshuffle", False))
+    chunkshape = compression.get("chunkshape", None)
+    if chunkshape is not None and chunkshape <= 0:
+        raise ValueError("Invalid chunkshape %s" % repr(chunkshape))
+    return filters, chunkshape
+
+
+def line_bit(line):
+    """ Bit of the line in the records table overflow mask """
+    if line & 128:
+        return 1 << (32 + (line & 127))
+    return 1 << line
+
+
+def chunk_codec(compression):
+    """ Codec used for pre-compressed chunks, blosc if available or zlib
+    :param compression: compression options of the tape, None for defaults
+    :type compression: dict, None
+    :rtype: dict
+    """
+    if compression is None or not isinstance(compression, dict):
+        compression = {"complib": "blosc", "complevel": 9, "shuffle": True}
+    complib = compression.get("complib", "blosc")
+    codec = {"codec": "zlib", "complevel": compression.get("complevel", 9)}
+    if complib.startswith("blosc") and blosc is not None:
+        codec["codec"] = "blosc"
+        codec["cname"] = complib.split(":")[1] if ":" in complib else "blosclz"
+        if compression.get("bitshuffle", False):
+            codec["shuffle"] = blosc.BITSHUFFLE
+        elif compression.get("shuffle", True):
+            codec["shuffle"] = blosc.SHUFFLE
+        else:
+            codec["shuffle"] = blosc.NOSHUFFLE
+    return codec
+
+
+def encode_chunk(data, codec):
+    """ Compresses samples with the codec from chunk_codec """
+    if codec["codec"] == "blosc":
+        return blosc.compress(data.tostring(), typesize=data.itemsize, clevel=codec["complevel"],
+                              shuffle=codec["shuffle"], cname=codec["cname"])
+    return zlib.compress(data.tostring(), codec["complevel"])
+
+
+def decode_chunk(blob, codec):
+    """ Decompresses samples of the pre-compressed chunk
+    :param blob: chunk as stored in the tape
+    :type blob: np.ndarray
+    :param codec: codec name, blosc or zlib
+    :type codec: str
+    :rtype: np.ndarray
+    """
+    if codec == "blosc":
+        if blosc is None:
+            raise ImportError("blosc module is required to read this tape")
+        data = blosc.decompress(blob.tostring())
+    else:
+        data = zlib.decompress(blob.tostring())
+    return np.frombuffer(data, dtype=c_int16)
+
+
+_worker_ring = None
+
+
+def _compress_init(ring):
+    global _worker_ring
+    _worker_ring = ring
+
+
+def _compress_task(args):
+    """ Compression pool job, returns chunks as {(line, mode): bytes} with the record shift, worker pid and busy time """
+    start = time()
+    slot, rec, codecs, stages = args
+    chunks = {}
+    shift = 0
+    try:
+        if slot is not None:
+            rec = _worker_ring.load(slot)
+        shift = record_shift(rec, stages)
+        for c in rec.buffers:
+            for d in rec.buffers[c]:
+                if isinstance(rec.buffers[c][d], np.ndarray):
+                    chunks[(c, d)] = encode_chunk(precondition(rec.buffers[c][d][rec.start:(rec.start + rec.samples)],
+                                                               stages, shift), codecs[c])
+    except Exception as ex:
+        print "Tape Compress(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+        chunks = None
+    return chunks, shift, os.getpid(), time() - start
+
+
+def chapter_index(chapter):
+    """ Metadata of all records in the chapter read at once, without touching the samples,
+    rebuilt from the record groups of layout 1 chapters written without the records table
+    :param chapter: chapter group
+    :type chapter: tables.Group
+    :returns: rows of the records table (offset, samples, timestamp, triggered, triggerAt, overflow, degraded, shift),
+              None if missing
+    :rtype: np.ndarray, None
+    :raises ValueError: when the record groups are not contiguous or hold fewer samples than listed
+    """
+    if "records" in chapter:
+        return chapter.records.read()
+    if chapter_layout(chapter) != 1:
+        return None
+    key = (chapter._v_file.filename, os.path.getmtime(chapter._v_file.filename), chapter._v_pathname)
+    if key not in _rebuilt_index:
+        _rebuilt_index.clear()
+        _rebuilt_index[key] = _record_groups_index(chapter)
+    return _rebuilt_index[key]
+
+
+""" records table rebuilt for the last layout 1 chapter read without one, the tape files read are closed """
+_rebuilt_index = {}
+
+
+def _record_groups_index(chapter):
+    """ Records table rows of the layout 1 chapter made of its record group attributes, None without records """
+    names = [group._v_name[len("record"):] for group in chapter._v_file.listNodes(chapter, classname="Group")
+             if group._v_name.startswith("record")]
+    indexes = sorted([int(name) for name in names if name.isdigit()])
+    if len(indexes) == 0:
+        return None
+    if indexes != range(indexes[0], indexes[0] + len(indexes)) or indexes[0] > chapter_first(chapter):
+        raise ValueError("Records of chapter %s are not contiguous" % chapter._v_name)
+    rows = np.zeros(shape=(indexes[-1] + 1, ), dtype=tb.description.dtype_from_descr(StreamingTapeIndex))
+    rows["triggerAt"] = -1
+    offset = 0
+    for index in indexes:
+        record = chapter._f_get_child(StreamingTape.recfmt % index)
+        attrs = record._v_attrs
+        lengths = []
+        overflow = 0
+        for line_group in chapter._v_file.listNodes(record, classname="Group"):
+            line = node_line(line_group._v_name)
+            if line is None:
+                continue
+            if "overflow" in line_group._v_attrs and line_group._v_attrs["overflow"]:
+                overflow |= line_bit(line)
+            lengths += [a.nrows for a in chapter._v_file.listNodes(line_group, classname="Leaf")]
+        samples = int(attrs["samples"]) if "samples" in attrs else min(lengths) if len(lengths) > 0 else 0
+        """ degraded records hold min/max pair of each block of samples """
+        stored = samples if "degraded" not in attrs else 2 * ((samples + attrs["degraded"] - 1) // attrs["degraded"])
+        if len(lengths) > 0 and min(lengths) < stored:
+            raise ValueError("Record %d of chapter %s holds %d samples instead of %d"
+                             % (index, chapter._v_name, min(lengths), stored))
+        row = rows[index]
+        row["offset"] = offset
+        row["samples"] = samples
+        row["timestamp"] = float(attrs["timestamp"]) if "timestamp" in attrs else 0.0
+        row["triggered"] = bool(attrs["triggered"]) if "triggered" in attrs else False
+        row["triggerAt"] = int(attrs["triggerAt"]) if "triggerAt" in attrs else -1
+        row["overflow"] = overflow
+        row["degraded"] = int(attrs["degraded"]) if "degraded" in attrs else 0
+        row["shift"] = int(attrs["shift"]) if "shift" in attrs else 0
+        rows[index] = row
+        offset += samples
+    return rows
+
+
+def chapter_first(chapter):
+    """ Index of the oldest record kept in the chapter, records before it were evicted by the retention policy """
+    if "first" in chapter._v_attrs:
+        return int(chapter._v_attrs["first"])
+    return 0
+
+
+def chapter_lines(chapter):
+    """ Channel and port groups of the tape chapter
+    :param chapter: chapter group
+    :type chapter: tables.Group
+    :returns: {line: group}, taken from the first record for layout 1 chapters
+    :rtype: dict
+    """
+    lines = {}
+    if chapter_layout(chapter) == 1:
+        first = StreamingTape.recfmt % chapter_first(chapter)
+        if first not in chapter:
+            return lines
+        chapter = chapter._f_get_child(first)
+    for group in chapter._v_file.listNodes(chapter, classname="Group"):
+        if node_line(group._v_name) is not None:
+            lines[node_line(group._v_name)] = group
+    return lines
+
+
+def chapter_triggers(chapter):
+    """ Trigger events of the chapter, taken from the records table on tapes without trigger index
+    :param chapter: chapter group
+    :type chapter: tables.Group
+    :returns: rows of absolute sample position, record index and timestamp, records evicted by retention left out,
+              None if the chapter has no records
+    :rtype: np.ndarray, None
+    """
+    records = chapter_index(chapter) if "triggers" not in chapter else None
+    if "triggers" in chapter:
+        rows = chapter.triggers.read()
+    elif records is not None:
+        hit = records["triggered"] & (records["triggerAt"] >= 0)
+        rows = np.zeros(shape=(int(hit.sum()), ), dtype=trigger_dtype)
+        rows["position"] = records["offset"][hit] + records["triggerAt"][hit]
+        rows["record"] = np.nonzero(hit)[0]
+        rows["timestamp"] = records["timestamp"][hit]
+    else:
+        return None
+    return rows[rows["record"] >= chapter_first(chapter)]
+
+
+def chapter_summary(chapter):
+    """ Per record statistics of the chapter recorded with summary=True
+    :param chapter: chapter group
+    :type chapter: tables.Group
+    :returns: rows of record index, line, mode, timestamp, min, max, mean, RMS, overflow and volts per ADC count,
+              records evicted by retention left out, None if the chapter has no summary
+    :rtype: np.ndarray, None
+    """
+    if "summary" not in chapter:
+        return None
+    rows = chapter.summary.read()
+    return rows[rows["record"] >= chapter_first(chapter)]
+
+
+def cut_windows(positions, pre, post, start, end, read):
+    """ Cuts sample windows around the positions, windows close to each other are read at once
+    :param positions: absolute sample positions of the windows
+    :type positions: np.ndarray
+    :param pre: number of samples before the position
+    :type pre: int
+    :param post: number of samples from the position on
+    :type post: int
+    :param start: first sample available
+    :type start: int
+    :param end: offset after the last sample available
+    :type end: int
+    :param read: function(start, count) returning number of samples read and {line: {mode: np.array}}
+    :type read: callable
+    :returns: sorted positions of the windows fitting between start and end and
+              {line: {mode: np.array(positions, pre + post)}}
+    :rtype: tuple(np.ndarray, dict)
+    """
+    width = pre + post
+    positions = np.sort(np.asarray(positions, dtype=np.int64))
+    positions = positions[(positions - pre >= start) & (positions + post <= end)]
+    span = max(1048576, 4 * width)
+    windows = {}
+    i = 0
+    while i < len(positions) and width > 0:
+        lo = int(positions[i]) - pre
+        j = i + 1
+        """ reading the gap is cheaper than another request while it is shorter than the window """
+        while j < len(positions) and positions[j] - pre - positions[j - 1] - post < width \
+                and positions[j] + post - lo <= span:
+            j += 1
+        count, buffers = read(lo, int(positions[j - 1]) + post - lo)
+        if buffers is not None:
+            for line in buffers:
+                if line not in windows:
+                    windows[line] = {}
+                for mode in buffers[line]:
+                    if mode not in windows[line]:
+                        windows[line][mode] = np.zeros(shape=(len(positions), width), dtype=c_int16)
+                    for k in xrange(i, j):
+                        at = int(positions[k]) - pre - lo
+                        windows[line][mode][k] = buffers[line][mode][at:(at + width)]
+        i = j
+    return positions, windows
+
+
+def read_trigger_windows(chapter, pre, post, channels=None, modes=None):
+    """ Reads samples around every trigger of the tape chapter, see cut_windows
+    :param chapter: chapter group
+    :type chapter: tables.Group
+    :returns: trigger positions of the windows and {line: {mode: np.array(triggers, pre + post)}}
+    :rtype: tuple(np.ndarray, dict)
+    """
+    triggers = chapter_triggers(chapter)
+    if triggers is None or chapter.records.nrows <= chapter_first(chapter):
+        return np.empty(shape=(0, ), dtype=np.int64), {}
+    table = chapter.records
+    last = table[-1]
+    return cut_windows(triggers["position"], pre, post, int(table.cols.offset[chapter_first(chapter)]),
+                       int(last["offset"] + last["samples"]),
+                       lambda start, count: read_chapter_range(chapter, start, count, channels, modes))
+
+
+def read_chapter_range(chapter, start, count, channels=None, modes=None):
+    """ Reads contiguous run of samples from the tape chapter
+    :param chapter: chapter group
+    :type chapter: tables.Group
+    :param start: first sample offset from the chapter start
+    :type start: int
+    :param count: number of samples to read
+    :type count: int
+    :param channels: channels/ports to read, None for all
+    :type channels: tuple, None
+    :param modes: buffer names to read (raw, min, max, avg, dec), None for all
+    :type modes: tuple, None
+    :returns: number of samples read and buffers as {line: {mode: np.array}}, (0, None) if out of chapter,
+              ranges reaching into the records evicted by retention start at the first retained sample,
+              ranges reaching a missing record group end before it
+    :rtype: tuple(int, dict)
+    """
+    if start < 0 or count <= 0:
+        return 0, None
+    table = chapter.records if "records" in chapter else chapter_index(chapter)
+    if table is None or len(table) <= chapter_first(chapter):
+        return 0, None
+    offsets = table.cols.offset if isinstance(table, tb.Table) else table["offset"]
+    end = start + count
+    start = max(start, int(offsets[chapter_first(chapter)]))
+    first = bisect.bisect_right(offsets, start) - 1
+    if first < 0:
+        return 0, None
+    last = bisect.bisect_left(offsets, end)
+    rows = table[first:last]
+    end = min(end, int(rows["offset"][-1] + rows["samples"][-1]))
+    if end <= start:
+        return 0, None
+    count = end - start
+    layout = chapter_layout(chapter)
+    stages = chapter_precondition(chapter)
+    shifts = rows["shift"] if "shift" in rows.dtype.names else np.zeros(shape=(len(rows), ), dtype=np.uint8)
+    degraded = rows["degraded"] if "degraded" in rows.dtype.names else np.zeros(shape=(len(rows), ), dtype=np.uint16)
+    buffers = {}
+    for line, group in chapter_lines(chapter).items():
+        if channels is not None and line not in channels:
+            continue
+        buffers[line] = {}
+        for a in chapter._v_file.listNodes(group, classname="Leaf"):
+            if modes is not None and a._v_name not in modes:
+                continue
+            if layout == 2 and stages is not None:
+                """ preconditioned samples are restored from the start of the first record """
+                head = int(rows["offset"][0])
+                buffers[line][a._v_name] = restore(a[head:end], stages, shifts, rows["offset"] - head)[(start - head):]
+            elif layout == 2:
+                buffers[line][a._v_name] = a[start:end]
+            else:
+                buffers[line][a._v_name] = np.empty(shape=(count,), dtype=c_int16)
+    if layout == 3:
+        lines = chapter_lines(chapter)
+        for i in xrange(len(rows)):
+            offset = int(rows["offset"][i])
+            lo = max(start - offset, 0)
+            hi = min(end - offset, int(rows["samples"][i]))
+            if hi <= lo:
+                continue
+            for line in buffers:
+                for mode in buffers[line]:
+                    data = decode_chunk(lines[line]._f_get_child(mode)[first + i], lines[line]._v_attrs["codec"])
+                    data = restore(data, stages, shifts[i])
+                    if degraded[i] > 0:
+                        data = expand_envelope(data, int(degraded[i]), int(rows["samples"][i]))
+                    buffers[line][mode][(offset + lo - start):(offset + hi - start)] = data[lo:hi]
+    elif layout == 1:
+        for i in xrange(len(rows)):
+            offset = int(rows["offset"][i])
+            lo = max(start - offset, 0)
+            hi = min(end - offset, int(rows["samples"][i]))
+            if hi <= lo:
+                continue
+            if StreamingTape.recfmt % (first + i) not in chapter:
+                """ the run ends at the missing record, like at the evicted ones """
+                count = offset + lo - start
+                if count == 0:
+                    return 0, None
+                for line in buffers:
+                    for mode in buffers[line]:
+                        buffers[line][mode] = buffers[line][mode][:count]
+                break
+            record = chapter._f_get_child(StreamingTape.recfmt % (first + i))
+            for line in buffers:
+                group = record._f_get_child(line_node(line))
+                for mode in buffers[line]:
+                    if degraded[i] > 0:
+                        data = restore(group._f_get_child(mode)[:], stages, shifts[i])
+                        data = expand_envelope(data, int(degraded[i]), int(rows["samples"][i]))[lo:hi]
+                    elif stages is not None:
+                        data = restore(group._f_get_child(mode)[:hi], stages, shifts[i])[lo:hi]
+                    else:
+                        data = group._f_get_child(mode)[lo:hi]
+                    buffers[line][mode][(offset + lo - start):(offset + hi - start)] = data
+    return count, buffers
+
+
+def read_segments_range(parts, start, count, channels=None, modes=None):
+    """ Reads contiguous run of samples of the chapter held by several files of the rolling tape
+    :param parts: chapter parts in the file order as (offset of the first sample from the chapter start,
+                  number of samples, function returning the chapter group of the file or None),
+                  files are opened only for the parts in the range
+    :type parts: list
+    :param start: first sample offset from the chapter start
+    :type start: int
+    :param count: number of samples to read
+    :type count: int
+    :param channels: channels/ports to read, None for all
+    :type channels: tuple, None
+    :param modes: buffer names to read (raw, min, max, avg, dec), None for all
+    :type modes: tuple, None
+    :returns: number of samples read and buffers as {line: {mode: np.array}}, (0, None) if out of chapter,
+              the run ends at the first samples missing from the parts
+    :rtype: tuple(int, dict)
+    """
+    runs = []
+    for offset, samples, group in parts:
+        lo = max(start, offset)
+        hi = min(start + count, offset + samples)
+        if hi > lo:
+            chapter = group()
+            if chapter is not None:
+                read, buffers = read_chapter_range(chapter, lo - offset, hi - lo, channels, modes)
+                if buffers is not None:
+                    runs.append((lo, read, buffers))
+    if len(runs) == 0 or runs[0][0] != start:
+        return 0, None
+    count = 0
+    for lo, read, buffers in runs:
+        if lo != start + count:
+            break
+        count += read
+    if len(runs) == 1:
+        return count, runs[0][2]
+    result = {}
+    for line in runs[0][2]:
+        result[line] = {}
+        for mode in runs[0][2][line]:
+            result[line][mode] = np.empty(shape=(count, ), dtype=runs[0][2][line][mode].dtype)
+    for lo, read, buffers in runs:
+        if lo - start >= count:
+            break
+        for line in result:
+            for mode in result[line]:
+                result[line][mode][(lo - start):(lo - start + read)] = buffers[line][mode][:read]
+    return count, result
+
+
+""" samples of single map partition handed to the user function,
+first and last are the record range, start and samples the partition run without the overlap,
+pre and post the overlap samples around it in the buffers as {line: {mode: np.array}} """
+StreamingTapeSlice = collections.namedtuple("StreamingTapeSlice",
+                                            ("chapter", "first", "last", "start", "samples", "pre", "post", "buffers"))
+
+def read_record(chapter, index):
+    """ Reads single record of the chapter of any layout
+    :param chapter: chapter group
+    :type chapter: tables.Group
+    :param index: index of the record in the chapter group
+    :type index: int
+    :returns: record, None if the chapter does not hold it
+    :rtype: StreamingTapeRecording, None
+    """
+    if chapter_layout(chapter) != 1:
+        return StreamingTapeRecording.read_chunk(chapter, index)
+    try:
+        chunk = chapter._v_file.getNode(chapter, StreamingTape.recfmt % index, "Group")
+    except Exception as ex:
+        chunk = None
+    if chunk is None:
+        return None
+    return StreamingTapeRecording.read_chunk(chunk)
+
+
+_cursor_file = None
+
+
+def _cursor_task(args):
+    """ Cursor reader pool job, reads single record of closed file of the rolling tape with its own handle """
+    global _cursor_file
+    filename, chapter, index = args
+    if _cursor_file is None or _cursor_file.filename != filename:
+        if _cursor_file is not None:
+            _cursor_file.close()
+        _cursor_file = tb.openFile(filename, mode="r")
+    if "/" + chapter not in _cursor_file:
+        return None
+    return read_record(_cursor_file.getNode("/", chapter, "Group"), index)
+
+
+_map_file = None
+
+
+def _map_task(args):
+    """ Map pool job, decodes single partition with its own handle of the tape file and applies the function """
+    global _map_file
+    filename = args[0]
+    if _map_file is None or _map_file.filename != filename:
+        if _map_file is not None:
+            _map_file.close()
+        _map_file = tb.openFile(filename, mode="r")
+    return _map_partition(_map_file, *args[1:])
+
+
+def _map_partition(tape, chapter, first, last, start, end, bounds, channels, modes, overlap, func):
+    lo = max(start - overlap, bounds[0])
+    hi = min(end + overlap, bounds[1])
+    count, buffers = read_chapter_range(tape.getNode("/", chapter, "Group"), lo, hi - lo, channels, modes)
+    return func(StreamingTapeSlice(chapter, first, last, start, end - start, start - lo, hi - end,
+                                   buffers if buffers is not None else {}))
+
+
+def map_chapter(filename, chapter, func, channels=None, modes=None, workers=0, overlap=0, reduce=None,
+                initial=None, records=None):
+    """ Applies the function to the chapter split into record ranges, in parallel with workers,
+    each worker opens the tape file read-only and decodes its own partitions
+    :param filename: tape file name, the tape has to be closed, see StreamingTape.map for idle running tapes
+    :type filename: str
+    :param chapter: chapter name
+    :type chapter: str
+    :param func: function(StreamingTapeSlice) returning a picklable result, defined at module level with workers
+    :type func: callable
+    :param channels: channels/ports to read, None for all
+    :type channels: tuple, None
+    :param modes: buffer names to read, None for all
+    :type modes: tuple, None
+    :param workers: number of worker processes, 0 to map in the calling process
+    :type workers: int
+    :param overlap: number of samples of the neighbouring partitions added on both sides
+    :type overlap: int
+    :param reduce: function(accumulated, result) folding the results in the chapter order,
+                   None to return the list of results
+    :type reduce: callable, None
+    :param initial: initial accumulated value, None to start with the first result
+    :param records: number of records per partition, None for four partitions per worker
+    :type records: int, None
+    :returns: reduced value or list of the partition results, None if the chapter has no records
+    :raises ValueError: if the chapter is not found
+    """
+    with tb.openFile(filename, mode="r") as tape:
+        if "/" + chapter not in tape:
+            raise ValueError("Chapter %s not found" % chapter)
+        group = tape.getNode("/", chapter, "Group")
+        rows = chapter_index(group)
+        first = chapter_first(group)
+    if rows is None or len(rows) <= first:
+        return None
+    ends = rows["offset"] + rows["samples"]
+    bounds = (int(rows["offset"][first]), int(ends[-1]))
+    if records is None:
+        records = -(-(len(rows) - first) // (4 * max(workers, 1)))
+    records = max(records, 1)
+    jobs = [(chapter, i, min(i + records, len(rows)), int(rows["offset"][i]), int(ends[min(i + records, len(rows)) - 1]),
+             bounds, channels, modes, max(overlap, 0), func) for i in xrange(first, len(rows), records)]
+    if workers <= 0:
+        tape = tb.openFile(filename, mode="r")
+        results = (_map_partition(tape, *job) for job in jobs)
+    else:
+        tape = None
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(_map_task, [(filename, ) + job for job in jobs])
+    try:
+        if reduce is None:
+            return list(results)
+        accumulated = initial
+        for i, result in enumerate(results):
+            accumulated = result if i == 0 and initial is None else reduce(accumulated, result)
+        return accumulated
+    finally:
+        if tape is not None:
+            tape.close()
+        else:
+            pool.terminate()
+            pool.join()
+
+
+class StreamingTapeRing(object):
+    """ Shared memory ring of fixed size slots carrying records to the processor
+
+    Each slot starts with a small header holding the pickled record metadata,
+    followed by the sample buffers. Only slot indices travel through the queues.
+    """
+    header = 4096
+
+    def __init__(self, slots, slot_size):
+        self.slots = slots
+        self.slot_size = slot_size
+        self._memory = multiprocessing.RawArray(c_char, slots * slot_size)
+        self._free = multiprocessing.Queue()
+        for slot in xrange(slots):
+            self._free.put(slot)
 
-    def play_last(self):
-        with self._readLock:
-            self._recordControl.put({"Command": "Last", "args": None})
-            try:
-                last = self._recordRead.get(True)
-            except Queue.Empty:
-                last = None
-        return last
+    def fits(self, rec):
+        """ Checks if the record samples fit into a single slot
+        :param rec: record to check
+        :type rec: StreamingTapeRecording
+        :rtype: bool
+        """
+        size = 0
+        for c in rec.buffers:
+            for key in rec.buffers[c]:
+                if isinstance(rec.buffers[c][key], np.ndarray):
+                    size += rec.bufflen * np.dtype(c_int16).itemsize
+        return size <= self.slot_size - self.header
 
-    def pull_stats(self):
-        if not self._stats:
+    def acquire(self, timeout=None):
+        """ Takes a free slot
+        :param timeout: how long to wait for a free slot, None to wait forever
+        :type timeout: float, None
+        :returns: slot index or None if none got free in time
+        :rtype: int, None
+        """
+        try:
+            return self._free.get(True, timeout)
+        except Queue.Empty:
             return None
-        with self._readLock:
-            self._recordControl.put({"Command": "Stats", "args": None})
-            try:
-                stats = self._recordRead.get(True)
-            except Queue.Empty:
-                stats = None
-        return stats
 
-    def erase(self):
-        pass
+    def release(self, slot):
+        """ Returns slot to the pool of free slots """
+        self._free.put(slot)
+
+    def _view(self, slot, offset, length):
+        return np.frombuffer(self._memory, dtype=c_int16, count=length, offset=(slot * self.slot_size + offset))
+
+    def store(self, slot, rec):
+        """ Copies the record into the slot
+        :param slot: slot index taken with acquire
+        :type slot: int
+        :param rec: record to store
+        :type rec: StreamingTapeRecording
+        :returns: False if the record metadata does not fit the slot header
+        :rtype: bool
+        """
+        meta = StreamingTapeRecording()
+        for key in rec.keys():
+            if key != "buffers":
+                meta[key] = rec[key]
+        meta.buffers = {}
+        meta.start = 0
+        arrays = []
+        offset = self.header
+        for c in rec.buffers:
+            meta.buffers[c] = {}
+            for key in rec.buffers[c]:
+                if isinstance(rec.buffers[c][key], np.ndarray):
+                    arrays.append((c, key, offset))
+                    offset += rec.bufflen * np.dtype(c_int16).itemsize
+                else:
+                    meta.buffers[c][key] = rec.buffers[c][key]
+        blob = cPickle.dumps((meta, arrays), cPickle.HIGHEST_PROTOCOL)
+        if len(blob) + 4 > self.header:
+            return False
+        base = slot * self.slot_size
+        self._memory[base:(base + 4 + len(blob))] = struct.pack("<I", len(blob)) + blob
+        for c, key, offset in arrays:
+            np.copyto(self._view(slot, offset, rec.samples),
+                      rec.buffers[c][key][rec.start:(rec.start + rec.samples)])
+        return True
+
+    def load(self, slot, copy=False):
+        """ Rebuilds the record stored in the slot
+        :param slot: slot index received from the queue
+        :type slot: int
+        :param copy: whether to copy buffers out of the slot, otherwise they are only valid until release
+        :type copy: bool
+        :rtype: StreamingTapeRecording
+        """
+        base = slot * self.slot_size
+        size = struct.unpack("<I", self._memory[base:(base + 4)])[0]
+        rec, arrays = cPickle.loads(self._memory[(base + 4):(base + 4 + size)])
+        for c, key, offset in arrays:
+            data = self._view(slot, offset, rec.bufflen)
+            rec.buffers[c][key] = data.copy() if copy else data
+        return rec
+
+    def close(self):
+        self._free._buffer.clear()
+        self._free.close()
+        self._free.join_thread()
+
+
+class StreamingTapeRecordPool(object):
+    """ Pool of records with preallocated buffers, reused for the side copies of the streaming callbacks
+    and for the copies StreamingTape.record queues for the processor
+
+    Records are shaped after the template given to acquire, one buffer of bufflen samples
+    for each line and mode of it. Released records have to be consumed by the tape already,
+    StreamingTape.record copies the samples before it returns. Only records handed out by
+    acquire are taken back, any other record given to release is left untouched.
+    """
+
+    def __init__(self, size=4):
+        """
+        :param size: number of free records kept for reuse
+        :type size: int
+        """
+        self.size = size
+        self.stats = {"allocated": 0, "reused": 0}
+        self._free = []
+        self._owned = weakref.WeakValueDictionary()
+        self._lock = th.Lock()
+
+    @staticmethod
+    def _fits(rec, template):
+        if len(rec.buffers) != len(template.buffers):
+            return False
+        for c in template.buffers:
+            if c not in rec.buffers:
+                return False
+            for key in template.buffers[c]:
+                if isinstance(template.buffers[c][key], np.ndarray) \
+                        and (key not in rec.buffers[c] or len(rec.buffers[c][key]) != template.bufflen):
+                    return False
+        return True
+
+    def acquire(self, template):
+        """ Takes a free record fitting the template or makes a new one
+        :param template: record the buffers are shaped after
+        :type template: StreamingTapeRecording
+        :returns: record with buffers of template bufflen samples, contents undefined
+        :rtype: StreamingTapeRecording
+        """
+        with self._lock:
+            while len(self._free) > 0:
+                rec = self._free.pop()
+                if self._fits(rec, template):
+                    self.stats["reused"] += 1
+                    self._owned[id(rec)] = rec
+                    return rec
+        rec = StreamingTapeRecording()
+        allocated = 0
+        for c in template.buffers:
+            rec.buffers[c] = {}
+            for key in template.buffers[c]:
+                if isinstance(template.buffers[c][key], np.ndarray):
+                    rec.buffers[c][key] = np.empty(shape=(template.bufflen,), dtype=c_int16)
+                    allocated += 1
+        with self._lock:
+            self.stats["allocated"] += allocated
+            self._owned[id(rec)] = rec
+        return rec
+
+    def release(self, rec):
+        """ Gives the record back for reuse, dropped when the pool is full
+        :param rec: record taken by acquire, None and records not handed out by the pool are ignored
+        :type rec: StreamingTapeRecording, None
+        """
+        if rec is None:
+            return
+        with self._lock:
+            if self._owned.get(id(rec)) is not rec:
+                return
+            del self._owned[id(rec)]
+            if len(self._free) >= self.size:
+                return
+            for key in rec.keys():
+                if key != "buffers":
+                    del rec[key]
+            self._free.append(rec)
 
 
 class StreamingTapeRecording(dict2class):
@@ -360,49 +2656,123 @@ class StreamingTapeRecording(dict2class):
         self.bufflen = 0
         self.buffers = {}
 
-    def side_copy(self):
+    def side_copy(self, pool=None):
+        """ Copy of the record samples starting at 0, detached from the buffers the device fills
+        :param pool: pool to take the copy from, None to allocate new buffers
+        :type pool: StreamingTapeRecordPool, None
+        :returns: copy or None on failure
+        :rtype: StreamingTapeRecording, None
+        """
         try:
-            clone = StreamingTapeRecording()
+            clone = StreamingTapeRecording() if pool is None else pool.acquire(self)
             for key in self.keys():
                 if not isinstance(self[key], dict):
                     clone[key] = self[key]
-                else:
+                    continue
+                if key not in clone:
                     clone[key] = {}
-                    for row in self[key].keys():
-                        if not isinstance(self[key][row], dict):
-                            clone[key][row] = self[key][row]
+                for row in self[key].keys():
+                    if not isinstance(self[key][row], dict):
+                        clone[key][row] = self[key][row]
+                        continue
+                    if row not in clone[key]:
+                        clone[key][row] = {}
+                    for data in self[key][row].keys():
+                        if not isinstance(self[key][row][data], np.ndarray):
+                            clone[key][row][data] = self[key][row][data]
                         else:
-                            clone[key][row] = {}
-                            for data in self[key][row].keys():
-                                if not isinstance(self[key][row][data], np.ndarray):
-                                    clone[key][row][data] = self[key][row][data]
-                                else:
-                                    clone[key][row][data] = np.empty(shape=(self.bufflen,), dtype=c_int16)
-                                    clone[key][row][data][:self.samples] = \
-                                        self[key][row][data][self.start:(self.start + self.samples)]
+                            if data not in clone[key][row]:
+                                clone[key][row][data] = np.empty(shape=(self.bufflen,), dtype=c_int16)
+                            np.copyto(clone[key][row][data][:self.samples],
+                                      self[key][row][data][self.start:(self.start + self.samples)])
             clone.start = 0
         except Exception as ex:
             print "Tape Side Copy(%d):" % sys.exc_info()[-1].tb_lineno, ex.message
             clone = None
         return clone
 
-    def top_up(self, rec):
+    def envelope(self, factor):
+        """ Decimated copy of the record keeping min and max of each block of samples
+        :param factor: number of samples represented by each min/max pair, even
+        :type factor: int
+        :returns: record with min and max interleaved in its buffers and degraded set to the factor
+        :rtype: StreamingTapeRecording
+        """
+        clone = StreamingTapeRecording()
+        for key in self.keys():
+            if key != "buffers":
+                clone[key] = self[key]
+        clone.buffers = {}
+        blocks = (self.samples + factor - 1) // factor
+        for c in self.buffers:
+            clone.buffers[c] = {}
+            for key in self.buffers[c]:
+                if not isinstance(self.buffers[c][key], np.ndarray):
+                    clone.buffers[c][key] = self.buffers[c][key]
+                    continue
+                data = np.empty(shape=(blocks * factor,), dtype=c_int16)
+                data[:self.samples] = self.buffers[c][key][self.start:(self.start + self.samples)]
+                data[self.samples:] = data[self.samples - 1] if self.samples > 0 else 0
+                data = data.reshape((blocks, factor))
+                env = np.empty(shape=(2 * blocks,), dtype=c_int16)
+                env[0::2] = data.min(axis=1)
+                env[1::2] = data.max(axis=1)
+                clone.buffers[c][key] = env
+        clone.start = 0
+        clone.degraded = factor
+        return clone
+
+    def expand(self):
+        """ Brings degraded record back to its sample count, each min and max held for half of its block """
+        for c in self.buffers:
+            for key in self.buffers[c]:
+                if isinstance(self.buffers[c][key], np.ndarray) and len(self.buffers[c][key]) < self.samples:
+                    data = np.empty(shape=(max(self.bufflen, self.samples),), dtype=c_int16)
+                    data[:self.samples] = expand_envelope(self.buffers[c][key], self.degraded, self.samples)
+                    self.buffers[c][key] = data
+        self.start = 0
+
+    def expanded(self):
+        """ Copy of degraded record brought back to its sample count, the envelope itself is left as it is
+        :returns: expanded copy, the record itself when it is not degraded
+        :rtype: StreamingTapeRecording
+        """
+        if "degraded" not in self:
+            return self
+        clone = StreamingTapeRecording()
+        for key in self.keys():
+            if key != "buffers":
+                clone[key] = self[key]
+        clone.buffers = dict([(c, dict(self.buffers[c])) for c in self.buffers])
+        clone.expand()
+        return clone
+
+    def top_up(self, rec, pool=None):
+        """ Appends samples of the record until the buffers are full
+        :param rec: record to take the samples from
+        :type rec: StreamingTapeRecording
+        :param pool: pool to take the copy of the samples left over from, None to allocate new buffers
+        :type pool: StreamingTapeRecordPool, None
+        :returns: copy of the samples which did not fit, taken from the pool when given, None if all of them did
+        :rtype: StreamingTapeRecording, None
+        """
+        left = None
         try:
             if not isinstance(rec, StreamingTapeRecording) or self.samples > self.bufflen:
                 return None
             if self.samples == self.bufflen:
-                return rec
+                return rec.side_copy(pool)
             if self.start != 0:
+                """ moved in place, overlapping copies are safe in numpy """
                 for c in self.buffers.keys():
                     for key in self.buffers[c].keys():
                         if isinstance(self.buffers[c][key], np.ndarray):
-                            a = np.empty(shape=(self.bufflen, ), dtype=c_int16)
-                            a[:self.samples] = self.buffers[c][key][self.start:(self.start + self.samples)]
-                            self.buffers[c][key] = a
+                            a = self.buffers[c][key]
+                            np.copyto(a[:self.samples], a[self.start:(self.start + self.samples)])
                 self.start = 0
             if self.samples + rec.samples > self.bufflen:
                 left_off = rec.samples - (self.bufflen - self.samples)
-                left = rec.side_copy()
+                left = rec.side_copy(pool)
                 left.start = rec.samples - left_off
                 left.samples = left_off
                 top_to = self.bufflen
@@ -436,18 +2806,38 @@ class StreamingTapeRecording(dict2class):
             self.samples = top_to
         except Exception as ex:
             print "records top_up(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+        return left
 
 
     @staticmethod
-    def read_chunk(chunk):
+    def read_chunk(chunk, index=None, lazy=False, cache=None):
+        """ Reads record from the tape file
+        :param chunk: record group, or chapter group of the layout 2 and 3 tapes
+        :type chunk: tables.Group
+        :param index: record index, used with layout 2 and 3 chapters only
+        :type index: int, None
+        :param lazy: whether to fill the buffers with StreamingTapeChunk proxies reading the samples on access,
+                     degraded records are always read whole and brought back to their sample count
+        :type lazy: bool
+        :param cache: cache of the samples read by the lazy buffers, None to read them on every access
+        :type cache: StreamingTapeCache, None
+        :returns: record or None if not found
+        :rtype: StreamingTapeRecording, None
+        """
         if not isinstance(chunk, tb.group.Group):
             return None
+        if chapter_layout(chunk) != 1:
+            return StreamingTapeRecording._read_stream_chunk(chunk, index, lazy, cache)
         res = StreamingTapeRecording()
         for attr in chunk._v_parent._v_attrs._v_attrnamesuser:
-            res[attr] = chunk._v_parent._v_attrs[attr]
+            if attr != "precondition":
+                res[attr] = chunk._v_parent._v_attrs[attr]
         for attr in chunk._v_attrs._v_attrnamesuser:
-            res[attr] = chunk._v_attrs[attr]
+            if attr != "shift":
+                res[attr] = chunk._v_attrs[attr]
         res["index"] = int(chunk._v_name.replace("record", ""))
+        stages = chapter_precondition(chunk._v_parent)
+        shift = int(chunk._v_attrs["shift"]) if "shift" in chunk._v_attrs else 0
         res["buffers"] = {}
         for channel in chunk._v_file.listNodes(chunk):
             c = None
@@ -460,30 +2850,255 @@ class StreamingTapeRecording(dict2class):
                 for attr in channel._v_attrs._v_attrnamesuser:
                     res["buffers"][c][attr] = channel._v_attrs[attr]
                 for a in chunk._v_file.listNodes(channel):
-                    res["buffers"][c][a._v_name] = np.array(a.read())
+                    if lazy and "degraded" not in res:
+                        res["buffers"][c][a._v_name] = StreamingTapeChunk(a, 0, a.nrows, cache=cache,
+                                                                          precondition=(stages, shift))
+                    else:
+                        res["buffers"][c][a._v_name] = restore(np.array(a.read()), stages, shift)
+        if "degraded" in res:
+            res.expand()
         return res
 
+    @staticmethod
+    def _read_stream_chunk(chapter, index, lazy=False, cache=None):
+        if index is None or "records" not in chapter:
+            return None
+        table = chapter.records
+        if index < 0 or index >= table.nrows:
+            return None
+        row = table[index]
+        res = StreamingTapeRecording()
+        for attr in chapter._v_attrs._v_attrnamesuser:
+            if attr != "precondition":
+                res[attr] = chapter._v_attrs[attr]
+        res["index"] = index
+        stages = chapter_precondition(chapter)
+        shift = int(row["shift"]) if "shift" in table.colnames else 0
+        res["timestamp"] = float(row["timestamp"])
+        res["samples"] = int(row["samples"])
+        if "triggerSet" in res and res["triggerSet"]:
+            res["triggered"] = bool(row["triggered"])
+            res["triggerAt"] = int(row["triggerAt"])
+        if "degraded" in table.colnames and row["degraded"] > 0:
+            res["degraded"] = int(row["degraded"])
+        offset = int(row["offset"])
+        res["buffers"] = {}
+        for channel in chapter._v_file.listNodes(chapter, classname="Group"):
+            if channel._v_name.startswith("channel"):
+                c = int(channel._v_name.replace("channel", ""))
+            elif channel._v_name.startswith("port"):
+                c = int(channel._v_name.replace("port", "")) | 128
+            else:
+                continue
+            res["buffers"][c] = {}
+            for attr in channel._v_attrs._v_attrnamesuser:
+                if attr != "codec":
+                    res["buffers"][c][attr] = channel._v_attrs[attr]
+            res["buffers"][c]["overflow"] = (int(row["overflow"]) & line_bit(c)) > 0
+            for a in chapter._v_file.listNodes(channel):
+                if isinstance(a, tb.VLArray):
+                    chunk = StreamingTapeChunk(a, 0, res["samples"], index, channel._v_attrs["codec"], cache,
+                                               (stages, shift))
+                else:
+                    chunk = StreamingTapeChunk(a, offset, res["samples"], cache=cache, precondition=(stages, shift))
+                res["buffers"][c][a._v_name] = chunk if lazy and "degraded" not in res else chunk.read()
+        if "degraded" in res:
+            res.expand()
+        return res
+
+
+class StreamingTapeChunk(object):
+    """ Proxy of single record buffer in the tape file, samples are read and decompressed only when accessed
+
+    Slicing without cache reads only the HDF5 chunks holding the requested samples,
+    pickled proxies turn into plain arrays.
+    """
+
+    def __init__(self, node, start, length, row=None, codec=None, cache=None, precondition=None):
+        """
+        :param node: array holding the samples
+        :type node: tables.Leaf
+        :param start: offset of the first sample in the array
+        :type start: int
+        :param length: number of samples
+        :type length: int
+        :param row: row of the pre-compressed chunk in layout 3 variable length array, None otherwise
+        :type row: int, None
+        :param codec: codec of the pre-compressed chunk
+        :type codec: str, None
+        :param cache: cache shared by the proxies, None to read on every access
+        :type cache: StreamingTapeCache, None
+        :param precondition: preconditioning stages and shift of the samples, None if stored as they are
+        :type precondition: tuple, None
+        """
+        if precondition is not None and precondition[0] is None:
+            precondition = None
+        self.node = node
+        self.start = start
+        self.length = length
+        self.row = row
+        self.codec = codec
+        self.cache = cache
+        self.precondition = precondition
+        self.dtype = np.dtype(c_int16)
+
+    @property
+    def shape(self):
+        return self.length,
+
+    def __len__(self):
+        return self.length
+
+    def read(self):
+        """ All samples of the buffer
+        :rtype: np.ndarray
+        """
+        if self.cache is not None:
+            return self.cache.get((self.node._v_file.filename, self.node._v_pathname, self.start, self.row),
+                                  self._load)
+        return self._load()
+
+    def _load(self):
+        if self.row is not None:
+            data = decode_chunk(self.node[self.row], self.codec)
+        else:
+            data = self.node[self.start:(self.start + self.length)]
+        if self.precondition is not None:
+            data = restore(data, *self.precondition)
+        return data
+
+    def __getitem__(self, item):
+        if self.cache is None and self.row is None and self.precondition is None:
+            if isinstance(item, slice):
+                lo, hi, step = item.indices(self.length)
+                if step > 0:
+                    return self.node[(self.start + lo):(self.start + max(hi, lo)):step]
+            elif isinstance(item, (int, long)) and -self.length <= item < self.length:
+                return self.node[self.start + (item % self.length)]
+        return self.read()[item]
+
+    def __array__(self, dtype=None):
+        data = self.read()
+        return data if dtype is None else data.astype(dtype)
+
+    def __reduce__(self):
+        return np.array, (self.read(),)
+
+    def __repr__(self):
+        return "StreamingTapeChunk(%s[%d:%d]%s)" % (self.node._v_pathname, self.start, self.start + self.length,
+                                                   "" if self.row is None else " row %d" % self.row)
+
+
+class StreamingTapeCache(object):
+    """ Least recently used cache of the samples read by StreamingTapeChunk proxies """
+
+    def __init__(self, size=67108864):
+        """
+        :param size: maximum size of the cached samples in bytes
+        :type size: int
+        """
+        self.size = size
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = th.Lock()
+        self._chunks = collections.OrderedDict()
+
+    def get(self, key, load):
+        """ Cached samples for the key, read with load on a miss
+        :returns: read only array shared by all readers of the key
+        :rtype: np.ndarray
+        """
+        with self._lock:
+            if key in self._chunks:
+                data = self._chunks.pop(key)
+                self._chunks[key] = data
+                self.hits += 1
+                return data
+            self.misses += 1
+        data = load()
+        data.flags.writeable = False
+        with self._lock:
+            if data.nbytes <= self.size and key not in self._chunks:
+                self._chunks[key] = data
+                self.used += data.nbytes
+                while self.used > self.size:
+                    self.used -= self._chunks.popitem(last=False)[1].nbytes
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._chunks.clear()
+            self.used = 0
+
 
 class RecordsProcessor(multiprocessing.Process):
 
-    def __init__(self, controlq, readq, writeq, watchdogoutq, watchdoginq):
+    def __init__(self, controlq, readq, writeq, parentpipe, alivepipe, ring=None, notifyq=None, cursorq=None,
+                 taken=None, backlog=0):
         self._controlq = controlq
         self._readq = readq
         self._writeq = writeq
-        self._watchdogInq = watchdoginq
-        self._watchdogOutq = watchdogoutq
-        self._watchdogEvent = None
-        self._watchdogThread = None
+        self._taken = taken
+        self._backlogSize = backlog
+        self._backlog = None
+        self._backlogReady = None
+        self._notifyq = notifyq
+        self._cursorq = cursorq
+        self._cursors = {}
+        self._notify = False
+        self._ended = set()
+        self._parentPipe = parentpipe
+        self._alivePipe = alivepipe
+        self._ring = ring
+        self._inbox = None
+        self._inflight = None
+        self._pool = None
+        self._poolStart = None
+        self._pending = collections.deque()
+        self._workerStats = {}
+        self._chunkCodecs = {}
         self._filename = None
         self._stats = False
         self._stats_store = dict()
         self._opened = False
         self._memstore = False
         self._records = {}
+        self._memindex = {}
+        self._retention = None
+        self._retained = {}
+        self._overview = None
+        self._overviewState = {}
+        self._overviewArrays = {}
+        self._journal = None
+        self._journalFile = None
+        self._journalSync = None
+        self._journalPending = []
+        self._journalFlushed = 0.0
+        self._journalStats = {"flushes": 0, "entries": 0, "time": 0.0}
+        self._precondition = None
+        self._summary = False
+        self._held = None
+        self._replay = collections.deque()
+        self._rollover = None
+        self._manifest = None
+        self._segments = []
+        self._segmentPending = 0
+        self._segmentFile = None
+        self._writeShift = 0
         self._fhandle = None
         self._writeChapter = ""
         self._writeChapterNode = None
         self._writeChunk = None
+        self._writeLines = {}
+        self._writeArrays = {}
+        self._writeOffset = 0
+        self._writeFilters = {}
+        self._layout = 1
+        self._compression = None
+        self._channelCompression = {}
+        self._codecStats = {}
+        self._trialFile = None
         self._readChapter = ""
         self._readChapterNode = None
         self._readChunk = None
@@ -494,75 +3109,270 @@ class RecordsProcessor(multiprocessing.Process):
         self._purge = False
         super(RecordsProcessor, self).__init__()
 
-    def _watchdog_worker(self, args):
-        while not self._watchdogEvent.wait(0.1):
-            try:
-                keepalive = self._watchdogInq.get(True, 2.0)
-            except Queue.Empty:
-                keepalive = None
-            if keepalive is not None:
-                try:
-                    self._watchdogOutq.put(True)
-                except Exception as ex:
-                    print "Dogwatch Send(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+    def _control_feeder(self):
+        while True:
+            self._inbox.put(("control", self._controlq.get()))
+
+    def _write_feeder(self):
+        """ Hands records over as the writer makes room for them, so that the write queue keeps the backlog """
+        while True:
+            self._inflight.acquire()
+            if self._backlog is None:
+                item = self._writeq.get()
             else:
-                self._watchdogEvent.set()
-        self._controlq.put({"Command": "Exit", "args": None})
+                with self._backlogReady:
+                    while len(self._backlog) == 0:
+                        self._backlogReady.wait()
+                    item = self._backlog.popleft()
+            self._inbox.put(("write", item))
+            if self._taken is not None:
+                self._taken[0] += 1
+
+    def _backlog_feeder(self):
+        """ Takes the records off the write queue as they come for drop_oldest, keeping at most backlog of them
+        for the writer and dropping the oldest beyond that, end of chapter marker is never dropped nor moved
+        """
+        while True:
+            item = self._writeq.get()
+            with self._backlogReady:
+                self._backlog.append(item)
+                while len(self._backlog) > self._backlogSize and self._backlog[0] is not None:
+                    self._f_drop(self._backlog.popleft())
+                self._backlogReady.notify()
+
+    def _f_drop(self, item):
+        if isinstance(item, int):
+            samples = self._ring.load(item).samples
+            self._ring.release(item)
+        else:
+            samples = item.samples
+        self._taken[2] += samples
+        self._taken[1] += 1
+
+    def _parent_watch(self):
+        """ Turns EOF on the parent pipe, when the tape owner is gone, into Exit command """
+        try:
+            self._parentPipe.recv()
+        except (EOFError, IOError):
+            pass
+        self._inbox.put(("control", {"Command": "Exit", "args": None}))
 
     def run(self):
         try:
-            self._watchdogEvent = th.Event()
-            if self._watchdogEvent.is_set():
-                self._watchdogEvent.clear()
-            self._watchdogThread = th.Thread(target=self._watchdog_worker, args=(None,))
-            ctrl = None
-            rec = None
+            """ keep only our ends of the pipes, the parent one would otherwise never see EOF """
+            self._parentPipe[1].close()
+            self._alivePipe[0].close()
+            self._parentPipe = self._parentPipe[0]
+            self._alivePipe = self._alivePipe[1]
+            self._inbox = Queue.Queue()
+            self._inflight = th.Semaphore(1)
+            feeders = [self._control_feeder, self._write_feeder, self._parent_watch]
+            if self._backlogSize > 0:
+                self._backlog = collections.deque()
+                self._backlogReady = th.Condition()
+                feeders.append(self._backlog_feeder)
+            for worker in feeders:
+                feeder = th.Thread(target=worker)
+                feeder.daemon = True
+                feeder.start()
             while True:
-                try:
-                    ctrl = self._controlq.get(False)
-                except Queue.Empty:
-                    ctrl = None
-
-                if ctrl is not None and isinstance(ctrl, dict) and "Command" in ctrl:
-                    cmd = ctrl["Command"]
+                if len(self._replay) > 0 and self._held is None:
+                    source, msg = self._replay.popleft()
+                else:
+                    try:
+                        source, msg = self._inbox.get(True, self._journal_timeout())
+                    except Queue.Empty:
+                        self._f_journal(force=True)
+                        continue
+                if self._held is not None and not (source == "control" and isinstance(msg, dict)
+                                                   and msg.get("Command") in ("Hold", "Release", "Exit")):
+                    self._held.append((source, msg))
+                    continue
+                if source == "control":
+                    if msg is None or not isinstance(msg, dict) or "Command" not in msg:
+                        continue
+                    cmd = msg["Command"]
                     if cmd == "Next":
-                        self._f_next(ctrl["args"])
+                        self._f_next(msg["args"])
                     elif cmd == "Last":
                         self._f_last()
                     elif cmd == "Open":
-                        self._f_open(ctrl["args"])
+                        self._f_open(msg["args"])
                     elif cmd == "Chapters":
                         self._f_chapters()
+                    elif cmd == "Seek":
+                        self._f_seek(msg["args"])
+                    elif cmd == "Range":
+                        self._f_range(msg["args"])
+                    elif cmd == "Index":
+                        self._f_chapter_index(msg["args"])
+                    elif cmd == "Fetch":
+                        self._f_fetch(msg["args"])
+                    elif cmd == "Cursor":
+                        self._f_cursor(msg["args"])
+                    elif cmd == "Overview":
+                        self._f_overview_read(msg["args"])
+                    elif cmd == "Triggers":
+                        self._f_triggers(msg["args"])
+                    elif cmd == "Windows":
+                        self._f_windows(msg["args"])
+                    elif cmd == "Summary":
+                        self._f_summary(msg["args"])
                     elif cmd == "Stats":
                         self._f_stats()
-                    elif cmd == "Watchdog":
-                        self._watchdogThread.start()
+                    elif cmd == "ProcessorStats":
+                        self._f_processor_stats()
+                    elif cmd == "Hold":
+                        self._f_hold()
+                    elif cmd == "Release":
+                        self._f_release()
                     elif cmd == "Exit":
+                        self._f_release()
+                        """ nobody waits for the held requests anymore, only the records are written """
+                        while len(self._replay) > 0:
+                            source, msg = self._replay.popleft()
+                            if source == "write":
+                                self._f_write(msg)
+                            elif source == "compressed":
+                                self._f_commit()
+                        self._f_commit(wait=True)
+                        if self._notifyq is not None:
+                            self._notifyq.put(None)
+                        if self._cursorq is not None:
+                            self._cursorq.put(None)
                         self._readq.put(None)
                         break
-
-                if self._opened:
-                    received = True
-                    try:
-                        rec = self._writeq.get(False)
-                    except Queue.Empty:
-                        received = False
-                        rec = None
-                    if rec is not None:
-                        self._f_record(rec, received)
-
-                if rec is None and ctrl is None:
-                    sleep(0.001)
+                elif source == "write":
+                    self._f_write(msg)
+                elif source == "compressed":
+                    self._f_commit()
         except Exception as ex:
             print "Tape Proc(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
             return
         finally:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
             if self._fhandle is not None:
                 self._fhandle.flush()
                 self._fhandle.close()
-            if not self._watchdogEvent.is_set():
-                self._watchdogEvent.set()
-            self._watchdogThread.join()
+            self._f_journal_close()
+            if self._rollover is not None and len(self._segments) > 0:
+                self._segments[-1]["closed"] = True
+                self._f_manifest()
+            if self._segmentFile is not None:
+                self._segmentFile.close()
+            if self._trialFile is not None:
+                self._trialFile.close()
+
+    def _f_hold(self):
+        """ Commits and closes the tape file so that others can open it, incoming records wait until released """
+        result = None
+        try:
+            if self._opened and not self._memstore and self._held is None:
+                self._f_commit(wait=True)
+                """ nothing is left due for the journal while the file is closed """
+                self._f_journal(force=True)
+                if self._writeChapterNode is not None:
+                    self._writeChapterNode._f_close()
+                self._writeChapterNode = None
+                self._writeLines = {}
+                self._writeArrays = {}
+                self._overviewArrays = {}
+                self._readChapterNode = None
+                self._fhandle.close()
+                self._fhandle = None
+                self._held = []
+                result = "OK"
+        except Exception as ex:
+            print "Tape Hold(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+            result = None
+        finally:
+            self._readq.put(result)
+
+    def _f_release(self):
+        """ Reopens the tape file closed by hold, everything received meanwhile is handled next in order """
+        held = self._held
+        self._held = None
+        if held is None:
+            return
+        self._fhandle = tb.openFile(self._filename, mode="a")
+        if self._writeChunk is not None:
+            self._writeChapterNode = self._fhandle.getNode("/", self._writeChapter, "Group")
+        if self._readChapter in self._fhandle.root:
+            self._readChapterNode = self._fhandle.getNode("/", self._readChapter, "Group")
+        self._replay.extend(held)
+
+    def _f_write(self, rec):
+        """ Writes the record or hands it to the compression pool, gives the room back to the feeder once done """
+        slot = None
+        if isinstance(rec, int):
+            slot = rec
+            rec = self._ring.load(slot, copy=self._memstore) if self._opened else None
+        if self._opened and self._pool is not None:
+            self._f_compress(rec, slot)
+            return
+        try:
+            if self._opened:
+                self._f_record(rec, True)
+        finally:
+            if slot is not None:
+                self._ring.release(slot)
+            self._inflight.release()
+
+    def _f_compress(self, rec, slot):
+        """ Queues the record for compression, records are committed in order by _f_commit """
+        job = {"rec": rec, "slot": slot, "codecs": None, "result": None}
+        if rec is not None:
+            job["codecs"] = dict([(c, self._codec(rec, c)) for c in rec.buffers])
+            job["result"] = self._pool.apply_async(_compress_task,
+                                                   ((slot, None if slot is not None else rec, job["codecs"],
+                                                     self._precondition),),
+                                                   callback=self._compressed)
+        self._pending.append(job)
+        self._f_commit()
+
+    def _compressed(self, result):
+        self._inbox.put(("compressed", None))
+
+    def _f_commit(self, wait=False):
+        """ Writes compressed records from the head of the pending queue, in the order they were received """
+        while len(self._pending) > 0:
+            job = self._pending[0]
+            if job["result"] is not None and not job["result"].ready():
+                if not wait:
+                    break
+                job["result"].wait()
+            self._pending.popleft()
+            try:
+                chunks = None
+                shift = None
+                if job["result"] is not None:
+                    chunks, shift, pid, busy = job["result"].get()
+                    if pid not in self._workerStats:
+                        self._workerStats[pid] = {"busy": 0.0, "tasks": 0}
+                    self._workerStats[pid]["busy"] += busy
+                    self._workerStats[pid]["tasks"] += 1
+                    if chunks is None:
+                        chunks, shift = _compress_task((None, job["rec"], job["codecs"], self._precondition))[:2]
+                self._f_record(job["rec"], True, chunks, job["codecs"], shift)
+            finally:
+                if job["slot"] is not None:
+                    self._ring.release(job["slot"])
+                self._inflight.release()
+
+    def _codec(self, rec, line):
+        """ Codec of the pre-compressed chunks for the line in the record chapter """
+        chapter = rec.chapter if rec.chapter is not None else self._writeChapter
+        if (chapter, line) not in self._chunkCodecs:
+            compression = self._channelCompression.get(line, self._compression)
+            if compression == "auto":
+                data = [rec.buffers[line][d] for d in rec.buffers[line] if isinstance(rec.buffers[line][d], np.ndarray)]
+                data = data[0][rec.start:(rec.start + rec.samples)] if len(data) > 0 else np.empty(0, dtype=c_int16)
+                data = precondition(data, self._precondition, record_shift(rec, self._precondition))
+                compression = self._pick_codec(line, data, chapter)
+            self._chunkCodecs[(chapter, line)] = chunk_codec(compression)
+        return self._chunkCodecs[(chapter, line)]
 
     def _f_next(self, args):
         if not self._opened or self._waiting or args["chapter"] is None:
@@ -575,7 +3385,7 @@ class RecordsProcessor(multiprocessing.Process):
                 if self._memstore:
                     if self._readChapter not in self._records:
                         self._readq.put(None)
-                else:
+                elif self._rollover is None:
                     self._readChapterNode = None
                     try:
                         self._readChapterNode = self._fhandle.getNode("/", self._readChapter, "Group")
@@ -586,20 +3396,19 @@ class RecordsProcessor(multiprocessing.Process):
                 self._readChunk = 0
             else:
                 self._readChunk += 1
+            if self._readChapter in self._retained and self._readChunk < self._retained[self._readChapter]["first"]:
+                self._readChunk = self._retained[self._readChapter]["first"]
             if self._memstore and self._readChapter in self._records:
                 if self._readChunk in self._records[self._readChapter]:
-                    rec = self._records[self._readChapter][self._readChunk]
+                    rec = self._records[self._readChapter][self._readChunk].expanded()
                     if args["purge"]:
                         del(self._records[self._readChapter][self._readChunk])
+            elif self._rollover is not None:
+                rec = self._fetch(self._readChapter, self._readChunk)
+                if isinstance(rec, basestring):
+                    rec = None
             elif self._readChapterNode is not None:
-                try:
-                    chunk = self._fhandle.getNode(self._readChapterNode,
-                                                  StreamingTape.recfmt % self._readChunk,
-                                                  "Group")
-                except Exception as ex:
-                    chunk = None
-                if chunk is not None:
-                    rec = StreamingTapeRecording().read_chunk(chunk)
+                rec = read_record(self._readChapterNode, self._readChunk)
 
             if rec is not None:
                 self._readq.put(rec)
@@ -618,22 +3427,22 @@ class RecordsProcessor(multiprocessing.Process):
             if self._opened and self._writeChunk is not None and self._writeChapter is not None:
                 if self._memstore:
                     if self._writeChunk in self._records[self._writeChapter]:
-                        last = self._records[self._writeChapter][self._writeChunk]
+                        last = self._records[self._writeChapter][self._writeChunk].expanded()
                 elif self._writeChapterNode is not None:
-                    chunk = None
-                    try:
-                        chunk = self._fhandle.getNode(self._writeChapterNode,
-                                                      StreamingTape.recfmt % self._writeChunk,
-                                                      "Group")
-                    except Exception as ex:
-                        chunk = None
-                    if chunk is not None:
-                        last = StreamingTapeRecording.read_chunk(chunk)
+                    last = read_record(self._writeChapterNode, self._writeChunk)
         except Exception as ex:
             print "Play Last(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
         finally:
             self._readq.put(last)
 
+    def _handoff(self, rec):
+        """ Record just written as handed to the readers waiting for it, detached from the ring slot,
+        degraded records brought back to their sample count
+        """
+        if "degraded" in rec:
+            return rec.expanded()
+        return rec if self._ring is None else rec.side_copy()
+
     def _f_open(self, args):
         if not self._opened:
             self._filename = args["filename"]
@@ -641,7 +3450,25 @@ class RecordsProcessor(multiprocessing.Process):
             if self._title is None or not isinstance(self._title, basestring):
                 self._title = strftime("PicoTape-%Y%m%d-%H%M%S")
             self._limit = args["limit"]
+            self._retention = args["retention"]
+            self._overview = args["overview"]
+            self._journal = args["journal"]
+            self._precondition = args["precondition"]
+            self._summary = args["summary"]
+            self._rollover = args["rollover"]
+            if self._rollover is not None:
+                self._manifest = self._filename
+                self._filename = segment_name(self._manifest, 0)
             self._overwrite = args["overwrite"]
+            self._layout = args["layout"]
+            self._compression = args["compression"]
+            self._channelCompression = args["channel_compression"]
+            if self._filename is not None and args["workers"] > 0:
+                self._layout = 3
+                self._pool = multiprocessing.Pool(args["workers"], _compress_init, (self._ring,))
+                self._poolStart = time()
+                for i in xrange(2 * args["workers"] - 1):
+                    self._inflight.release()
             if self._filename is not None:
                 self._fhandle = None
                 error = "OK"
@@ -652,7 +3479,13 @@ class RecordsProcessor(multiprocessing.Process):
                         error = "File %s exists" % self._filename
                     else:
                         self._fhandle = tb.openFile(self._filename, title=self._title, mode="w")
+                        if self._journal is not None:
+                            self._f_journal_open()
+                        if self._rollover is not None:
+                            self._f_segment()
                 except Exception as ex:
+                    if self._fhandle is not None:
+                        self._fhandle.close()
                     self._fhandle = None
                     error = ex.message
                 if self._fhandle is not None:
@@ -668,13 +3501,19 @@ class RecordsProcessor(multiprocessing.Process):
         if self._opened:
             if self._memstore:
                 self._readq.put(self._records.keys())
+            elif self._rollover is not None:
+                """ chapters written to the closed files of the rolling tape only are listed in the manifest """
+                names = set([node._v_name for node in self._fhandle.iterNodes("/", classname="Group")])
+                for segment in self._segments:
+                    names.update(segment["chapters"].keys())
+                self._readq.put(list(names))
             else:
                 self._readq.put([node._v_name for node in
                                  self._fhandle.iterNodes("/", classname="Group")])
         else:
             self._readq.put([])
 
-    def _f_record(self, rec, received):
+    def _f_record(self, rec, received, chunks=None, codecs=None, shift=None):
         if rec is not None and isinstance(rec, StreamingTapeRecording):
             if self._stats:
                 start_write = time()
@@ -685,16 +3524,26 @@ class RecordsProcessor(multiprocessing.Process):
                 else:
                     rec.chapter = strftime("%Y%m%d_%H%M%S", time())
             if self._writeChapter != rec.chapter or self._writeChunk is None:
+                self._f_notify(self._writeChapter)
                 self._writeChapter = rec.chapter
                 if self._stopped:
                     self._stopped = False
                 if self._memstore:
                     if rec.chapter not in self._records:
                         self._records[rec.chapter] = {}
+                        self._memindex[rec.chapter] = {"offset": [], "samples": [], "timestamp": [], "triggers": [],
+                                                       "summary": [], "base": 0}
+                    index = self._memindex[rec.chapter]
+                    self._writeOffset = index["offset"][-1] + index["samples"][-1] if len(index["offset"]) > 0 else 0
                 else:
                     if self._writeChapterNode is not None:
                         self._writeChapterNode._f_close()
                         self._writeChapterNode = None
+                    self._writeLines = {}
+                    self._writeArrays = {}
+                    self._writeFilters = {}
+                    self._overviewArrays = {}
+                    self._writeOffset = 0
                     try:
                         self._writeChapterNode = self._fhandle.getNode("/",
                                                                        self._writeChapter,
@@ -707,26 +3556,43 @@ class RecordsProcessor(multiprocessing.Process):
                                                                            "Group")
                         [self._writeChapterNode._f_setAttr(key, rec[key]) for key in
                          ("chapter", "interval", "units", "mode", "downsample", "device", "serial",
-                          "triggerSet", "triggerDirection", "triggerThreshold", "triggerSource")
+                          "triggerSet", "triggerDirection", "triggerThreshold", "triggerSource", "maxAdc")
                          if hasattr(rec, key)]
+                        self._writeChapterNode._f_setAttr("layout", self._layout)
+                        if self._precondition is not None:
+                            self._writeChapterNode._f_setAttr("precondition", ",".join(self._precondition))
+                    elif "records" in self._writeChapterNode:
+                        self._writeOffset = int(self._writeChapterNode.records.cols.samples[:].sum())
                 self._writeChunk = 0
                 if self._stats:
                     self._stats_store = dict()
             else:
                 self._writeChunk += 1
             rec["index"] = self._writeChunk
+            if self._rollover is not None:
+                rec["index"] += self._segment_parts(rec.chapter)[-1][1]
+            self._writeShift = shift if shift is not None else record_shift(rec, self._precondition)
             if self._waiting and rec.chapter == self._waitingChapter:
-                self._readq.put(rec)
+                self._readq.put(self._handoff(rec))
             if self._opened and self._memstore:
                 if not (self._waiting and self._purge):
                     self._records[rec.chapter][self._writeChunk] = rec
                 else:
                     self._purge = False
+                self._f_index(rec)
+            elif chapter_layout(self._writeChapterNode) == 2:
+                data_len = self._f_record_streams(rec)
+                self._f_index(rec)
+            elif chapter_layout(self._writeChapterNode) == 3:
+                data_len = self._f_record_chunks(rec, chunks, codecs)
+                self._f_index(rec)
             else:
                 chunk = self._fhandle.createGroup(self._writeChapterNode,
                                                   StreamingTape.recfmt % self._writeChunk)
                 [chunk._f_setAttr(key, rec[key]) for key in
-                 ("timestamp", "samples", "triggerAt", "triggered") if hasattr(rec, key)]
+                 ("timestamp", "samples", "triggerAt", "triggered", "degraded") if hasattr(rec, key)]
+                if self._precondition is not None:
+                    chunk._f_setAttr("shift", self._writeShift)
                 for c in rec["buffers"].keys():
                     if c & 128:
                         channel = self._fhandle.createGroup(chunk, "port%02d" % (c & 127))
@@ -736,25 +3602,852 @@ class RecordsProcessor(multiprocessing.Process):
                         if not isinstance(rec["buffers"][c][d], np.ndarray):
                             channel._f_setAttr(d, rec["buffers"][c][d])
                         else:
+                            data = precondition(rec["buffers"][c][d], self._precondition, self._writeShift)
+                            filters, chunkshape = self._filters(c, data[:rec.samples])
+                            if chunkshape is not None:
+                                chunkshape = (min(chunkshape, max(len(data), 1)),)
                             a = self._fhandle.createCArray(channel, d,
-                                                           atom=StreamingTape.atom, shape=rec["buffers"][c][d].shape,
-                                                           filters=StreamingTape.filters)
-                            a[:] = rec["buffers"][c][d][:]
+                                                           atom=StreamingTape.atom, shape=data.shape,
+                                                           filters=filters, chunkshape=chunkshape)
+                            a[:] = data
                             if self._stats:
                                 data_len += len(rec["buffers"][c][d])
                             a._f_close(True)
                     channel._f_close()
                 chunk._f_close()
+                self._f_index(rec)
+            self._f_retain(rec)
+            if self._overview is not None and not self._memstore:
+                self._f_overview(rec)
+            self._ended.discard(rec.chapter)
+            self._f_notify(rec.chapter)
+            self._f_cursor_wake(rec.chapter, rec)
             self._waiting = False
+            self._f_journal()
+            if self._rollover is not None:
+                self._f_roll(rec)
             if self._stats:
                 stop_write = time()
                 self._stats_store[self._writeChunk] = {"time": stop_write - start_write, "data_len": data_len}
+                if "timestamp" in rec:
+                    self._stats_store[self._writeChunk]["latency"] = stop_write - rec["timestamp"]
         elif received and rec is None:
+            self._f_journal(force=True)
+            self._ended.add(self._writeChapter)
+            self._f_notify(self._writeChapter)
+            self._f_cursor_wake(self._writeChapter)
             if self._waiting:
                 self._readq.put(None)
                 self._waiting = False
             else:
                 self._stopped = True
 
+    def _f_record_streams(self, rec):
+        """ Appends the record to the chapter arrays of the layout 2 tape, returns number of samples written """
+        chapter = self._writeChapterNode
+        data_len = 0
+        for c in rec["buffers"].keys():
+            if c not in self._writeLines:
+                name = line_node(c)
+                if name in chapter:
+                    self._writeLines[c] = chapter._f_get_child(name)
+                else:
+                    self._writeLines[c] = self._fhandle.createGroup(chapter, name)
+                    [self._writeLines[c]._f_setAttr(d, rec["buffers"][c][d]) for d in rec["buffers"][c]
+                     if d != "overflow" and not isinstance(rec["buffers"][c][d], np.ndarray)]
+            channel = self._writeLines[c]
+            for d in rec["buffers"][c]:
+                if isinstance(rec["buffers"][c][d], np.ndarray):
+                    data = precondition(rec["buffers"][c][d][rec.start:(rec.start + rec.samples)],
+                                        self._precondition, self._writeShift)
+                    if (c, d) not in self._writeArrays:
+                        if d in channel:
+                            self._writeArrays[(c, d)] = channel._f_get_child(d)
+                        else:
+                            filters, chunkshape = self._filters(c, data)
+                            self._writeArrays[(c, d)] = \
+                                self._fhandle.createEArray(channel, d, atom=StreamingTape.atom, shape=(0,),
+                                                           filters=filters,
+                                                           chunkshape=(chunkshape,) if chunkshape else None,
+                                                           expectedrows=max(rec.bufflen, 1) * 1000)
+                    self._writeArrays[(c, d)].append(data)
+                    data_len += rec.samples
+        return data_len
+
+    def _f_record_chunks(self, rec, chunks, codecs):
+        """ Appends pre-compressed record chunks to the layout 3 tape, returns number of samples written """
+        if chunks is None:
+            codecs = dict([(c, self._codec(rec, c)) for c in rec.buffers])
+            chunks = _compress_task((None, rec, codecs, self._precondition))[0]
+        chapter = self._writeChapterNode
+        data_len = 0
+        for c in rec["buffers"].keys():
+            if c not in self._writeLines:
+                name = line_node(c)
+                if name in chapter:
+                    self._writeLines[c] = chapter._f_get_child(name)
+                else:
+                    self._writeLines[c] = self._fhandle.createGroup(chapter, name)
+                    [self._writeLines[c]._f_setAttr(d, rec["buffers"][c][d]) for d in rec["buffers"][c]
+                     if d != "overflow" and not isinstance(rec["buffers"][c][d], np.ndarray)]
+                    self._writeLines[c]._f_setAttr("codec", codecs[c]["codec"])
+            channel = self._writeLines[c]
+            for d in rec["buffers"][c]:
+                if isinstance(rec["buffers"][c][d], np.ndarray):
+                    if (c, d) not in self._writeArrays:
+                        if d in channel:
+                            self._writeArrays[(c, d)] = channel._f_get_child(d)
+                        else:
+                            self._writeArrays[(c, d)] = self._fhandle.createVLArray(channel, d, tb.UInt8Atom(),
+                                                                                    expectedrows=1000)
+                    self._writeArrays[(c, d)].append(np.frombuffer(chunks[(c, d)], dtype=np.uint8))
+                    data_len += rec.samples
+        return data_len
+
+    def _f_index(self, rec):
+        """ Adds the record to the chapter index of sample offsets and timestamps """
+        timestamp = rec["timestamp"] if "timestamp" in rec else time()
+        trigger = None
+        if "triggered" in rec and rec["triggered"] and "triggerAt" in rec and rec["triggerAt"] >= 0:
+            trigger = (self._writeOffset + rec["triggerAt"], self._writeChunk, timestamp)
+        summary = record_summary(rec, self._writeChunk, timestamp) if self._summary else None
+        if self._memstore:
+            index = self._memindex[rec.chapter]
+            index["offset"].append(self._writeOffset)
+            index["samples"].append(rec.samples)
+            index["timestamp"].append(timestamp)
+            if trigger is not None:
+                index["triggers"].append(trigger)
+            if summary is not None:
+                index["summary"].append(summary)
+        else:
+            chapter = self._writeChapterNode
+            if "records" not in chapter:
+                self._fhandle.createTable(chapter, "records", StreamingTapeIndex)
+            overflow = 0
+            for c in rec["buffers"].keys():
+                if "overflow" in rec["buffers"][c] and rec["buffers"][c]["overflow"]:
+                    overflow |= line_bit(c)
+            row = (self._writeOffset, rec.samples, timestamp,
+                   rec["triggered"] if "triggered" in rec else False,
+                   rec["triggerAt"] if "triggerAt" in rec else -1, overflow,
+                   rec["degraded"] if "degraded" in rec else 0, self._writeShift)
+            if self._journalFile is not None:
+                self._journalPending.append((rec.chapter, self._writeChunk, chapter.records.nrows) + row)
+            chapter.records.append([row])
+            if trigger is not None:
+                if "triggers" not in chapter:
+                    self._fhandle.createTable(chapter, "triggers", StreamingTapeTrigger)
+                chapter.triggers.append([trigger])
+            if summary is not None:
+                if "summary" not in chapter:
+                    self._fhandle.createTable(chapter, "summary", StreamingTapeSummary, expectedrows=10000)
+                chapter.summary.append(summary)
+        self._writeOffset += rec.samples
+
+    def _f_journal_open(self):
+        """ Starts the journal, the tape file is synced through its own descriptor """
+        self._journalFile = open(journal_name(self._filename), "wb")
+        self._journalFile.write(journal_magic)
+        self._journalFile.flush()
+        os.fsync(self._journalFile.fileno())
+        self._journalSync = os.open(self._filename, os.O_RDWR)
+        self._journalFlushed = time()
+
+    def _f_journal_close(self):
+        """ The tape is consistent once closed, the journal is left behind only by crashes """
+        if self._journalFile is None:
+            return
+        self._journalFile.close()
+        self._journalFile = None
+        if self._journalSync is not None:
+            os.close(self._journalSync)
+            self._journalSync = None
+        os.remove(journal_name(self._filename))
+
+    def _f_segment(self):
+        """ Lists the newly opened file in the manifest of the rolling tape """
+        self._segments.append({"file": os.path.basename(self._filename), "closed": False, "opened": time(),
+                               "records": 0, "chapters": {}})
+        self._segmentPending = 0
+        self._f_manifest()
+
+    def _f_manifest(self):
+        """ Replaces the manifest of the rolling tape, readers never see it half written """
+        name = manifest_name(self._manifest)
+        with open(name + ".tmp", "w") as f:
+            json.dump({"title": self._title, "segments": self._segments}, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(name + ".tmp", name)
+
+    def _f_roll(self, rec):
+        """ Counts the record in the current file of the rolling tape, moves on to the next file once it is due """
+        segment = self._segments[-1]
+        if rec.chapter not in segment["chapters"]:
+            before = [s["chapters"][rec.chapter] for s in self._segments[:-1] if rec.chapter in s["chapters"]]
+            segment["chapters"][rec.chapter] = {"first": sum([c["records"] for c in before]),
+                                                "offset": sum([c["samples"] for c in before]),
+                                                "records": 0, "samples": 0}
+        chapter = segment["chapters"][rec.chapter]
+        chapter["records"] += 1
+        chapter["samples"] += rec.samples
+        segment["records"] += 1
+        due = segment["records"] >= self._rollover.get("records", sys.maxint) or \
+            time() - segment["opened"] >= self._rollover.get("seconds", float("inf"))
+        if not due and "bytes" in self._rollover:
+            """ samples cached by HDF5 are counted uncompressed, the file is flushed to know for sure """
+            self._segmentPending += sum([a.nbytes for line in rec.buffers.values() for a in line.values()
+                                         if isinstance(a, np.ndarray)])
+            if os.path.getsize(self._filename) + self._segmentPending >= self._rollover["bytes"]:
+                self._fhandle.flush()
+                self._segmentPending = 0
+                due = os.path.getsize(self._filename) >= self._rollover["bytes"]
+        if due:
+            self._f_rollover()
+
+    def _f_rollover(self):
+        """ Closes the current file of the rolling tape, readable by others from now on, and opens the next one """
+        self._f_journal(force=True)
+        if self._writeChapterNode is not None:
+            self._writeChapterNode._f_close()
+            self._writeChapterNode = None
+        self._fhandle.close()
+        self._fhandle = None
+        self._f_journal_close()
+        closed = self._segments[-1]
+        closed["closed"] = True
+        self._filename = segment_name(self._manifest, len(self._segments))
+        self._fhandle = tb.openFile(self._filename, title=self._title, mode="w")
+        if self._journal is not None:
+            self._f_journal_open()
+        self._writeChunk = None
+        self._readChapterNode = None
+        self._f_segment()
+
+    def _segment_parts(self, chapter):
+        """ Files of the rolling tape holding the chapter, the current one always last, with the index
+        of the first record and the offset of the first sample of the chapter in each of them
+        :rtype: list(tuple(dict, int, int))
+        """
+        parts = []
+        first = offset = 0
+        for segment in self._segments[:-1]:
+            if chapter in segment["chapters"]:
+                part = segment["chapters"][chapter]
+                parts.append((segment, part["first"], part["offset"]))
+                first = part["first"] + part["records"]
+                offset = part["offset"] + part["samples"]
+        parts.append((self._segments[-1], first, offset))
+        return parts
+
+    def _segment_group(self, segment, chapter):
+        """ Chapter group in the file of the rolling tape, closed files are opened read-only on demand,
+        None if the file does not hold the chapter
+        """
+        if not segment["closed"]:
+            handle = self._fhandle
+        else:
+            name = os.path.join(os.path.dirname(self._manifest), segment["file"])
+            if self._segmentFile is None or self._segmentFile.filename != name:
+                if self._segmentFile is not None:
+                    self._segmentFile.close()
+                self._segmentFile = tb.openFile(name, mode="r")
+            handle = self._segmentFile
+        if "/" + chapter not in handle:
+            return None
+        return handle.getNode("/", chapter, "Group")
+
+    def _journal_timeout(self):
+        """ Time left until the pending journal entries are due, None when nothing is waiting """
+        if self._journalFile is None or len(self._journalPending) == 0 or "seconds" not in self._journal:
+            return None
+        return max(self._journalFlushed + self._journal["seconds"] - time(), 0.001)
+
+    def _f_journal(self, force=False):
+        """ Flushes the tape file and appends the records it now holds for sure to the journal,
+        once the cadence is due or when forced
+        """
+        if self._journalFile is None or len(self._journalPending) == 0:
+            return
+        if not force and len(self._journalPending) < self._journal.get("records", sys.maxint) and \
+                time() - self._journalFlushed < self._journal.get("seconds", float("inf")):
+            return
+        start = time()
+        self._fhandle.flush()
+        os.fsync(self._journalSync)
+        self._journalFile.write(np.array(self._journalPending, dtype=journal_dtype).tostring())
+        self._journalFile.flush()
+        os.fsync(self._journalFile.fileno())
+        self._journalFlushed = time()
+        self._journalStats["flushes"] += 1
+        self._journalStats["entries"] += len(self._journalPending)
+        self._journalStats["time"] += self._journalFlushed - start
+        self._journalPending = []
+
+    def _f_overview(self, rec):
+        """ Reduces the record samples into the overview levels of the chapter,
+        leftovers not filling whole row are kept per chapter until the next records
+        """
+        chapter = self._writeChapterNode
+        if "overview" not in chapter:
+            self._fhandle.createGroup(chapter, "overview")._f_setAttr("levels", self._overview)
+        if rec.chapter not in self._overviewState:
+            self._overviewState[rec.chapter] = {}
+        state = self._overviewState[rec.chapter]
+        for c in rec.buffers:
+            for d in rec.buffers[c]:
+                if not isinstance(rec.buffers[c][d], np.ndarray):
+                    continue
+                if (c, d) not in state:
+                    state[(c, d)] = [np.empty(shape=(0, ), dtype=c_int16)] + \
+                                    [np.empty(shape=(0, 3), dtype=c_int16) for level in self._overview[1:]]
+                leftover = state[(c, d)]
+                data = rec.buffers[c][d][rec.start:(rec.start + rec.samples)]
+                if "degraded" in rec:
+                    data = expand_envelope(data, rec.degraded, rec.samples)
+                leftover[0] = np.concatenate((leftover[0], data))
+                rows, leftover[0] = overview_rows(leftover[0], self._overview[0])
+                for i, factor in enumerate(self._overview):
+                    if len(rows) == 0:
+                        break
+                    self._overview_array(c, d, factor).append(rows)
+                    if i + 1 < len(self._overview):
+                        leftover[i + 1] = np.concatenate((leftover[i + 1], rows))
+                        rows, leftover[i + 1] = overview_rows(leftover[i + 1], self._overview[i + 1] // factor)
+
+    def _overview_array(self, line, mode, factor):
+        if (line, mode, factor) not in self._overviewArrays:
+            overview = self._writeChapterNode.overview
+            name = line_node(line)
+            group = overview._f_get_child(name) if name in overview else self._fhandle.createGroup(overview, name)
+            name = "%s_%d" % (mode, factor)
+            if name in group:
+                self._overviewArrays[(line, mode, factor)] = group._f_get_child(name)
+            else:
+                self._overviewArrays[(line, mode, factor)] = \
+                    self._fhandle.createEArray(group, name, atom=StreamingTape.atom, shape=(0, 3),
+                                               filters=StreamingTape.filters)
+        return self._overviewArrays[(line, mode, factor)]
+
+    def _f_overview_read(self, args):
+        result = None
+        try:
+            if self._opened and not self._memstore and args["chapter"] in self._fhandle.root:
+                chapter = self._fhandle.getNode("/", args["chapter"], "Group")
+                result = read_chapter_overview(chapter, args["start"], args["count"], args["pixels"],
+                                               args["channels"], args["modes"])
+        except Exception as ex:
+            print "Tape Overview(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+            result = None
+        finally:
+            self._readq.put(result)
+
+    def _f_notify(self, chapter):
+        """ Tells the asynchronous readers that the chapter got new record or ended """
+        if self._notify and self._notifyq is not None and chapter:
+            self._notifyq.put(chapter)
+
+    def _f_fetch(self, args):
+        """ Reads record of the chapter by index for the asynchronous readers,
+        replies the record, "WAIT", "END" at the end of the chapter or the error message
+        """
+        self._notify = True
+        result = None
+        try:
+            result = self._fetch(args["chapter"], args["index"])
+            if result is None:
+                result = "END"
+        except Exception as ex:
+            print "Tape Fetch(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+            result = "Fetch failed: %s" % ex.message
+        finally:
+            self._readq.put(result)
+
+    def _fetch(self, chapter, index):
+        """ Reads record of the chapter by index, records evicted by the retention are skipped
+        :returns: record, "WAIT" if it is not written yet and the chapter is still being written or not started,
+                  otherwise None
+        """
+        result = None
+        if self._opened and chapter is not None:
+            if chapter in self._retained:
+                index = max(index, self._retained[chapter]["first"])
+            if self._memstore:
+                exists = chapter in self._records
+                if exists and index in self._records[chapter]:
+                    result = self._records[chapter][index].expanded()
+            elif self._rollover is not None:
+                """ indexes count the records of the chapter across the files of the rolling tape """
+                parts = self._segment_parts(chapter)
+                exists = len(parts) > 1
+                for segment, first, offset in reversed(parts):
+                    if index >= first:
+                        group = self._segment_group(segment, chapter)
+                        exists = exists or group is not None
+                        if group is not None:
+                            result = read_record(group, index - first)
+                        break
+            else:
+                exists = chapter in self._fhandle.root
+                if exists:
+                    result = read_record(self._fhandle.getNode("/", chapter, "Group"), index)
+            if result is not None:
+                result["index"] = index
+            elif not exists or (chapter == self._writeChapter and chapter not in self._ended):
+                result = "WAIT"
+        return result
+
+    def _f_retain(self, rec):
+        """ Evicts the oldest records of the chapter beyond the retention policy, O(1) per record """
+        if self._retention is None:
+            return
+        if rec.chapter not in self._retained:
+            self._retained[rec.chapter] = {"first": self._writeChunk, "bytes": 0, "records": collections.deque()}
+        kept = self._retained[rec.chapter]
+        size = sum([a.nbytes for line in rec.buffers.values() for a in line.values() if isinstance(a, np.ndarray)])
+        timestamp = rec["timestamp"] if "timestamp" in rec else time()
+        kept["records"].append((self._writeChunk, size, timestamp))
+        kept["bytes"] += size
+        evicted = False
+        while len(kept["records"]) > 1 and \
+                (("records" in self._retention and len(kept["records"]) > self._retention["records"]) or
+                 ("bytes" in self._retention and kept["bytes"] > self._retention["bytes"]) or
+                 ("seconds" in self._retention and timestamp - kept["records"][0][2] > self._retention["seconds"])):
+            index, size, stamp = kept["records"].popleft()
+            kept["bytes"] -= size
+            kept["first"] = index + 1
+            evicted = True
+            if self._memstore:
+                self._records[rec.chapter].pop(index, None)
+            else:
+                name = StreamingTape.recfmt % index
+                if name in self._writeChapterNode:
+                    self._writeChapterNode._f_get_child(name)._f_remove(recursive=True)
+        if not evicted:
+            return
+        if self._memstore:
+            """ index lists are trimmed once the evicted head outgrows the retained part """
+            index = self._memindex[rec.chapter]
+            drop = kept["first"] - index["base"]
+            if drop > 1024 and drop * 2 > len(index["offset"]):
+                for key in ("offset", "samples", "timestamp"):
+                    del index[key][:drop]
+                index["triggers"] = [t for t in index["triggers"] if t[1] >= kept["first"]]
+                index["summary"] = [r for r in index["summary"] if len(r) == 0 or r["record"][0] >= kept["first"]]
+                index["base"] = kept["first"]
+        else:
+            self._writeChapterNode._f_setAttr("first", kept["first"])
+
+    def _f_seek(self, args):
+        """ Positions the read cursor at the record holding the requested sample or time """
+        found = None
+        try:
+            found = self._locate(args)
+            if found is not None:
+                if not self._memstore and self._rollover is None:
+                    self._readChapterNode = self._fhandle.getNode("/", args["chapter"], "Group")
+                self._readChapter = args["chapter"]
+                self._readChunk = found[0] - 1
+                self._waiting = False
+        except Exception as ex:
+            print "Tape Seek(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+            found = None
+        finally:
+            self._readq.put(found)
+
+    def _locate(self, args):
+        """ Finds the record holding the sample or time of the chapter, None if not found or evicted
+        :returns: index of the record and offset of its first sample
+        :rtype: tuple(int, int), None
+        """
+        found = None
+        if self._opened and args["chapter"] is not None:
+            if self._memstore:
+                if args["chapter"] in self._memindex:
+                    index = self._memindex[args["chapter"]]
+                    found = self._bisect(index["offset"], index["samples"], index["timestamp"], args)
+                    if found is not None:
+                        found = (found[0] + index["base"], found[1])
+            elif self._rollover is not None:
+                for segment, first, offset in self._segment_parts(args["chapter"]):
+                    chapter = self._segment_group(segment, args["chapter"])
+                    if chapter is None or "records" not in chapter:
+                        continue
+                    cols = chapter.records.cols
+                    found = self._bisect(cols.offset, cols.samples, cols.timestamp,
+                                         dict(args, sample=args["sample"] - offset
+                                              if args["sample"] is not None else None))
+                    if found is not None:
+                        found = (found[0] + first, found[1] + offset)
+                        break
+            elif args["chapter"] in self._fhandle.root:
+                chapter = self._fhandle.getNode("/", args["chapter"], "Group")
+                if "records" in chapter:
+                    cols = chapter.records.cols
+                    found = self._bisect(cols.offset, cols.samples, cols.timestamp, args)
+            if found is not None and args["chapter"] in self._retained \
+                    and found[0] < self._retained[args["chapter"]]["first"]:
+                found = None
+        return found
+
+    def _f_cursor(self, args):
+        """ Serves the named read cursors, replies go to the cursors queue tagged with cursor name and operation """
+        name = args["cursor"]
+        op = args["op"]
+        if op == "open":
+            self._cursors[name] = {"chapter": args["chapter"], "index": args["start"], "waiting": False}
+            return
+        if op == "close":
+            self._cursors.pop(name, None)
+            return
+        result = None
+        try:
+            cursor = self._cursors.get(name, None)
+            if cursor is None:
+                result = None
+            elif op == "next":
+                if cursor["waiting"]:
+                    result = "WAIT"
+                else:
+                    """ the cursor may have read the closed files of the rolling tape on its own meanwhile """
+                    cursor["index"] = args.get("index", cursor["index"])
+                    result = self._fetch(cursor["chapter"], cursor["index"])
+                    if isinstance(result, basestring):
+                        if args["wait"]:
+                            cursor["waiting"] = True
+                        else:
+                            result = None
+                    elif result is not None:
+                        cursor["index"] = result.index + 1
+            elif op == "seek":
+                result = self._locate(dict(args, chapter=cursor["chapter"]))
+                if result is not None:
+                    cursor["index"] = result[0]
+                    cursor["waiting"] = False
+        except Exception as ex:
+            print "Tape Cursor(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+            result = None
+        finally:
+            self._cursorq.put((name, op, result))
+
+    def _f_cursor_wake(self, chapter, rec=None):
+        """ Hands the record just written, or the end of the chapter, to the cursors waiting for it """
+        for name, cursor in self._cursors.items():
+            if not cursor["waiting"] or cursor["chapter"] != chapter:
+                continue
+            if rec is not None and cursor["index"] == rec.index:
+                result = self._handoff(rec)
+            else:
+                result = self._fetch(chapter, cursor["index"])
+                if isinstance(result, basestring):
+                    continue
+            cursor["waiting"] = False
+            if result is not None:
+                cursor["index"] = result.index + 1
+            self._cursorq.put((name, "next", result))
+
+    def _f_range(self, args):
+        result = None
+        try:
+            if not self._opened or args["chapter"] is None:
+                pass
+            elif self._memstore:
+                if args["chapter"] in self._memindex:
+                    result = self._memstore_range(args)
+            elif self._rollover is not None:
+                result = self._segment_range(args)
+            elif args["chapter"] in self._fhandle.root:
+                chapter = self._fhandle.getNode("/", args["chapter"], "Group")
+                result = read_chapter_range(chapter, args["start"], args["count"], args["channels"], args["modes"])
+        except Exception as ex:
+            print "Tape Range(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+            result = None
+        finally:
+            self._readq.put(result)
+
+    def _f_chapter_index(self, args):
+        result = None
+        try:
+            chapter = args["chapter"]
+            if not self._opened or chapter is None:
+                pass
+            elif self._memstore:
+                if chapter in self._memindex:
+                    index = self._memindex[chapter]
+                    first = self._retained[chapter]["first"] if chapter in self._retained else 0
+                    first = max(args["start"], first, index["base"])
+                    rows = np.zeros(shape=(max(len(index["offset"]) + index["base"] - first, 0), ), dtype=index_dtype)
+                    rows["record"] = np.arange(first, first + len(rows))
+                    rows["offset"] = index["offset"][(first - index["base"]):]
+                    rows["samples"] = index["samples"][(first - index["base"]):]
+                    rows["timestamp"] = index["timestamp"][(first - index["base"]):]
+                    rows["triggerAt"] = -1
+                    for position, record, timestamp in index["triggers"]:
+                        if record >= first:
+                            rows["triggered"][record - first] = True
+                            rows["triggerAt"][record - first] = position - rows["offset"][record - first]
+                    result = (rows, chapter in self._ended)
+            elif self._rollover is not None:
+                parts = []
+                for segment, first, offset in self._segment_parts(chapter):
+                    group = self._segment_group(segment, chapter)
+                    if group is not None:
+                        parts.append(self._index_rows(group, max(args["start"] - first, 0), first, offset))
+                if len(parts) > 0:
+                    result = (np.concatenate(parts), chapter in self._ended)
+            elif chapter in self._fhandle.root:
+                group = self._fhandle.getNode("/", chapter, "Group")
+                result = (self._index_rows(group, max(args["start"], chapter_first(group))), chapter in self._ended)
+        except Exception as ex:
+            print "Tape Index(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+            result = None
+        finally:
+            self._readq.put(result)
+
+    @staticmethod
+    def _index_rows(group, start, first=0, offset=0):
+        """ Index rows of the chapter records table from the start record on, shifted by the record index
+        and sample offset of the chapter part held by other files of the rolling tape
+        """
+        table = group.records.read(start) if "records" in group and start < group.records.nrows \
+            else np.zeros(0, dtype=index_dtype)
+        rows = np.zeros(shape=(len(table), ), dtype=index_dtype)
+        rows["record"] = np.arange(first + start, first + start + len(rows))
+        for key in ("offset", "samples", "timestamp", "triggered", "triggerAt"):
+            rows[key] = table[key]
+        rows["offset"] += offset
+        return rows
+
+    def _f_triggers(self, args):
+        result = None
+        try:
+            if not self._opened or args["chapter"] is None:
+                pass
+            elif self._memstore:
+                if args["chapter"] in self._memindex:
+                    result = self._memstore_triggers(args["chapter"])
+            elif self._rollover is not None:
+                result = self._segment_rows(args["chapter"], chapter_triggers)
+            elif args["chapter"] in self._fhandle.root:
+                result = chapter_triggers(self._fhandle.getNode("/", args["chapter"], "Group"))
+        except Exception as ex:
+            print "Tape Triggers(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+            result = None
+        finally:
+            self._readq.put(result)
+
+    def _f_summary(self, args):
+        result = None
+        try:
+            if not self._opened or args["chapter"] is None:
+                pass
+            elif self._memstore:
+                if args["chapter"] in self._memindex:
+                    result = self._memstore_summary(args["chapter"])
+            elif self._rollover is not None:
+                result = self._segment_rows(args["chapter"], chapter_summary)
+            elif args["chapter"] in self._fhandle.root:
+                result = chapter_summary(self._fhandle.getNode("/", args["chapter"], "Group"))
+        except Exception as ex:
+            print "Tape Summary(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+            result = None
+        finally:
+            self._readq.put(result)
+
+    def _f_windows(self, args):
+        result = None
+        try:
+            if not self._opened or args["chapter"] is None:
+                pass
+            elif self._memstore:
+                if args["chapter"] in self._memindex:
+                    index = self._memindex[args["chapter"]]
+                    first = self._retained[args["chapter"]]["first"] if args["chapter"] in self._retained else 0
+                    start = index["offset"][first - index["base"]] if first - index["base"] < len(index["offset"]) \
+                        else 0
+                    end = index["offset"][-1] + index["samples"][-1] if len(index["offset"]) > 0 else 0
+                    result = cut_windows(self._memstore_triggers(args["chapter"])["position"],
+                                         args["pre"], args["post"], start, end,
+                                         lambda s, c: self._memstore_range(dict(args, start=s, count=c)))
+            elif self._rollover is not None:
+                triggers = self._segment_rows(args["chapter"], chapter_triggers)
+                if triggers is not None:
+                    segment, first, offset = self._segment_parts(args["chapter"])[-1]
+                    part = segment["chapters"].get(args["chapter"])
+                    end = offset + (part["samples"] if part is not None else 0)
+                    result = cut_windows(triggers["position"], args["pre"], args["post"], 0, end,
+                                         lambda s, c: self._segment_range(dict(args, start=s, count=c)))
+            elif args["chapter"] in self._fhandle.root:
+                result = read_trigger_windows(self._fhandle.getNode("/", args["chapter"], "Group"),
+                                              args["pre"], args["post"], args["channels"], args["modes"])
+        except Exception as ex:
+            print "Tape Windows(%d):" % sys.exc_info()[-1].tb_lineno, type(ex), ex.message
+            result = None
+        finally:
+            self._readq.put(result)
+
+    def _segment_rows(self, chapter, read):
+        """ Rows read from the chapter in each file of the rolling tape, with record indexes and trigger positions
+        counted across the files, None if none of the files holds them
+        """
+        parts = []
+        for segment, first, offset in self._segment_parts(chapter):
+            group = self._segment_group(segment, chapter)
+            rows = read(group) if group is not None else None
+            if rows is not None:
+                rows["record"] += first
+                if "position" in rows.dtype.names:
+                    rows["position"] += offset
+                parts.append(rows)
+        return np.concatenate(parts) if len(parts) > 0 else None
+
+    def _segment_range(self, args):
+        """ Contiguous run of samples of the chapter read across the files of the rolling tape """
+        parts = []
+        for segment, first, offset in self._segment_parts(args["chapter"]):
+            part = segment["chapters"].get(args["chapter"])
+            parts.append((offset, part["samples"] if part is not None else 0,
+                          lambda segment=segment: self._segment_group(segment, args["chapter"])))
+        return read_segments_range(parts, args["start"], args["count"], args["channels"], args["modes"])
+
+    def _memstore_triggers(self, chapter):
+        """ Trigger index of the memory tape chapter, triggers of the evicted records left out """
+        rows = np.array(self._memindex[chapter]["triggers"], dtype=trigger_dtype)
+        if chapter in self._retained:
+            rows = rows[rows["record"] >= self._retained[chapter]["first"]]
+        return rows
+
+    def _memstore_summary(self, chapter):
+        """ Summary rows of the memory tape chapter, None if it was recorded without summary """
+        parts = self._memindex[chapter]["summary"]
+        if len(parts) == 0:
+            return None
+        rows = np.concatenate(parts)
+        if chapter in self._retained:
+            rows = rows[rows["record"] >= self._retained[chapter]["first"]]
+        return rows
+
+    def _memstore_range(self, args):
+        index = self._memindex[args["chapter"]]
+        records = self._records[args["chapter"]]
+        start = args["start"]
+        if start < 0 or args["count"] <= 0:
+            return 0, None
+        kept = (self._retained[args["chapter"]]["first"] if args["chapter"] in self._retained else 0) - index["base"]
+        if len(index["offset"]) <= kept:
+            return 0, None
+        start = max(start, index["offset"][kept])
+        first = bisect.bisect_right(index["offset"], start) - 1
+        if first < 0:
+            return 0, None
+        end = min(args["start"] + args["count"], index["offset"][-1] + index["samples"][-1])
+        if end <= start:
+            return 0, None
+        buffers = {}
+        i = first
+        while i < len(index["offset"]) and index["offset"][i] < end:
+            if i + index["base"] in records:
+                rec = records[i + index["base"]].expanded()
+                offset = index["offset"][i]
+                lo = max(start - offset, 0)
+                hi = min(end - offset, rec.samples)
+                for line in rec.buffers:
+                    if args["channels"] is not None and line not in args["channels"]:
+                        continue
+                    if line not in buffers:
+                        buffers[line] = {}
+                    for mode in rec.buffers[line]:
+                        if not isinstance(rec.buffers[line][mode], np.ndarray) \
+                                or (args["modes"] is not None and mode not in args["modes"]):
+                            continue
+                        if mode not in buffers[line]:
+                            buffers[line][mode] = np.zeros(shape=(end - start,), dtype=c_int16)
+                        buffers[line][mode][(offset + lo - start):(offset + hi - start)] = \
+                            rec.buffers[line][mode][(rec.start + lo):(rec.start + hi)]
+            i += 1
+        return end - start, buffers
+
+    @staticmethod
+    def _bisect(offsets, samples, timestamps, args):
+        """ Binary search of the chapter index
+        :returns: record index and its sample offset, None if out of chapter
+        """
+        count = len(offsets)
+        if args["sample"] is not None:
+            i = bisect.bisect_right(offsets, args["sample"]) - 1
+            if i < 0 or args["sample"] >= offsets[i] + samples[i]:
+                return None
+        else:
+            i = bisect.bisect_left(timestamps, args["time"])
+            if i >= count:
+                return None
+        return i, int(offsets[i])
+
+    def _filters(self, line, data):
+        """ Filters and chunk length for the line in the current chapter, picks the codec in auto mode """
+        if line not in self._writeFilters:
+            compression = self._channelCompression.get(line, self._compression)
+            if compression == "auto":
+                compression = self._pick_codec(line, data)
+            self._writeFilters[line] = compression_filters(compression)
+        return self._writeFilters[line]
+
+    def _pick_codec(self, line, data, chapter=None):
+        """ Test compresses the data with all candidate codecs and returns the one giving the best write rate
+
+        The write rate combines compression throughput with the time to store the compressed bytes,
+        assuming the storage sustains StreamingTape.storage_rate bytes per second.
+        """
+        if self._trialFile is None:
+            self._trialFile = tb.openFile("codec_trial.h5", mode="w", driver="H5FD_CORE",
+                                          driver_core_backing_store=0)
+        data = data[:StreamingTape.trial_samples]
+        if len(data) == 0:
+            return None
+        best = None
+        trials = []
+        for codec in StreamingTape.codecs:
+            try:
+                filters, chunkshape = compression_filters(codec)
+            except ValueError:
+                continue
+            chunk = (min(chunkshape, len(data)),) if chunkshape is not None else None
+            start = time()
+            a = self._trialFile.createCArray("/", "trial", atom=StreamingTape.atom, shape=data.shape,
+                                             filters=filters, chunkshape=chunk)
+            a[:] = data
+            a.flush()
+            elapsed = max(time() - start, 1e-6)
+            ratio = float(data.nbytes) / max(a.size_on_disk, 1)
+            a._f_remove()
+            rate = 1.0 / (elapsed / data.nbytes + 1.0 / (ratio * StreamingTape.storage_rate))
+            trial = {"complib": codec["complib"], "complevel": codec["complevel"],
+                     "shuffle": codec.get("shuffle", True), "bitshuffle": codec.get("bitshuffle", False),
+                     "ratio": ratio, "throughput": data.nbytes / elapsed, "rate": rate}
+            trials.append(trial)
+            if best is None or rate > best[1]["rate"]:
+                best = (codec, trial)
+        if best is None:
+            return None
+        if chapter is None:
+            chapter = self._writeChapter
+        if chapter not in self._codecStats:
+            self._codecStats[chapter] = {}
+        self._codecStats[chapter][line] = {"pick": best[1], "trials": trials}
+        return best[0]
+
     def _f_stats(self):
         self._readq.put(deepcopy(self._stats_store))
+
+    def _f_processor_stats(self):
+        stats = dict()
+        stats["codecs"] = deepcopy(self._codecStats)
+        stats["cpu"] = sum(os.times()[:2])
+        if self._pool is not None:
+            elapsed = max(time() - self._poolStart, 1e-6)
+            stats["workers"] = dict([(pid, {"busy": w["busy"], "tasks": w["tasks"], "utilisation": w["busy"] / elapsed})
+                                     for pid, w in self._workerStats.items()])
+        if self._journal is not None:
+            stats["journal"] = dict(self._journalStats, pending=len(self._journalPending))
+        self._readq.put(stats)
@@ -0,0 +1,432 @@
+#
+# Copyright (C) 2014-2018 Pico Technology Ltd. See LICENSE file for terms.
+#
+"""
+Publishing streaming records over TCP or Unix sockets and subscribing to them
+
+Every frame starts with net_frame: magic, kind, number of lines, sequence number and body length.
+Record frames carry net_record with the length prefixed chapter, device and serial names, followed
+by net_line for each line and the raw little endian int16 samples of each line buffer, in the line order
+and net_modes order within the line. Chapter end frames carry the chapter name only.
+"""
+
+import numpy as np
+import socket
+import struct
+import Queue
+import threading as th
+import os
+import stat
+import sys
+from time import time, sleep
+from ctypes import c_int16
+from picosdk.psutils import StreamingTapeRecording
+from picosdk.picostatus import pico_num
+
+net_magic = "PTN1"
+""" magic, kind, lines, sequence, body length """
+net_frame = struct.Struct("<4sBxHII")
+""" timestamp, samples, points per buffer, interval, units, mode, downsample, max adc, trigger position, degraded,
+    flags (trigger set, triggered, final), lengths of chapter, device and serial names """
+net_record = struct.Struct("<dIIqhhIiqIBBBB")
+""" line, flags (overflow, range set, level set), modes mask, range or level, scale """
+net_line = struct.Struct("<HBBid")
+net_modes = ("raw", "min", "max", "avg", "dec")
+NET_RECORD = 1
+NET_END = 2
+
+
+def _attr(rec, key, default):
+    return rec[key] if key in rec and rec[key] is not None else default
+
+
+def encode_record(rec, sequence):
+    """ Builds the frame of the record, the samples are copied into it
+    :param rec: record to encode
+    :type rec: StreamingTapeRecording
+    :param sequence: frame sequence number
+    :type sequence: int
+    :returns: frame
+    :rtype: str
+    """
+    degraded = int(_attr(rec, "degraded", 0))
+    points = None
+    lines = []
+    payload = []
+    for line in sorted(rec.buffers.keys()):
+        buffers = rec.buffers[line]
+        flags = 1 if buffers.get("overflow", False) else 0
+        value = 0
+        if "range" in buffers:
+            flags |= 2
+            value = int(buffers["range"])
+        elif "level" in buffers:
+            flags |= 4
+            value = int(buffers["level"])
+        mask = 0
+        for bit, mode in enumerate(net_modes):
+            if mode not in buffers or not isinstance(buffers[mode], np.ndarray):
+                continue
+            data = buffers[mode] if degraded else buffers[mode][rec.start:rec.start + rec.samples]
+            if points is None:
+                points = len(data)
+            mask |= 1 << bit
+            payload.append(np.ascontiguousarray(data[:points], dtype="<i2").tostring())
+        lines.append(net_line.pack(line, flags, mask, value, float(buffers.get("scale", 0.0))))
+    names = [str(_attr(rec, key, "")) for key in ("chapter", "device", "serial")]
+    flags = (1 if _attr(rec, "triggerSet", False) else 0) | (2 if _attr(rec, "triggered", False) else 0) \
+        | (4 if _attr(rec, "final", False) else 0)
+    head = net_record.pack(_attr(rec, "timestamp", time()), rec.samples, points or 0, int(_attr(rec, "interval", 0)),
+                           int(_attr(rec, "units", 0)), int(_attr(rec, "mode", 0)), int(_attr(rec, "downsample", 1)),
+                           int(_attr(rec, "maxAdc", 0)), int(_attr(rec, "triggerAt", -1)), degraded, flags,
+                           *[len(n) for n in names])
+    body = "".join([head] + names + lines + payload)
+    return net_frame.pack(net_magic, NET_RECORD, len(lines), sequence, len(body)) + body
+
+
+def encode_end(chapter, sequence):
+    """ Builds the frame closing the chapter
+    :param chapter: chapter name, None if not known
+    :type chapter: str, None
+    :param sequence: frame sequence number
+    :type sequence: int
+    :returns: frame
+    :rtype: str
+    """
+    body = str(chapter) if chapter is not None else ""
+    return net_frame.pack(net_magic, NET_END, 0, sequence, len(body)) + body
+
+
+def _bind(address):
+    if isinstance(address, basestring):
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            os.unlink(address)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(address)
+    return sock
+
+
+class StreamingTapePublisher(object):
+    """ Tape sink publishing records to the subscribers connected over TCP or Unix socket
+
+    Each record is encoded once and the frame is shared by all the subscribers. Every subscriber
+    has its own queue and sending thread, frames of subscribers which can not keep up are dropped
+    once their queue is full, the others are not affected. Chapter end frames are never dropped.
+    Loads into the devices like a tape, or serves as a sink of StreamingTapeFanout.
+    """
+    """ seconds a subscriber may block single frame before it gets disconnected """
+    send_timeout = 10.0
+
+    def __init__(self, address, queue_size=16, listen=8):
+        """
+        :param address: (host, port) to listen on with TCP, port 0 for any free one, or Unix socket path
+        :type address: tuple, str
+        :param queue_size: number of frames waiting for each subscriber, the newer ones are dropped
+        :type queue_size: int
+        :param listen: number of pending connections
+        :type listen: int
+        :raises socket.error: when the address can not be bound
+        """
+        self._queueSize = max(queue_size, 1)
+        self._server = _bind(address)
+        self._server.listen(listen)
+        self._server.settimeout(0.25)
+        self.address = self._server.getsockname()
+        self._unix = isinstance(address, basestring)
+        self._closing = False
+        self._lock = th.Lock()
+        self._sequence = 0
+        self._chapter = None
+        self._subscribers = {}
+        self._overloadStats = {"dropped": 0, "dropped_samples": 0, "degraded": 0, "degraded_samples": 0}
+        self._acceptThread = th.Thread(target=self._accept)
+        self._acceptThread.daemon = True
+        self._acceptThread.start()
+
+    def _accept(self):
+        while not self._closing:
+            try:
+                conn, peer = self._server.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            conn.settimeout(self.send_timeout)
+            if not self._unix:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sub = {"socket": conn, "peer": peer if peer else "unix:%d" % conn.fileno(), "queue": Queue.Queue(),
+                   "frames": 0, "bytes": 0, "dropped": 0, "dropped_samples": 0, "connected": time()}
+            sub["thread"] = th.Thread(target=self._send, args=(sub, ))
+            sub["thread"].daemon = True
+            with self._lock:
+                self._subscribers[id(sub)] = sub
+            sub["thread"].start()
+
+    def _send(self, sub):
+        try:
+            while True:
+                item = sub["queue"].get()
+                if item is None:
+                    break
+                frame, samples = item
+                sub["socket"].sendall(frame)
+                with self._lock:
+                    sub["frames"] += 1
+                    sub["bytes"] += len(frame)
+        except socket.error:
+            pass
+        finally:
+            with self._lock:
+                self._subscribers.pop(id(sub), None)
+            try:
+                sub["socket"].shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sub["socket"].close()
+
+    def _deliver(self, frame, samples):
+        with self._lock:
+            subscribers = self._subscribers.values()
+        for sub in subscribers:
+            if samples is not None and sub["queue"].qsize() >= self._queueSize:
+                with self._lock:
+                    sub["dropped"] += 1
+                    sub["dropped_samples"] += samples
+                    self._overloadStats["dropped"] += 1
+                    self._overloadStats["dropped_samples"] += samples
+                continue
+            sub["queue"].put((frame, samples))
+
+    def record(self, records, detached=False):
+        """ Publishes the records, the samples are copied into the frame before returning
+        :param records: records to publish, None to close the current chapter
+        :type records: StreamingTapeRecording, None
+        :param detached: accepted for the StreamingTape interface, the records are always encoded right away
+        :type detached: bool
+        :returns: status of the call
+        :rtype: int
+        """
+        if self._closing:
+            return pico_num("PICO_CANCELLED")
+        try:
+            if records is None:
+                frame = encode_end(self._chapter, self._sequence)
+            else:
+                frame = encode_record(records, self._sequence)
+                self._chapter = _attr(records, "chapter", None)
+        except Exception as ex:
+            print "Publisher Record(%d):" % sys.exc_info()[-1].tb_lineno, ex.message
+            return pico_num("PICO_CANCELLED")
+        self._sequence = (self._sequence + 1) & 0xffffffff
+        self._deliver(frame, records.samples if records is not None else None)
+        return pico_num("PICO_OK")
+
+    def is_processing(self):
+        return not self._closing
+
+    def wait2finish(self, timeout=10.0):
+        """ Waits for the queued frames to be sent to all the subscribers
+        :param timeout: how long to wait in seconds, 0 to wait until done
+        :type timeout: float
+        """
+        deadline = time() + timeout
+        while timeout == 0 or time() < deadline:
+            with self._lock:
+                if all([sub["queue"].qsize() == 0 for sub in self._subscribers.values()]):
+                    return
+            sleep(0.01)
+
+    def wait4subscribers(self, count=1, timeout=10.0):
+        """ Waits for the subscribers to connect
+        :returns: whether the count got connected in time
+        :rtype: bool
+        """
+        deadline = time() + timeout
+        while len(self._subscribers) < count and (timeout == 0 or time() < deadline):
+            sleep(0.01)
+        return len(self._subscribers) >= count
+
+    def overload_stats(self):
+        """ Counters of frames dropped for the slow subscribers, summed over all of them
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(self._overloadStats)
+
+    def subscriber_stats(self):
+        """ Traffic of each connected subscriber
+        :returns: peer to dict of frames and bytes sent, throughput in bytes/s, frames dropped and waiting
+        :rtype: dict
+        """
+        stats = {}
+        now = time()
+        with self._lock:
+            for sub in self._subscribers.values():
+                stats[sub["peer"]] = {"frames": sub["frames"], "bytes": sub["bytes"], "dropped": sub["dropped"],
+                                      "dropped_samples": sub["dropped_samples"], "backlog": sub["queue"].qsize(),
+                                      "throughput": sub["bytes"] / max(now - sub["connected"], 1e-6)}
+        return stats
+
+    def close(self):
+        """ Sends the queued frames and disconnects the subscribers """
+        if self._closing:
+            return
+        self._closing = True
+        self._acceptThread.join()
+        self._server.close()
+        if self._unix and os.path.exists(self.address):
+            os.unlink(self.address)
+        with self._lock:
+            subscribers = self._subscribers.values()
+        for sub in subscribers:
+            sub["queue"].put(None)
+        for sub in subscribers:
+            sub["thread"].join()
+
+
+class StreamingTapeSubscriber(object):
+    """ Client of StreamingTapePublisher rebuilding the published records """
+
+    def __init__(self, address, timeout=10.0):
+        """
+        :param address: (host, port) of the publisher, or Unix socket path
+        :type address: tuple, str
+        :param timeout: seconds to wait for the connection and each frame, None to wait forever
+        :type timeout: float, None
+        :raises socket.error: when the publisher can not be reached
+        """
+        family = socket.AF_UNIX if isinstance(address, basestring) else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(address)
+        self._head = bytearray(net_frame.size)
+        self._sequence = None
+        self.lost = 0
+        self.connected = True
+
+    def _recv_into(self, buf):
+        view = memoryview(buf)
+        got = 0
+        while got < len(view):
+            try:
+                n = self._socket.recv_into(view[got:])
+            except socket.timeout:
+                if got > 0:
+                    raise EOFError("Frame cut short")
+                raise
+            if n == 0:
+                raise EOFError("Publisher closed the connection")
+            got += n
+
+    def _recv(self, size):
+        buf = bytearray(size)
+        self._recv_into(buf)
+        return str(buf)
+
+    def receive(self, out=None):
+        """ Receives next record
+        :param out: preallocated arrays to fill as {line: {mode: np.array}}, the record buffers
+                    refer to them, missing or short ones are allocated
+        :type out: dict, None
+        :returns: record, chapter end as empty record with final set, None when disconnected or timed out
+        :rtype: StreamingTapeRecording, None
+        :raises ValueError: when the stream is not made of publisher frames
+        """
+        if not self.connected:
+            return None
+        try:
+            self._recv_into(self._head)
+        except socket.timeout:
+            return None
+        except (EOFError, socket.error):
+            self.close()
+            return None
+        try:
+            magic, kind, nlines, sequence, length = net_frame.unpack(str(self._head))
+            if magic != net_magic:
+                raise ValueError("Not a tape publisher stream")
+            if self._sequence is not None:
+                self.lost += (sequence - self._sequence - 1) & 0xffffffff
+            self._sequence = sequence
+            if kind == NET_END:
+                rec = StreamingTapeRecording()
+                rec.chapter = self._recv(length) if length > 0 else None
+                rec.final = True
+                return rec
+            return self._receive_record(nlines, out)
+        except (EOFError, socket.error):
+            """ timeouts within the frame included, the stream is out of step """
+            self.close()
+            return None
+
+    def _receive_record(self, nlines, out):
+        timestamp, samples, points, interval, units, mode, downsample, max_adc, trigger_at, degraded, flags, \
+            lchapter, ldevice, lserial = net_record.unpack(self._recv(net_record.size))
+        names = self._recv(lchapter + ldevice + lserial)
+        rec = StreamingTapeRecording()
+        rec.chapter = names[:lchapter]
+        rec.device = names[lchapter:lchapter + ldevice]
+        rec.serial = names[lchapter + ldevice:]
+        rec.timestamp = timestamp
+        rec.samples = samples
+        rec.bufflen = points
+        rec.start = 0
+        rec.interval = interval
+        rec.units = units
+        rec.mode = mode
+        rec.downsample = downsample
+        if max_adc != 0:
+            rec.maxAdc = max_adc
+        rec.triggerSet = flags & 1 > 0
+        rec.triggered = flags & 2 > 0
+        rec.triggerAt = trigger_at
+        rec.final = flags & 4 > 0
+        if degraded > 0:
+            rec.degraded = degraded
+        lines = []
+        for i in range(nlines):
+            lines.append(net_line.unpack(self._recv(net_line.size)))
+        for line, lflags, mask, value, scale in lines:
+            buffers = {"overflow": lflags & 1 > 0}
+            if lflags & 2:
+                buffers["range"] = value
+                buffers["scale"] = scale
+            elif lflags & 4:
+                buffers["level"] = value
+            for bit, name in enumerate(net_modes):
+                if not mask & 1 << bit:
+                    continue
+                data = None
+                if out is not None and line in out and name in out[line]:
+                    data = out[line][name]
+                    if not isinstance(data, np.ndarray) or data.dtype != np.dtype(c_int16) \
+                            or len(data) < points or not data.flags.c_contiguous:
+                        data = None
+                if data is None:
+                    data = np.empty(shape=(points, ), dtype=c_int16)
+                self._recv_into(data[:points].view(np.uint8))
+                if sys.byteorder == "big":
+                    data[:points].byteswap(True)
+                buffers[name] = data
+            rec.buffers[line] = buffers
+        return rec
+
+    def __iter__(self):
+        while True:
+            rec = self.receive()
+            if rec is None:
+                return
+            yield rec
+
+    def close(self):
+        if not self.connected:
+            return
+        self.connected = False
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._socket.close()
@@ -0,0 +1,930 @@
+#
+# Copyright (C) 2014-2018 Pico Technology Ltd. See LICENSE file for terms.
+#
+"""
+Offline tools working on closed streaming tape files
+"""
+
+import tables as tb
+import numpy as np
+import multiprocessing
+import collections
+import json
+import wave
+import os.path
+import threading as th
+from time import time
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+from picosdk.psutils import StreamingTape, StreamingTapeIndex, StreamingTapeRecording, \
+    StreamingTapeTrigger, StreamingTapeSummary, chapter_layout, chapter_lines, chapter_first, chapter_index, \
+    chapter_precondition, chapter_triggers, chapter_summary, restore, expand_envelope, line_node, line_bit, \
+    read_chapter_range, read_segments_range, compression_filters, decode_chunk, journal_dtype, journal_name, \
+    read_journal, read_manifest, ratio_modes, tape_sink, MAX_ADC
+from picosdk.picostatus import pico_num
+
+""" formats handled by export_chapter """
+FORMATS = ("npy", "raw", "parquet", "arrow", "wav")
+
+
+def chapter_interval(chapter):
+    """ Time between the stored samples of the chapter in seconds, None if the chapter does not carry it """
+    attrs = chapter._v_attrs
+    if "interval" not in attrs or "units" not in attrs:
+        return None
+    interval = float(attrs["interval"]) * pow(10.0, 3 * int(attrs["units"]) - 15)
+    if "mode" in attrs and int(attrs["mode"]) != 0 and "downsample" in attrs:
+        interval *= int(attrs["downsample"])
+    return interval
+
+
+def chapter_samples(chapter):
+    """ Number of samples in the chapter, None if it has neither records table nor record groups """
+    rows = chapter.records if "records" in chapter else chapter_index(chapter)
+    if rows is None:
+        return None
+    if len(rows) == 0:
+        return 0
+    last = rows[-1]
+    return int(last["offset"] + last["samples"])
+
+
+def line_factors(chapter, max_adc=None):
+    """ Volts per ADC count of the chapter channels, digital ports are left out
+    :param chapter: chapter group
+    :type chapter: tables.Group
+    :param max_adc: ADC count of the full scale, None to take it from the tape or MAX_ADC
+    :type max_adc: int, None
+    :rtype: dict
+    """
+    if max_adc is None:
+        max_adc = int(chapter._v_attrs["maxAdc"]) if "maxAdc" in chapter._v_attrs else MAX_ADC
+    factors = {}
+    for line, group in chapter_lines(chapter).items():
+        if not line & 128 and "scale" in group._v_attrs:
+            factors[line] = float(group._v_attrs["scale"]) / max_adc
+    return factors
+
+
+_export_file = None
+
+
+def _export_block(args):
+    """ Export pool job, reads samples of single block in a worker with its own handle of the tape file """
+    global _export_file
+    filename, chapter, start, count, channels, modes = args
+    if _export_file is None or _export_file.filename != filename:
+        if _export_file is not None:
+            _export_file.close()
+        _export_file = tb.openFile(filename, mode="r")
+    return read_chapter_range(_export_file.getNode("/", chapter, "Group"), start, count, channels, modes)
+
+
+def read_blocks(filename, chapter, start, end, block, channels=None, modes=None, workers=0):
+    """ Reads the chapter samples block by block, in parallel with workers, but always yielded in order
+    :param filename: tape file name, the tape has to be closed
+    :type filename: str
+    :param chapter: chapter name
+    :type chapter: str
+    :param start: first sample offset
+    :type start: int
+    :param end: offset after the last sample
+    :type end: int
+    :param block: number of samples read at once
+    :type block: int
+    :param channels: channels/ports to read, None for all
+    :type channels: tuple, None
+    :param modes: buffer names to read, None for all
+    :type modes: tuple, None
+    :param workers: number of reading processes, at most two blocks per worker are held in memory
+    :type workers: int
+    :returns: generator of block offsets and read_chapter_range results
+    """
+    jobs = [(filename, chapter, offset, min(block, end - offset), channels, modes)
+            for offset in xrange(start, end, block)]
+    if workers <= 0:
+        with tb.openFile(filename, mode="r") as tape:
+            group = tape.getNode("/", chapter, "Group")
+            for job in jobs:
+                yield job[2], read_chapter_range(group, job[2], job[3], channels, modes)
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = collections.deque()
+        for job in jobs:
+            pending.append((job[2], pool.apply_async(_export_block, (job, ))))
+            if len(pending) >= 2 * workers:
+                offset, result = pending.popleft()
+                yield offset, result.get()
+        while len(pending) > 0:
+            offset, result = pending.popleft()
+            yield offset, result.get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class _NpyExport(object):
+    """ Single .npy file per line and mode, written through memory maps """
+
+    def __init__(self, output, prefix, total, interval):
+        self.output = output
+        self.prefix = prefix
+        self.total = total
+        self.maps = {}
+
+    def write(self, start, buffers):
+        for line in buffers:
+            for mode in buffers[line]:
+                data = buffers[line][mode]
+                if (line, mode) not in self.maps:
+                    self.maps[(line, mode)] = np.lib.format.open_memmap(
+                        os.path.join(self.output, "%s_%s_%s.npy" % (self.prefix, line_node(line), mode)),
+                        mode="w+", dtype=data.dtype, shape=(self.total, ))
+                self.maps[(line, mode)][start:(start + len(data))] = data
+
+    def close(self):
+        names = []
+        for m in self.maps.values():
+            m.flush()
+            names.append(m.filename)
+        self.maps = {}
+        return names
+
+
+class _RawExport(object):
+    """ Raw little endian samples per line and mode with json description, ready for np.memmap """
+
+    def __init__(self, output, prefix, total, interval):
+        self.output = output
+        self.prefix = prefix
+        self.interval = interval
+        self.files = {}
+
+    def write(self, start, buffers):
+        for line in buffers:
+            for mode in buffers[line]:
+                data = buffers[line][mode]
+                if (line, mode) not in self.files:
+                    name = os.path.join(self.output, "%s_%s_%s.bin" % (self.prefix, line_node(line), mode))
+                    self.files[(line, mode)] = [open(name, "wb"), data.dtype.newbyteorder("<"), 0]
+                f = self.files[(line, mode)]
+                data.astype(f[1]).tofile(f[0])
+                f[2] += len(data)
+
+    def close(self):
+        names = []
+        for (line, mode), (f, dtype, count) in self.files.items():
+            f.close()
+            with open(os.path.splitext(f.name)[0] + ".json", "w") as d:
+                json.dump({"line": line_node(line), "mode": mode, "dtype": dtype.str, "count": count,
+                           "interval": self.interval}, d, indent=1)
+            names += [f.name, d.name]
+        self.files = {}
+        return names
+
+
+class _ArrowExport(object):
+    """ Single table with column per line and mode, Parquet with row group per block or Arrow IPC file """
+
+    def __init__(self, output, prefix, total, interval, parquet=True):
+        if pyarrow is None:
+            raise ImportError("pyarrow is required to export Parquet and Arrow files")
+        self.name = os.path.join(output, "%s.%s" % (prefix, "parquet" if parquet else "arrow"))
+        self.parquet = parquet
+        self.interval = interval
+        self.writer = None
+        self.sink = None
+
+    def write(self, start, buffers):
+        columns = []
+        names = []
+        count = 0
+        for line in sorted(buffers.keys()):
+            for mode in sorted(buffers[line].keys()):
+                columns.append(pyarrow.array(buffers[line][mode]))
+                names.append("%s_%s" % (line_node(line), mode))
+                count = len(buffers[line][mode])
+        time = np.arange(start, start + count, dtype=np.float64)
+        if self.interval is not None:
+            time *= self.interval
+        batch = pyarrow.RecordBatch.from_arrays([pyarrow.array(time)] + columns, ["time"] + names)
+        if self.writer is None:
+            if self.parquet:
+                self.writer = pyarrow.parquet.ParquetWriter(self.name, batch.schema)
+            else:
+                self.sink = pyarrow.OSFile(self.name, "wb")
+                self.writer = pyarrow.RecordBatchFileWriter(self.sink, batch.schema)
+        if self.parquet:
+            self.writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def close(self):
+        if self.writer is None:
+            return []
+        self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+        return [self.name]
+
+
+class _WavExport(object):
+    """ 16 bit PCM wave file per mode with a wave channel per line """
+
+    def __init__(self, output, prefix, total, interval):
+        self.output = output
+        self.prefix = prefix
+        self.rate = max(int(round(1.0 / interval)), 1) if interval else 1
+        self.files = {}
+
+    def write(self, start, buffers):
+        lines = sorted(buffers.keys())
+        modes = set([m for line in lines for m in buffers[line]])
+        for mode in modes:
+            data = [buffers[line][mode] for line in lines if mode in buffers[line]]
+            if mode not in self.files:
+                f = wave.open(os.path.join(self.output, "%s_%s.wav" % (self.prefix, mode)), "wb")
+                f.setnchannels(len(data))
+                f.setsampwidth(2)
+                f.setframerate(self.rate)
+                self.files[mode] = f
+            frames = np.column_stack(data).astype("<i2")
+            self.files[mode].writeframes(frames.tostring())
+
+    def close(self):
+        names = []
+        for f in self.files.values():
+            names.append(f._file.name)
+            f.close()
+        self.files = {}
+        return names
+
+
+def export_chapter(filename, chapter, output, formats=("npy", ), channels=None, modes=None, volts=False,
+                   block=1048576, workers=0, max_adc=None):
+    """ Converts the tape chapter into per line files readable without the tape layout knowledge
+
+    Samples are read in blocks, so the memory used does not depend on the chapter length,
+    with workers the blocks are read and decompressed in parallel and written in order.
+    Records evicted by retention are left out, npy files keep zeros in their place.
+    :param filename: tape file name, the tape has to be closed
+    :type filename: str
+    :param chapter: chapter name
+    :type chapter: str
+    :param output: directory for the exported files, named after the chapter
+    :type output: str
+    :param formats: any of npy, raw (with json description), parquet, arrow and wav
+    :type formats: tuple
+    :param channels: channels/ports to export, None for all
+    :type channels: tuple, None
+    :param modes: buffer names to export (raw, min, max, avg, dec), None for all
+    :type modes: tuple, None
+    :param volts: whether to convert the channel samples to volts, using the stored scale, not used with wav
+    :type volts: bool
+    :param block: number of samples read at once
+    :type block: int
+    :param workers: number of processes reading the blocks, 0 to read them in this one
+    :type workers: int
+    :param max_adc: ADC count of the full scale, None to take it from the tape or MAX_ADC
+    :type max_adc: int, None
+    :returns: names of the written files
+    :rtype: list
+    :raises ValueError: on unknown format or chapter, or chapter without records
+    :raises ImportError: when Parquet or Arrow is requested without pyarrow
+    """
+    for fmt in formats:
+        if fmt not in FORMATS:
+            raise ValueError("Unsupported export format %s" % repr(fmt))
+    with tb.openFile(filename, mode="r") as tape:
+        if chapter not in tape.root:
+            raise ValueError("Chapter %s not found" % chapter)
+        group = tape.getNode("/", chapter, "Group")
+        total = chapter_samples(group)
+        if total is None:
+            raise ValueError("Chapter %s has no records" % chapter)
+        rows = group.records if "records" in group else chapter_index(group)
+        head = int(rows[chapter_first(group)]["offset"]) if len(rows) > chapter_first(group) else total
+        interval = chapter_interval(group)
+        factors = line_factors(group, max_adc) if volts else {}
+    exports = []
+    for fmt in formats:
+        if fmt == "npy":
+            exports.append((_NpyExport(output, chapter, total, interval), True))
+        elif fmt == "raw":
+            exports.append((_RawExport(output, chapter, total, interval), True))
+        elif fmt in ("parquet", "arrow"):
+            exports.append((_ArrowExport(output, chapter, total, interval, fmt == "parquet"), True))
+        elif fmt == "wav":
+            exports.append((_WavExport(output, chapter, total, interval), False))
+    names = []
+    try:
+        for start, result in read_blocks(filename, chapter, head, total, block, channels, modes, workers):
+            _export_write(exports, start, result, factors)
+    finally:
+        for export, convert in exports:
+            names += export.close()
+    return names
+
+
+def _export_write(exports, start, result, factors):
+    count, buffers = result
+    if count == 0 or buffers is None:
+        return
+    converted = buffers
+    if len(factors) > 0:
+        converted = {}
+        for line in buffers:
+            converted[line] = {}
+            for mode in buffers[line]:
+                if line in factors:
+                    converted[line][mode] = buffers[line][mode] * np.float32(factors[line])
+                else:
+                    converted[line][mode] = buffers[line][mode]
+    for export, convert in exports:
+        export.write(start, converted if convert else buffers)
+
+
+def compact_tape(filename, output, compression=None, chapters=None, block=4194304, workers=0):
+    """ Rewrites the tape into large contiguous chunks, as layout 2 chapters with the chosen codec
+
+    Chapter, channel and port attributes are copied, records table keeps the timestamps,
+    trigger positions and overflow flags of each source record. Records evicted by retention
+    are left out and offsets start from the oldest kept record. Layout 1 chapters written without
+    records table are indexed by their record groups. Sample counts are verified once the chapter
+    is written.
+    :param filename: source tape file name, the tape has to be closed
+    :type filename: str
+    :param output: compacted tape file name, overwritten if it exists
+    :type output: str
+    :param compression: compression options as taken by StreamingTape, None for the default filters
+    :type compression: dict, None
+    :param chapters: names of the chapters to compact, None for all
+    :type chapters: list, None
+    :param block: number of samples read at once
+    :type block: int
+    :param workers: number of processes reading and decompressing the source
+    :type workers: int
+    :returns: number of records and samples per chapter
+    :rtype: dict
+    :raises ValueError: on unsupported compression, unknown chapter, chapter without records or failed verification
+    """
+    filters, chunkshape = compression_filters(compression)
+    with tb.openFile(filename, mode="r") as source:
+        title = source.title
+        names = [node._v_name for node in source.iterNodes("/", classname="Group")]
+    if chapters is None:
+        chapters = names
+    for chapter in chapters:
+        if chapter not in names:
+            raise ValueError("Chapter %s not found" % chapter)
+    summary = {}
+    with tb.openFile(output, mode="w", title=title) as target:
+        for chapter in chapters:
+            summary[chapter] = _compact_chapter(filename, chapter, target, filters, chunkshape, block, workers)
+    return summary
+
+
+def _compact_chapter(filename, chapter, target, filters, chunkshape, block, workers):
+    with tb.openFile(filename, mode="r") as source:
+        group = source.getNode("/", chapter, "Group")
+        attrs, lines = _chapter_source(group)
+        rows = chapter_index(group)
+        triggers = chapter_triggers(group)
+        stats = chapter_summary(group)
+        first = chapter_first(group)
+        overview = "overview" in group
+    if rows is None:
+        raise ValueError("Chapter %s has neither records table nor record groups" % chapter)
+    rows = rows[first:]
+    if len(rows) == 0:
+        _create_chapter(target, chapter, attrs, {}, filters, chunkshape, 1)
+        return {"records": 0, "samples": 0}
+    start = int(rows["offset"][0])
+    end = int(rows["offset"][-1] + rows["samples"][-1])
+    dest, arrays = _create_chapter(target, chapter, attrs, lines, filters, chunkshape, max(end - start, 1))
+    blocks = read_blocks(filename, chapter, start, end, block, workers=workers)
+    try:
+        for offset, (count, buffers) in blocks:
+            for key in arrays:
+                arrays[key].append(buffers[key[0]][key[1]])
+    finally:
+        blocks.close()
+    table = _write_index(target, dest, rows, rows["offset"] - start)
+    if triggers is not None and len(triggers) > 0:
+        triggers["position"] -= start
+        triggers["record"] -= first
+        target.createTable(dest, "triggers", StreamingTapeTrigger, expectedrows=len(triggers)).append(triggers)
+    if stats is not None and len(stats) > 0:
+        stats["record"] -= first
+        target.createTable(dest, "summary", StreamingTapeSummary, expectedrows=len(stats)).append(stats)
+    if overview and start == 0:
+        with tb.openFile(filename, mode="r") as source:
+            source.getNode("/%s/overview" % chapter)._f_copy(newparent=dest, recursive=True)
+    target.flush()
+    for key, a in arrays.items():
+        if a.nrows != end - start:
+            raise ValueError("Chapter %s %s/%s holds %d samples instead of %d" %
+                             (chapter, line_node(key[0]), key[1], a.nrows, end - start))
+    if table.nrows != len(rows) or int(rows["samples"].sum()) != end - start:
+        raise ValueError("Chapter %s records do not match the source" % chapter)
+    return {"records": len(rows), "samples": end - start}
+
+
+def _chapter_source(group):
+    """ Chapter attributes and {line: (attributes, buffer names)} of the source chapter """
+    attrs = dict([(a, group._v_attrs[a]) for a in group._v_attrs._v_attrnamesuser
+                  if a not in ("layout", "first", "precondition")])
+    lines = {}
+    for line, node in chapter_lines(group).items():
+        lines[line] = (dict([(a, node._v_attrs[a]) for a in node._v_attrs._v_attrnamesuser if a != "codec"]),
+                       [a._v_name for a in group._v_file.listNodes(node, classname="Leaf")])
+    return attrs, lines
+
+
+def _create_chapter(target, chapter, attrs, lines, filters, chunkshape, expectedrows):
+    """ Creates layout 2 chapter in the target tape, returns the chapter group and {(line, mode): EArray} """
+    dest = target.createGroup("/", chapter)
+    for key, value in attrs.items():
+        dest._f_setAttr(key, value)
+    dest._f_setAttr("layout", 2)
+    arrays = {}
+    for line, (line_attrs, modes) in lines.items():
+        node = target.createGroup(dest, line_node(line))
+        for key, value in line_attrs.items():
+            node._f_setAttr(key, value)
+        for mode in modes:
+            arrays[(line, mode)] = target.createEArray(node, mode, atom=StreamingTape.atom, shape=(0, ),
+                                                       filters=filters,
+                                                       chunkshape=(chunkshape, ) if chunkshape else None,
+                                                       expectedrows=expectedrows)
+    return dest, arrays
+
+
+def _write_index(target, dest, rows, offsets):
+    """ Writes the records table of the layout 2 chapter from rows holding the records table columns,
+    samples are written restored so the shifts are not copied
+    """
+    table = target.createTable(dest, "records", StreamingTapeIndex, expectedrows=max(len(rows), 1))
+    copied = np.zeros(shape=(len(rows), ), dtype=table.dtype)
+    for name in table.colnames:
+        if name in rows.dtype.names and name != "shift":
+            copied[name] = rows[name]
+    copied["offset"] = offsets
+    table.append(copied)
+    return table
+
+
+def recover_tape(filename, output, journal=None, compression=None):
+    """ Salvages the records of the tape left unclosed by a crash into a new layout 2 tape
+
+    Records listed in the journal were flushed to the tape file before they were journaled,
+    so only those are read and the tape is not scanned. Without the journal the records
+    tables of the tape are trusted instead. Each record is read on its own, unreadable
+    ones are skipped and counted as torn, offsets of the recovered chapter are contiguous.
+    Records written after the last journal flush are not listed anywhere and are lost
+    without being counted, up to one journal cadence of records per chapter.
+    :param filename: damaged tape file name
+    :type filename: str
+    :param output: recovered tape file name, overwritten if it exists
+    :type output: str
+    :param journal: journal file name, None for the one kept next to the tape
+    :type journal: str, None
+    :param compression: compression options as taken by StreamingTape, None for the default filters
+    :type compression: dict, None
+    :returns: number of records and samples salvaged and of listed records found torn per chapter
+    :rtype: dict
+    :raises IOError: when the tape file cannot be opened at all
+    :raises ValueError: on unsupported compression or journal file
+    """
+    if journal is None:
+        journal = journal_name(filename)
+    entries = read_journal(journal) if os.path.isfile(journal) else None
+    filters, chunkshape = compression_filters(compression)
+    try:
+        source = tb.openFile(filename, mode="r")
+    except Exception as ex:
+        raise IOError("Tape %s cannot be opened: %s" % (filename, ex))
+    summary = {}
+    try:
+        if entries is not None:
+            chapters = []
+            for chapter in entries["chapter"]:
+                if chapter not in chapters:
+                    chapters.append(chapter)
+        else:
+            chapters = [node._v_name for node in source.iterNodes("/", classname="Group")]
+        with tb.openFile(output, mode="w", title=source.title) as target:
+            for chapter in chapters:
+                summary[chapter] = _recover_chapter(source, target, chapter,
+                                                    entries[entries["chapter"] == chapter]
+                                                    if entries is not None else None,
+                                                    filters, chunkshape)
+    finally:
+        source.close()
+    return summary
+
+
+def _recover_chapter(source, target, chapter, entries, filters, chunkshape):
+    summary = {"records": 0, "samples": 0, "torn": len(entries) if entries is not None else 0}
+    try:
+        group = source.getNode("/", chapter, "Group")
+        attrs, lines = _chapter_source(group)
+        layout = chapter_layout(group)
+        first = chapter_first(group)
+        if entries is None:
+            entries = _table_entries(group)
+    except Exception:
+        return summary
+    summary["torn"] = 0
+    dest, arrays = _create_chapter(target, chapter, attrs, lines, filters, chunkshape,
+                                   max(int(entries["samples"].sum()), 1))
+    kept = []
+    for entry in entries:
+        if layout == 1 and entry["index"] < first:
+            continue
+        try:
+            buffers = _salvage_record(group, layout, lines, entry)
+        except Exception:
+            summary["torn"] += 1
+            continue
+        for key in arrays:
+            arrays[key].append(buffers[key])
+        kept.append(entry)
+    rows = np.array(kept, dtype=journal_dtype)
+    _write_index(target, dest, rows, np.cumsum(rows["samples"], dtype=np.int64) - rows["samples"])
+    target.flush()
+    summary["records"] = len(rows)
+    summary["samples"] = int(rows["samples"].sum())
+    return summary
+
+
+def _table_entries(group):
+    """ Journal entries made of the chapter records table, for tapes without journal """
+    rows = group.records.read()
+    entries = np.zeros(shape=(len(rows), ), dtype=journal_dtype)
+    for name in rows.dtype.names:
+        entries[name] = rows[name]
+    entries["chapter"] = group._v_name
+    entries["index"] = np.arange(len(rows))
+    entries["row"] = np.arange(len(rows))
+    return entries
+
+
+def _salvage_record(group, layout, lines, entry):
+    """ Reads all buffers of the record, raises when any of them is missing or short """
+    samples = int(entry["samples"])
+    offset = int(entry["offset"])
+    degraded = int(entry["degraded"])
+    stages = chapter_precondition(group)
+    buffers = {}
+    if layout == 1:
+        record = group._f_get_child(StreamingTape.recfmt % entry["index"])
+    for line, (line_attrs, modes) in lines.items():
+        for mode in modes:
+            if layout == 1:
+                data = record._f_get_child(line_node(line))._f_get_child(mode)[:samples]
+            elif layout == 2:
+                data = group._f_get_child(line_node(line))._f_get_child(mode)[offset:(offset + samples)]
+            else:
+                node = group._f_get_child(line_node(line))
+                data = decode_chunk(node._f_get_child(mode)[entry["row"]], node._v_attrs["codec"])[:samples]
+            data = restore(data, stages, int(entry["shift"]))
+            if degraded > 0 and layout != 2:
+                data = expand_envelope(data, degraded, samples)
+            if len(data) != samples:
+                raise ValueError("Record %d of %s is incomplete" % (entry["index"], group._v_name))
+            buffers[(line, mode)] = data
+    return buffers
+
+
+class TapeSegments(object):
+    """ Closed files of the rolling tape read as one logical tape through its manifest
+
+    Record indexes and sample offsets are the ones of the whole chapter, counted across the files.
+    Files are opened read-only on first use, the one still written by the running tape is left out.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: tape file name the rolling tape was started with
+        :type filename: str
+        :raises ValueError: when the manifest is not found or broken
+        """
+        self._filename = filename
+        self._files = {}
+        self._segments = []
+        self.title = None
+        self.refresh()
+
+    def refresh(self):
+        """ Rereads the manifest, picking up the files closed since """
+        manifest = read_manifest(self._filename)
+        self.title = manifest.get("title")
+        self._segments = [s for s in manifest["segments"] if s["closed"]]
+
+    def chapters(self):
+        """ Names of the chapters in the closed files, in the order they were started """
+        names = []
+        for segment in self._segments:
+            names += sorted([c for c in segment["chapters"] if c not in names],
+                            key=lambda c: (segment["chapters"][c]["first"], c))
+        return names
+
+    def segments(self, chapter):
+        """ Parts of the chapter in the closed files
+        :returns: list of file name, first record, sample offset, number of records and samples
+        :rtype: list
+        """
+        directory = os.path.dirname(os.path.abspath(self._filename))
+        return [(os.path.join(directory, s["file"]), s["chapters"][chapter]["first"], s["chapters"][chapter]["offset"],
+                 s["chapters"][chapter]["records"], s["chapters"][chapter]["samples"])
+                for s in self._segments if chapter in s["chapters"]]
+
+    def _group(self, filename, chapter):
+        if filename not in self._files:
+            self._files[filename] = tb.openFile(filename, mode="r")
+        return self._files[filename].getNode("/", chapter, "Group")
+
+    def chapter_index(self, chapter):
+        """ Records table of the whole chapter, see psutils.chapter_index
+        :returns: rows with the offsets counted from the chapter start, None if the chapter is not found
+        :rtype: np.ndarray, None
+        """
+        parts = []
+        for filename, first, offset, records, samples in self.segments(chapter):
+            rows = chapter_index(self._group(filename, chapter))
+            if rows is not None:
+                rows["offset"] += offset
+                parts.append(rows)
+        return np.concatenate(parts) if len(parts) > 0 else None
+
+    def triggers(self, chapter):
+        """ Trigger events of the whole chapter, see psutils.chapter_triggers
+        :rtype: np.ndarray, None
+        """
+        parts = []
+        for filename, first, offset, records, samples in self.segments(chapter):
+            rows = chapter_triggers(self._group(filename, chapter))
+            if rows is not None:
+                rows["position"] += offset
+                rows["record"] += first
+                parts.append(rows)
+        return np.concatenate(parts) if len(parts) > 0 else None
+
+    def summary(self, chapter):
+        """ Per record statistics of the whole chapter, see psutils.chapter_summary
+        :rtype: np.ndarray, None
+        """
+        parts = []
+        for filename, first, offset, records, samples in self.segments(chapter):
+            rows = chapter_summary(self._group(filename, chapter))
+            if rows is not None:
+                rows["record"] += first
+                parts.append(rows)
+        return np.concatenate(parts) if len(parts) > 0 else None
+
+    def read_range(self, chapter, start, count, channels=None, modes=None):
+        """ Reads contiguous run of samples of the chapter, across the files, see psutils.read_segments_range
+        :returns: number of samples read and buffers as {line: {mode: np.array}}, (0, None) if out of chapter
+        :rtype: tuple(int, dict)
+        """
+        parts = [(offset, samples, lambda filename=filename: self._group(filename, chapter))
+                 for filename, first, offset, records, samples in self.segments(chapter)]
+        return read_segments_range(parts, start, count, channels, modes)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TapeReplay(object):
+    """ Virtual streaming device playing recorded tape chapter back into the loaded tape
+
+    Records are shaped as the ones PS5000Device._recording_cb hands to the tape, with the
+    stored interval, units, mode, ranges, trigger positions and overflow flags, paced after
+    the stored sampling interval. Offers the recording part of the device interface, so that
+    the whole streaming pipeline can run without an oscilloscope attached.
+    """
+
+    def __init__(self, filename, chapter, speed=1.0, loop=False):
+        """
+        :param filename: recorded tape file name, the tape has to be closed
+        :type filename: str
+        :param chapter: name of the chapter to replay
+        :type chapter: str
+        :param speed: pace relative to the recorded sampling rate, 1.0 for real time, 0 for as fast as possible
+        :type speed: float
+        :param loop: whether to start over once the end of the chapter is reached
+        :type loop: bool
+        :raises ValueError: when the chapter is not found or holds no records
+        """
+        with tb.openFile(filename, mode="r") as tape:
+            if "/%s" % chapter not in tape:
+                raise ValueError("Chapter %s not found" % chapter)
+            group = tape.getNode("/", chapter, "Group")
+            self._attrs = dict([(a, group._v_attrs[a]) for a in group._v_attrs._v_attrnamesuser])
+            self._lines = dict([(line, dict([(a, node._v_attrs[a]) for a in node._v_attrs._v_attrnamesuser
+                                             if a not in ("codec", "overflow")]))
+                                for line, node in chapter_lines(group).items()])
+            rows = chapter_index(group)
+            if rows is None or len(rows) <= chapter_first(group):
+                raise ValueError("Chapter %s holds no records" % chapter)
+            self._rows = rows[chapter_first(group):]
+            self._interval = chapter_interval(group)
+        self._filename = filename
+        self._chapter = chapter
+        self._speed = speed
+        self._loop = loop
+        self._tape = None
+        self._records = None
+        self._stats = {"records": 0, "samples": 0, "elapsed": 0.0, "lag": 0.0}
+        self._recording_lock = th.Lock()
+        self._recording_event = th.Event()
+        self._recording_thread = None
+        self.last_error = None
+
+    def load_tape(self, tape):
+        """ Loads/sets which streaming tape to use
+        :param tape: tape object, fan-out of several tapes, network publisher or any sink with record
+                     and is_processing, see psutils.tape_sink
+        :type tape: StreamingTape, StreamingTapeFanout, StreamingTapePublisher
+        :returns: status of the call
+        :rtype int
+        """
+        if self._tape is not None:
+            self.eject_tape()
+        if tape_sink(tape):
+            self._tape = tape
+            return pico_num("PICO_OK")
+        else:
+            return pico_num("PICO_INVALID_PARAMETER")
+
+    def eject_tape(self):
+        """ Removes tape reference
+        :returns: PICO_OK
+        :rtype: int
+        """
+        self._tape = None
+        self._records = None
+        return pico_num("PICO_OK")
+
+    def start_recording(self, interval=None, units=None, mode=None, downsample=None, memlength=0, limit=0,
+                        chapter=None):
+        """ Starts replaying the chapter to the tape
+        :param interval: ignored, the stored interval is used
+        :param units: ignored, the stored units are used
+        :param mode: ignored, the stored data reduction mode is used
+        :param downsample: ignored, the stored downsample ratio is used
+        :param memlength: number of samples in each record, 0 for the longest stored record
+        :type memlength: int
+        :param limit: number of samples at which the replay stops with final record, 0 to replay until stopped
+        :type limit: int
+        :param chapter: chapter name for the records, None for the replayed chapter name
+        :type chapter: string, None
+        :returns: status of the call
+        :rtype: int
+        """
+        if self._tape is None:
+            return pico_num("PICO_BUFFERS_NOT_SET")
+        if self.is_recording():
+            return pico_num("PICO_BUSY")
+        with self._recording_lock:
+            rec = StreamingTapeRecording()
+            for key in ("device", "serial", "maxAdc", "interval", "units", "mode", "downsample", "triggerSet",
+                        "triggerSource", "triggerThreshold", "triggerDirection"):
+                if key in self._attrs:
+                    rec[key] = self._attrs[key]
+            rec.modes = ratio_modes(int(rec.mode) if "mode" in rec else 0)
+            rec.chapter = chapter if chapter is not None else self._chapter
+            rec.enabled = len(self._lines)
+            rec.bufflen = memlength if memlength > 0 else int(self._rows["samples"].max())
+            if limit > 0:
+                rec.bufflen = min(rec.bufflen, limit)
+                rec.final = False
+            rec.max_samples = limit if limit > 0 else rec.bufflen
+            if "triggerSet" in rec and rec.triggerSet:
+                rec.triggered = False
+            else:
+                rec.triggerSet = False
+            rec.buffers = {}
+            with tb.openFile(self._filename, mode="r") as tape:
+                for line, group in chapter_lines(tape.getNode("/", self._chapter, "Group")).items():
+                    rec.buffers[line] = dict(self._lines[line])
+                    for a in tape.listNodes(group, classname="Leaf"):
+                        rec.buffers[line][a._v_name] = np.empty(shape=(rec.bufflen, ), dtype=np.int16)
+            self._records = rec
+            self._stats = {"records": 0, "samples": 0, "elapsed": 0.0, "lag": 0.0}
+            self._recording_event.clear()
+            self._recording_thread = th.Thread(target=self._recording_worker, args=(limit, ))
+            self._recording_thread.start()
+        return pico_num("PICO_OK")
+
+    def stop_recording(self):
+        """ Stops the replay
+        :returns: status of the call
+        :rtype: int
+        """
+        if self._recording_thread is None or not self._recording_thread.is_alive():
+            return pico_num("PICO_NOT_USED_IN_THIS_CAPTURE_MODE")
+        self._recording_event.set()
+        self._recording_thread.join()
+        self._recording_thread = None
+        return pico_num("PICO_OK")
+
+    def is_recording(self):
+        return self._recording_thread is not None and self._recording_thread.is_alive()
+
+    def wait2finish(self, timeout=None):
+        """ Waits for the replay to reach the end of the chapter or the limit
+        :returns: whether the replay is over
+        :rtype: bool
+        """
+        if self._recording_thread is not None:
+            self._recording_thread.join(timeout)
+        return not self.is_recording()
+
+    def replay_stats(self):
+        """ Records and samples replayed, elapsed time and the worst lag behind the schedule in seconds """
+        return dict(self._stats)
+
+    def _recording_worker(self, limit):
+        """ Reads the chapter block by block and hands the records to the tape on schedule """
+        rec = self._records
+        offsets = self._rows["offset"]
+        first = int(offsets[0])
+        end = int(offsets[-1] + self._rows["samples"][-1])
+        pace = self._interval / self._speed if self._speed > 0 and self._interval else 0.0
+        try:
+            with tb.openFile(self._filename, mode="r") as tape:
+                group = tape.getNode("/", self._chapter, "Group")
+                offset = first
+                played = 0
+                start = time()
+                while not self._recording_event.is_set():
+                    if offset >= end:
+                        if not self._loop:
+                            break
+                        offset = first
+                    count = min(rec.bufflen, end - offset)
+                    if limit > 0:
+                        count = min(count, limit - played)
+                    count, buffers = read_chapter_range(group, offset, count)
+                    if count == 0:
+                        break
+                    self._fill(rec, offset, count, buffers)
+                    played += count
+                    offset += count
+                    if pace > 0:
+                        due = start + played * pace - time()
+                        if due > 0 and self._recording_event.wait(due):
+                            break
+                        self._stats["lag"] = max(self._stats["lag"], -due)
+                    rec.timestamp = time()
+                    if limit > 0 and played >= limit:
+                        rec.final = True
+                    if self._tape is None or not self._tape.is_processing():
+                        break
+                    self._tape.record(rec)
+                    self._stats["records"] += 1
+                    self._stats["samples"] += count
+                    if limit > 0 and played >= limit:
+                        break
+                self._stats["elapsed"] = time() - start
+            if self._tape is not None:
+                self._tape.record(None)
+        except Exception as ex:
+            self.last_error = ex.message
+            print "Replay Worker:", self.last_error, type(ex)
+
+    def _fill(self, rec, offset, count, buffers):
+        """ Copies the samples into the record buffers and sets the callback fields for the block """
+        rec.samples = count
+        rec.start = 0
+        lo = np.searchsorted(self._rows["offset"], offset, side="right") - 1
+        hi = np.searchsorted(self._rows["offset"], offset + count, side="left")
+        rows = self._rows[max(lo, 0):hi]
+        overflow = int(np.bitwise_or.reduce(rows["overflow"])) if len(rows) > 0 else 0
+        for line in rec.buffers:
+            rec.buffers[line]["overflow"] = (overflow & line_bit(line)) > 0
+            for mode in buffers[line]:
+                rec.buffers[line][mode][:count] = buffers[line][mode]
+        if rec.triggerSet:
+            rec.triggered = False
+            rec.triggerAt = -1
+            for row in rows[rows["triggered"]]:
+                at = int(row["offset"] + row["triggerAt"]) - offset
+                if 0 <= at < count:
+                    rec.triggered = True
+                    rec.triggerAt = at
+                    break